@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import CustomUser
+from .models import CustomUser, OutgoingEmail
 
 # Register your models here.
 admin.site.register(CustomUser)
+admin.site.register(OutgoingEmail)
@@ -0,0 +1,73 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth import aauthenticate
+from django.http import Http404
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from spotechnify_server.admission import AUTH_THROTTLES, apassword_hashing
+from spotechnify_server.async_api import api_response, async_api_view, request_data
+from spotechnify_server.settings import EMAIL_HOST_USER
+from .models import CustomUser, OutgoingEmail, Verification
+from .serializers import UserSerializer, UserLoginSerializer, ForgotPasswordSerializer
+from .views import get_jwt_token, get_random_password, get_verification_email, get_new_password_email
+
+# async versions of the login, verification check, resend verification and forgot password views (see views.py)
+# password hashing runs in a worker thread, so it does not block the event loop
+
+
+@async_api_view(['POST'], authenticated=False, throttles=AUTH_THROTTLES)
+async def jwt_token_obtain(request):
+    """async version of JwtTokenObtainView
+    """
+    serializer = UserLoginSerializer(data=request_data(request))
+    serializer.is_valid(raise_exception=True)
+    async with apassword_hashing():
+        user = await aauthenticate(
+            username=serializer.validated_data['username'],
+            password=serializer.validated_data['password']
+        )
+    if user is None:
+        raise AuthenticationFailed(detail="Username or Password (or both) is incorrect")
+    token = get_jwt_token(user=user)
+    serializer = UserSerializer(instance=user, context={"request": request})
+    data = {
+        "refresh": str(token),
+        "access": str(token.access_token),
+        "user": serializer.data
+    }
+    return api_response(data)
+
+
+@async_api_view(['GET'])
+async def user_verification_check(request):
+    """async version of UserVerificationCheckAPIView, answered from the token claims only
+    """
+    return api_response({"email_verified": request.user.is_email_verified})
+
+
+@async_api_view(['GET'])
+async def resend_verification(request):
+    """async version of ResendVerification
+    """
+    user = await CustomUser.objects.aget(pk=request.user.pk)
+    verification = await sync_to_async(Verification.get_or_create_for_user)(user=user)
+    subject, message = get_verification_email(user, verification)
+    await OutgoingEmail.aenqueue(subject, message, EMAIL_HOST_USER, [user.email])
+    return api_response({"message": "Verification Code Sent."})
+
+
+@async_api_view(['POST'], authenticated=False, throttles=AUTH_THROTTLES)
+async def forgot_password(request):
+    """async version of ForgotPassword
+    """
+    serializer = ForgotPasswordSerializer(data=request_data(request))
+    serializer.is_valid(raise_exception=True)
+    user = await CustomUser.objects.filter(email=serializer.validated_data['email']).afirst()
+    if user is None:
+        raise Http404("No CustomUser matches the given query.")
+    new_password = get_random_password()
+    async with apassword_hashing():
+        await sync_to_async(user.set_password)(new_password)
+    await user.asave()
+    subject, message = get_new_password_email(user, new_password)
+    await OutgoingEmail.aenqueue(subject, message, EMAIL_HOST_USER, [user.email])
+    return api_response({"message": "New password sent"}, status.HTTP_201_CREATED)
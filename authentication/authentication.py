@@ -0,0 +1,108 @@
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from authentication.models import CustomUser
+
+
+class ClaimsUser(TokenUser):
+    """user built from the claims of a validated access token, so authenticating a request needs no query
+       id and is_email_verified come from the token, any other attribute (email, is_active, is_staff, ...)
+       is read from the CustomUser cached by CustomUser.get_cached (a database query on a cache miss)
+
+       it is read-only, views that modify the user must load it with load_user
+    """
+
+    @cached_property
+    def is_email_verified(self) -> bool:
+        return self.token.get("email_verified", False)
+
+    @cached_property
+    def instance(self) -> CustomUser:
+        """the full user model, from the user cache or the database
+        """
+        return CustomUser.get_cached(self.id)
+
+    @cached_property
+    def username(self) -> str:
+        return self.instance.username
+
+    @cached_property
+    def is_active(self) -> bool:
+        return self.instance.is_active
+
+    @cached_property
+    def is_staff(self) -> bool:
+        return self.instance.is_staff
+
+    @cached_property
+    def is_superuser(self) -> bool:
+        return self.instance.is_superuser
+
+    def __str__(self) -> str:
+        return self.username
+
+    def __getattr__(self, attr: str):
+        if attr.startswith('__') or attr == 'token':
+            raise AttributeError(attr)
+        return getattr(self.instance, attr)
+
+
+class ClaimsUserAuthentication(JWTStatelessUserAuthentication):
+    """JWTStatelessUserAuthentication that also rejects the tokens of deleted and inactive users
+       is_active is read from the user cache (CustomUser.get_cached), which saving the user clears,
+       so a deactivated user is locked out at once instead of when the token expires,
+       and authenticating still needs no query while the user is cached
+    """
+
+    def get_user(self, validated_token) -> ClaimsUser:
+        user = super().get_user(validated_token)
+        try:
+            instance = CustomUser.get_cached(user.pk)
+        except CustomUser.DoesNotExist:
+            instance = None
+        return self.check_active(user, instance)
+
+    async def aauthenticate(self, request):
+        """same as authenticate, for async views (the user cache and the database are read without blocking)
+        """
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        user = super().get_user(validated_token)
+        try:
+            instance = await CustomUser.aget_cached(user.pk)
+        except CustomUser.DoesNotExist:
+            instance = None
+        return self.check_active(user, instance), validated_token
+
+    @staticmethod
+    def check_active(user: ClaimsUser, instance: CustomUser) -> ClaimsUser:
+        """raises AuthenticationFailed (401) if the user was deleted (instance is None) or is inactive
+        """
+        if instance is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if not instance.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        user.instance = instance
+        return user
+
+
+def load_user(user) -> CustomUser:
+    """returns the CustomUser model of the request user, loaded from the database if it is a ClaimsUser
+       use it before modifying and saving the user
+
+    Args:
+        user (CustomUser | ClaimsUser): the request user
+
+    Returns:
+        CustomUser: the user model instance
+    """
+    if isinstance(user, ClaimsUser):
+        return CustomUser.objects.get(pk=user.pk)
+    return user
@@ -0,0 +1,79 @@
+import time
+from datetime import timedelta
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from authentication.models import OutgoingEmail
+
+
+class Command(BaseCommand):
+    help = "Sends the queued emails (OutgoingEmail) over one reused SMTP connection, retrying failures with backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="send the emails that are due and exit, instead of polling forever")
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help="seconds to wait when no email is due")
+        parser.add_argument('--max-attempts', type=int, default=5,
+                            help="an email is marked failed after this many attempts")
+        parser.add_argument('--backoff', type=float, default=30.0,
+                            help="seconds before the first retry, doubled after every failed attempt")
+
+    def handle(self, *args, **options):
+        connection = get_connection()
+        try:
+            while True:
+                sent, failed = self.send_batch(connection, options)
+                if sent or failed:
+                    self.stdout.write(f"sent: {sent}, failed: {failed}")
+                if options['once'] and not (sent or failed):
+                    break
+                if not (sent or failed):
+                    connection.close()  # do not keep an idle SMTP connection open
+                    time.sleep(options['interval'])
+        finally:
+            connection.close()
+
+    def send_batch(self, connection, options):
+        """sends one batch of due emails, rows are locked with SKIP LOCKED so several workers can run
+
+        Returns:
+            tuple: (number of sent emails, number of failed attempts)
+        """
+        sent = failed = 0
+        with transaction.atomic():
+            emails = list(
+                OutgoingEmail.objects.select_for_update(skip_locked=True)
+                .filter(status=OutgoingEmail.PENDING, next_attempt_at__lte=timezone.now())
+                .order_by('next_attempt_at')[:options['batch_size']]
+            )
+            if not emails:
+                return sent, failed
+            for email in emails:
+                try:
+                    connection.open()  # no-op if the connection is already open
+                    EmailMessage(email.subject, email.message, email.from_email, email.recipients,
+                                 connection=connection).send()
+                except Exception as e:
+                    # the connection may be broken, it is reopened for the next email
+                    connection.close()
+                    email.attempts += 1
+                    email.last_error = str(e)
+                    if email.attempts >= options['max_attempts']:
+                        email.status = OutgoingEmail.FAILED
+                    else:
+                        delay = options['backoff'] * 2 ** (email.attempts - 1)
+                        email.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+                    failed += 1
+                else:
+                    email.status = OutgoingEmail.SENT
+                    email.sent_at = timezone.now()
+                    email.message = ""
+                    email.attempts += 1
+                    sent += 1
+            OutgoingEmail.objects.bulk_update(
+                emails, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at', 'message']
+            )
+        return sent, failed
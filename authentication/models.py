@@ -1,6 +1,11 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.utils.crypto import get_random_string
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from spotechnify_server.images import current_variants
 
 class CustomUser(AbstractUser):
     """ custom model for user
@@ -9,9 +14,59 @@ class CustomUser(AbstractUser):
     is_email_verified = models.BooleanField(default=False)
     email_verification_datetime = models.DateTimeField(default=None, null=True)
     profile_image = models.ImageField(upload_to='profile_images', default=None, null=True)
+    # resized copies of profile_image, built in the background by the build_image_variants command
+    profile_image_variants = models.JSONField(null=True, default=None, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    CACHE_KEY = "user:{user_id}"
+
+    def save(self, *args, **kwargs):
+        """saves the user and drops it from the user cache once the transaction commits
+           the profile image variants are reset if the profile image changed, so they are built again
+        """
+        self.profile_image_variants = current_variants(self.profile_image, self.profile_image_variants)
+        super().save(*args, **kwargs)
+        key = CustomUser.CACHE_KEY.format(user_id=self.pk)
+        transaction.on_commit(lambda: cache.delete(key))
+
+    def delete(self, *args, **kwargs):
+        """deletes the user and drops it from the user cache once the transaction commits
+        """
+        key = CustomUser.CACHE_KEY.format(user_id=self.pk)
+        result = super().delete(*args, **kwargs)
+        transaction.on_commit(lambda: cache.delete(key))
+        return result
+
+    @staticmethod
+    def get_cached(user_id: int):
+        """returns the user with the given id from the cache, or from the database if it is not cached
+           the cached user is kept for USER_CACHE_TIMEOUT seconds and is only meant for reading
+
+        Args:
+            user_id (int): id of the user
+
+        Returns:
+            CustomUser: the user
+        """
+        key = CustomUser.CACHE_KEY.format(user_id=user_id)
+        user = cache.get(key)
+        if user is None:
+            user = CustomUser.objects.get(pk=user_id)
+            cache.set(key, user, settings.USER_CACHE_TIMEOUT)
+        return user
+
+    @staticmethod
+    async def aget_cached(user_id: int):
+        """same as get_cached, for async views
+        """
+        key = CustomUser.CACHE_KEY.format(user_id=user_id)
+        user = await cache.aget(key)
+        if user is None:
+            user = await CustomUser.objects.aget(pk=user_id)
+            await cache.aset(key, user, settings.USER_CACHE_TIMEOUT)
+        return user
+
     def __str__(self):
         return self.username
 
@@ -44,4 +99,68 @@ class Verification(models.Model):
             return Verification.objects.create(code=get_random_string(length=Verification.CODE_LENGTH, allowed_chars='1234567890'), user=user)
 
     def __str__(self) -> str:
-        return f"user: {self.user.username}"
\ No newline at end of file
+        return f"user: {self.user.username}"
+
+
+class OutgoingEmail(models.Model):
+    """an email queued by a view and sent later by the send_queued_emails worker,
+       so requests do not wait for the SMTP server
+       the body is cleared after sending, because it may contain a password
+    """
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+    ]
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    from_email = models.CharField(max_length=254, default=None, null=True)
+    recipients = models.JSONField(default=list)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(default=None, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"], name="outgoing_email_due_idx"),
+        ]
+
+    @staticmethod
+    def enqueue(subject: str, message: str, from_email: str, recipient_list: list):
+        """queues an email, it is sent by the send_queued_emails worker
+
+        Args:
+            subject (str): subject of the email
+            message (str): body of the email
+            from_email (str): sender address
+            recipient_list (list): recipient addresses
+
+        Returns:
+            OutgoingEmail: the queued email
+        """
+        return OutgoingEmail.objects.create(
+            subject=subject,
+            message=message,
+            from_email=from_email,
+            recipients=list(recipient_list)
+        )
+
+    @staticmethod
+    async def aenqueue(subject: str, message: str, from_email: str, recipient_list: list):
+        """same as enqueue, for async views
+        """
+        return await OutgoingEmail.objects.acreate(
+            subject=subject,
+            message=message,
+            from_email=from_email,
+            recipients=list(recipient_list)
+        )
+
+    def __str__(self) -> str:
+        return f"{self.subject} -> {', '.join(self.recipients)} ({self.status})"
@@ -5,10 +5,12 @@ from rest_framework_simplejwt.tokens import Token
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from authentication.models import CustomUser
 import base64
+from spotechnify_server.images import ImageVariantsField
 
 class UserSerializer(serializers.ModelSerializer):
     """ModelSerializer for User model
     """
+    profile_image_variants = ImageVariantsField('profile_image', 'profile_image_variants')
 
     class Meta:
         model = get_user_model()
@@ -22,6 +24,7 @@ class UserSerializer(serializers.ModelSerializer):
             "email",
             "is_email_verified",
             "profile_image",
+            "profile_image_variants",
             "created_at",
             "updated_at"
         )
@@ -1,3 +1,173 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+from smtplib import SMTPServerDisconnected
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from authentication.models import CustomUser, OutgoingEmail
 
-# Create your tests here.
+
+class FailingEmailBackend(BaseEmailBackend):
+    """an SMTP server that drops every message
+    """
+
+    def send_messages(self, email_messages):
+        raise SMTPServerDisconnected("Connection unexpectedly closed")
+
+
+class ClaimsUserAuthenticationTest(TestCase):
+    """the JWT of a user stops working as soon as the user is deactivated or deleted,
+       while an active cached user is authenticated without a query
+    """
+    urls = ('authentication:check_verified', 'authentication:async_check_verified')
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username="listener", email="listener@example.com",
+                                                   password="a-long-password")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+
+    def test_active_user(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(reverse(url)).status_code, 200)
+
+    def test_cached_user_needs_no_query(self):
+        self.client.get(reverse(self.urls[0]))
+        for url in self.urls:
+            with self.subTest(url=url), self.assertNumQueries(0):
+                self.assertEqual(self.client.get(reverse(url)).status_code, 200)
+
+    def test_deactivated_user(self):
+        self.client.get(reverse(self.urls[0]))  # cached while active
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(reverse(url))
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(response.json()["code"], "user_inactive")
+
+    def test_deleted_user(self):
+        self.client.get(reverse(self.urls[0]))  # cached while it exists
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(reverse(url))
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(response.json()["code"], "user_not_found")
+
+
+class SendQueuedEmailsTest(TestCase):
+    """the views only queue emails, the send_queued_emails worker sends them (the test runner uses the locmem backend)
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def enqueue(self, count: int = 1) -> list:
+        return [OutgoingEmail.enqueue(f"Subject {n}", f"Message {n}", "server@example.com", [f"user{n}@example.com"])
+                for n in range(count)]
+
+    def send(self, *args) -> None:
+        call_command('send_queued_emails', '--once', *args, stdout=StringIO())
+
+    def test_view_only_queues(self):
+        CustomUser.objects.create_user(username="listener", email="listener@example.com", password="a-long-password")
+        response = APIClient().post(reverse('authentication:forgot_password'), {"email": "listener@example.com"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(mail.outbox, [])
+        email = OutgoingEmail.objects.get()
+        self.assertEqual((email.recipients, email.status), (["listener@example.com"], OutgoingEmail.PENDING))
+
+    def test_delivery(self):
+        self.enqueue(3)
+        self.send()
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ["user0@example.com", "user1@example.com", "user2@example.com"])
+        self.assertEqual(mail.outbox[0].subject, "Subject 0")
+        for email in OutgoingEmail.objects.all():
+            self.assertEqual((email.status, email.attempts, email.message), (OutgoingEmail.SENT, 1, ""))
+            self.assertIsNotNone(email.sent_at)
+        # sent emails are not sent again
+        self.send()
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_emails_not_due_are_not_sent(self):
+        email, = self.enqueue()
+        OutgoingEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now() + timedelta(minutes=1))
+        self.send()
+        self.assertEqual(mail.outbox, [])
+
+    @override_settings(EMAIL_BACKEND='authentication.tests.FailingEmailBackend')
+    def test_backoff(self):
+        email, = self.enqueue()
+        for attempt, delay in ((1, 10), (2, 20), (3, 40)):
+            started = timezone.now()
+            self.send('--backoff', '10')
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts), (OutgoingEmail.PENDING, attempt))
+            self.assertEqual(email.last_error, "Connection unexpectedly closed")
+            self.assertGreaterEqual(email.next_attempt_at, started + timedelta(seconds=delay))
+            self.assertLess(email.next_attempt_at, timezone.now() + timedelta(seconds=delay))
+            # the next attempt waits for the backoff
+            self.send('--backoff', '10')
+            email.refresh_from_db()
+            self.assertEqual(email.attempts, attempt)
+            OutgoingEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+
+    @override_settings(EMAIL_BACKEND='authentication.tests.FailingEmailBackend')
+    def test_max_attempts(self):
+        email, = self.enqueue()
+        # without backoff the email is retried at once until it fails for good
+        self.send('--backoff', '0', '--max-attempts', '3')
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.FAILED, 3))
+        self.assertEqual(email.message, "Message 0")
+        with self.settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+            self.send()
+        self.assertEqual(mail.outbox, [])
+
+
+@override_settings(THROTTLE_BUCKETS={'ip': (3, 60), 'credential': (100, 300)})
+class AuthThrottleTest(TestCase):
+    urls = ('authentication:forgot_password', 'authentication:async_forgot_password')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def post(self, url: str, n: int, forwarded_for: str):
+        return self.client.post(reverse(url), {"email": f"user{n}@example.com"}, format='json',
+                                headers={"X-Forwarded-For": forwarded_for})
+
+    def test_forwarded_for_is_not_trusted(self):
+        for url in self.urls:
+            cache.clear()
+            with self.subTest(url=url):
+                statuses = [self.post(url, n, f"10.0.0.{n}").status_code for n in range(4)]
+                self.assertNotIn(429, statuses[:3])
+                self.assertEqual(statuses[3], 429)
+
+    def test_forwarded_for_of_the_proxies(self):
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}):
+            for url in self.urls:
+                with self.subTest(url=url):
+                    statuses = [self.post(url, n, f"10.0.0.{n}").status_code for n in range(4)]
+                    self.assertNotIn(429, statuses)
+
+    def test_body_that_is_not_an_object(self):
+        for url in self.urls + ('authentication:token_obtain_pair', 'authentication:async_token_obtain_pair'):
+            cache.clear()
+            with self.subTest(url=url):
+                self.assertEqual(self.client.post(reverse(url), [1, 2], format='json').status_code, 400)
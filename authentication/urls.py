@@ -1,6 +1,6 @@
 from django.urls import path
 from rest_framework.authtoken.views import obtain_auth_token
-from authentication import views
+from authentication import views, async_views
 from rest_framework.authtoken.views import obtain_auth_token
 from rest_framework_simplejwt.views import(
     TokenObtainPairView,
@@ -51,4 +51,21 @@ urlpatterns = [
     path('change-password/',
          views.ChangePassword.as_view(),
          name='change_password'),
+
+    # async versions, for serving under ASGI
+    path('async/jwt-token/',
+         async_views.jwt_token_obtain,
+         name='async_token_obtain_pair'),
+
+    path('async/check-verified/',
+         async_views.user_verification_check,
+         name='async_check_verified'),
+
+    path('async/resend-verification/',
+         async_views.resend_verification,
+         name='async_resend_verification'),
+
+    path('async/forgot-password/',
+         async_views.forgot_password,
+         name='async_forgot_password'),
 ]
\ No newline at end of file
@@ -2,7 +2,6 @@ import uuid
 from django.shortcuts import render
 from django.contrib.auth import authenticate
 from django.utils import timezone
-from django.core.mail import send_mail
 from django.core.mail import EmailMessage
 from spotechnify_server.settings import EMAIL_HOST_USER
 from rest_framework import views, status
@@ -26,8 +25,11 @@ from .serializers import (UserSerializer,
                           ForgotPasswordSerializer)
 from authentication.models import (
     Verification,
-    CustomUser
+    CustomUser,
+    OutgoingEmail
 )
+from authentication.authentication import load_user
+from spotechnify_server.admission import AUTH_THROTTLES, password_hashing
 
 def get_jwt_token(user: CustomUser) -> RefreshToken:
     """creates a token for user and sets the "email_verified" attribute for user and returns it
@@ -59,9 +61,50 @@ def get_random_password() -> str:
     password = password.replace("-", "")
     return password
 
+def get_verification_email(user: CustomUser, verification: Verification) -> tuple:
+    """builds the email containing the verification code
+
+    Args:
+        user (CustomUser): the user the email is sent to
+        verification (Verification): the verification code of the user
+
+    Returns:
+        tuple: (subject, message)
+    """
+    subject = "Spotify Verification Code"
+    message = f"""
+Dear user
+Welcome to Spotechnify
+{user.username}
+Verification Code:
+{verification.code}
+"""
+    return subject, message
+
+def get_new_password_email(user: CustomUser, new_password: str) -> tuple:
+    """builds the email containing the new password of a user who forgot his/her password
+
+    Args:
+        user (CustomUser): the user the email is sent to
+        new_password (str): the new password
+
+    Returns:
+        tuple: (subject, message)
+    """
+    subject = "Spotechnify New Password"
+    message = f"""
+Dear user
+Welcome to Spotechnify
+{user.username}
+Your new password:
+{new_password}
+"""
+    return subject, message
+
 class SignUpView(views.APIView):
     """signs up the user sending the request
     """
+    throttle_classes = AUTH_THROTTLES
 
     def post(self, request: Request) ->Response:
         """if request method is POST, this method is called
@@ -76,7 +119,8 @@ class SignUpView(views.APIView):
         """
         serializer = UserSerializer(data=self.request.data)
         serializer.is_valid(raise_exception=True)
-        user = serializer.save()
+        with password_hashing():
+            user = serializer.save()
 #         verification = Verification.get_or_create_for_user(user=user)
 #         subject = "Spotechnify Email Verification"
 #         message = f"""
@@ -106,6 +150,7 @@ class SignUpView(views.APIView):
 class JwtTokenObtainView(views.APIView):
     """user can login via this view, to get a new token
     """
+    throttle_classes = AUTH_THROTTLES
 
     def post(self, request):
         """if request method is POST, this method is called
@@ -122,7 +167,8 @@ class JwtTokenObtainView(views.APIView):
         serializer.is_valid(raise_exception=True)
         username = serializer.validated_data['username']
         password = serializer.validated_data['password']
-        user = authenticate(username=username, password=password, )
+        with password_hashing():
+            user = authenticate(username=username, password=password, )
         if user is None:
             detail = "Username or Password (or both) is incorrect"
             raise AuthenticationFailed(detail=detail)
@@ -150,21 +196,11 @@ class ResendVerification(views.APIView):
         Returns:
             Response: response that is sent to user, containing success/fail message
         """
-        user = self.request.user
+        user = load_user(self.request.user)
         verification = Verification.get_or_create_for_user(user=user)
-        subject = "Spotify Verification Code"
-        message = f"""
-Dear user
-Welcome to Spotechnify
-{user.username}
-Verification Code:
-{verification.code}
-"""
+        subject, message = get_verification_email(user, verification)
         recipient_list = [user.email]
-        try:
-            send_mail(subject, message, EMAIL_HOST_USER, recipient_list, fail_silently=False)
-        except Exception as e:
-            return Response({"message": "There was an internal problem"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        OutgoingEmail.enqueue(subject, message, EMAIL_HOST_USER, recipient_list)
         return Response({"message": "Verification Code Sent."}, status=status.HTTP_200_OK)
 
 class Verify(views.APIView):
@@ -181,7 +217,7 @@ class Verify(views.APIView):
         Returns:
             Response: the response sent to user, containing success/fail message and tokens
         """
-        user = self.request.user
+        user = load_user(self.request.user)
         if user.is_email_verified:
             return Response({"message": f"Email of user {user.username} is already verified"}, status=status.HTTP_400_BAD_REQUEST)
         serializer = VerificationSerializer(data=self.request.data)
@@ -219,6 +255,7 @@ class UserVerificationCheckAPIView(views.APIView):
 class ForgotPassword(views.APIView):
     """if user forgot his/her password, sends his/her email to this view to receive a new password in his/her email
     """
+    throttle_classes = AUTH_THROTTLES
 
     def post(self, request: Request) -> Response:
         """if user sends request with POST method, this method is called
@@ -234,24 +271,19 @@ class ForgotPassword(views.APIView):
         serializer.is_valid(raise_exception=True)
         user = get_object_or_404(get_user_model(), email=serializer.validated_data['email'])
         new_password = get_random_password()
-        user.set_password(new_password)
+        with password_hashing():
+            user.set_password(new_password)
         user.save()
-        subject = "Spotechnify New Password"
-        message = f"""
-Dear user
-Welcome to Spotechnify
-{user.username}
-Your new password:
-{new_password}
-"""
+        subject, message = get_new_password_email(user, new_password)
         recipient_list = [user.email]
-        send_mail(subject, message, EMAIL_HOST_USER, recipient_list, fail_silently=True)
+        OutgoingEmail.enqueue(subject, message, EMAIL_HOST_USER, recipient_list)
         return Response({"message": "New password sent"}, status=status.HTTP_201_CREATED)
 
 class ChangePassword(views.APIView):
     """changes the user's password (while user is logged in)
     """
     permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = AUTH_THROTTLES
 
     def post(self, request: Request) -> Response:
         """if user sends request with POST method, this method is called
@@ -264,12 +296,13 @@ class ChangePassword(views.APIView):
         Returns:
             Response: the response
         """
-        user = self.request.user
+        user = load_user(self.request.user)
         serializer = ChangePasswordSerializer(data=self.request.data)
         serializer.is_valid(raise_exception=True)
-        if not user.check_password(serializer.validated_data['old_password']):
-            return Response({"error": "Wrong Password"}, status=status.HTTP_400_BAD_REQUEST)
-        user.set_password(serializer.validated_data['new_password'])
+        with password_hashing():
+            if not user.check_password(serializer.validated_data['old_password']):
+                return Response({"error": "Wrong Password"}, status=status.HTTP_400_BAD_REQUEST)
+            user.set_password(serializer.validated_data['new_password'])
         user.save()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -1,6 +1,8 @@
 from django.contrib import admin
-from .models import Song, Like
+from .models import Song, Like, GenrePopularity, SongUpload
 # Register your models here.
 
 admin.site.register(Song)
-admin.site.register(Like)
\ No newline at end of file
+admin.site.register(Like)
+admin.site.register(GenrePopularity)
+admin.site.register(SongUpload)
@@ -0,0 +1,134 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import QuerySet
+from django.http import Http404
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from spotechnify_server import db_router
+from spotechnify_server.async_api import api_response, async_api_view, request_data
+from spotechnify_server.renderers import FastJSONRenderer
+from django.utils.cache import patch_cache_control
+from .models import Song, Like
+from . import conditional
+from .pagination import SongKeysetPagination
+from .serializers import SongSerializer, FastSongListSerializer, LikeBatchSerializer
+
+# async versions of the song list, search and like/unlike views (see views.py),
+# for serving under ASGI without holding a thread per request while waiting for the database
+
+
+async def song_list_response(request, queryset: QuerySet, liked_song_ids: set = None):
+    """evaluates the queryset with the async ORM (a page of it if the client asked for one) and serializes it
+    """
+    drf_request = Request(request)
+    context = {'request': drf_request, 'liked_song_ids': liked_song_ids}
+    paginator = SongKeysetPagination()
+    # see FastSongListMixin
+    serializer = FastSongListSerializer(SongSerializer, context) if settings.SONG_LIST_FAST_PATH else None
+    fast = serializer is not None and serializer.supported
+    if fast:
+        queryset = serializer.values(queryset)
+    with db_router.read_from_replica(await db_router.ashould_read_from_replica(request.user.pk)):
+        songs = await paginator.apaginate_queryset(queryset, drf_request)
+        paginated = songs is not None
+        if not paginated:
+            songs = [song async for song in queryset]
+    if fast:
+        data = serializer.serialize(songs)
+    else:
+        data = SongSerializer(songs, many=True, context=context).data
+    if paginated:
+        data = paginator.get_paginated_response(data).data
+    return api_response(data, renderer_class=FastJSONRenderer if fast else JSONRenderer)
+
+
+def annotate_liked() -> bool:
+    return settings.LIKED_SONGS_MODE == 'annotate'
+
+
+async def list_etag(request):
+    user = request.user
+    return conditional.list_etag(request, user.pk, await Song.aget_catalog_version(), await Like.aget_likes_version(user))
+
+
+async def conditional_song_list_response(request, queryset: QuerySet):
+    """song_list_response with the ETag of SongListAPIView/LikedListAPIView (see ConditionalListMixin)
+    """
+    etag = await list_etag(request)
+    if etag is not None and conditional.etag_matches(request, etag):
+        return api_response(None, status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    response = await song_list_response(request, queryset, await get_liked_song_ids(request.user))
+    if etag is not None:
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+async def get_liked_song_ids(user):
+    if annotate_liked():
+        return None
+    return await Like.aget_liked_song_ids(user)
+
+
+@async_api_view(['GET'])
+async def song_list(request):
+    user = request.user
+    if annotate_liked():
+        queryset = Song.annotate_by_like(user).order_by('id')
+    else:
+        queryset = Song.objects.order_by('id')
+    return await conditional_song_list_response(request, queryset)
+
+
+@async_api_view(['GET'])
+async def liked_list(request):
+    user = request.user
+    queryset = Song.get_liked_by_user(user, annotate_liked=annotate_liked()).order_by('id')
+    return await conditional_song_list_response(request, queryset)
+
+
+@async_api_view(['GET'])
+async def search(request):
+    user = request.user
+    query = request.GET.get('q', '').strip()
+    queryset = Song.search(user, query, annotate_liked=annotate_liked())
+    return await song_list_response(request, queryset, await get_liked_song_ids(user))
+
+
+# writes go through Like.apply_changes in a worker thread, because they need a transaction,
+# which the async ORM does not support
+
+
+@async_api_view(['POST'])
+async def like_song(request, song_id):
+    result = (await sync_to_async(Like.apply_changes)(request.user, [song_id], []))[song_id]
+    if result == Like.NOT_FOUND:
+        raise Http404("No Song matches the given query.")
+    if result == Like.LIKED:
+        return api_response({"message": "Song liked successfully."}, status.HTTP_201_CREATED)
+    return api_response({"message": "You already liked this song."})
+
+
+@async_api_view(['DELETE'])
+async def unlike_song(request, song_id):
+    result = (await sync_to_async(Like.apply_changes)(request.user, [], [song_id]))[song_id]
+    if result == Like.NOT_FOUND:
+        raise Http404("No Song matches the given query.")
+    if result == Like.UNLIKED:
+        return api_response({"message": "Song unliked successfully."})
+    return api_response({"message": "You haven't liked this song."})
+
+
+@async_api_view(['POST'])
+async def batch_like(request):
+    serializer = LikeBatchSerializer(data=request_data(request))
+    serializer.is_valid(raise_exception=True)
+    results = await sync_to_async(Like.apply_changes)(
+        request.user,
+        serializer.validated_data['like'],
+        serializer.validated_data['unlike']
+    )
+    return api_response(
+        {"results": [{"song_id": song_id, "result": result} for song_id, result in results.items()]}
+    )
@@ -0,0 +1,90 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils.http import parse_etags
+from spotechnify_server import db_router
+
+# versions are the time (ns, hex) of the write that made them,
+# so it is known whether the replicas may still be behind a version
+
+# caches that each worker process keeps for itself, a write only changes the versions of the worker that made it
+PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def new_version() -> str:
+    return f"{time.time_ns():x}"
+
+
+def get_version(key: str) -> str:
+    """current version stored under key, a new one is started if the cache lost it
+       (which only costs the clients one full download)
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_version(key: str) -> str:
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, new_version(), None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_version(key: str) -> None:
+    """changes the version now and again when the current transaction commits,
+       so a response built from the data before the commit never carries the version after it
+    """
+    cache.set(key, new_version(), None)
+    transaction.on_commit(lambda: cache.set(key, new_version(), None))
+
+
+def is_settled(version: str) -> bool:
+    """False while the replicas may not have the write that made the version yet
+    """
+    if not db_router.replica_aliases():
+        return True
+    return time.time_ns() - int(version, 16) >= settings.REPLICA_PIN_SECONDS * 1_000_000_000
+
+
+def cache_is_shared() -> bool:
+    """False if the versions live in a per process cache, another worker would answer 304 to a list it never saw change
+    """
+    return settings.CACHES['default']['BACKEND'] not in PROCESS_CACHES
+
+
+def list_etag(request, user_id: int, *versions: str):
+    """weak ETag of a song list of the user, from the versions of the data in it, the url (page, page size)
+       and the signing period of the urls in it (see CachedUrlS3Storage.url_period), so a client never keeps
+       a list of expired urls
+
+    Returns:
+        str: the ETag, or None if the list should not be cached because the cache is not shared
+             or a version is too recent
+    """
+    if not cache_is_shared() or not all(is_settled(version) for version in versions):
+        return None
+    url_period = getattr(default_storage, 'url_period', lambda: None)()
+    key = f"{request.get_full_path()}|{user_id}|{'|'.join(versions)}|{url_period}"
+    return f'W/"{hashlib.sha1(key.encode()).hexdigest()[:20]}"'
+
+
+def etag_matches(request, etag: str) -> bool:
+    """weak comparison of etag with the If-None-Match header of the request
+    """
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    if '*' in etags:
+        return True
+    return etag.removeprefix('W/') in (tag.removeprefix('W/') for tag in etags)
@@ -0,0 +1,201 @@
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+from authentication.models import CustomUser
+from music.models import Song
+
+# (name, method, sync path, async path), "{song}" is replaced by a random song id
+ROUTES = [
+    ("list", 'GET', "/music/list/?page_size=50", "/music/async/list/?page_size=50"),
+    ("liked", 'GET', "/music/liked/?page_size=50", "/music/async/liked/?page_size=50"),
+    ("search", 'GET', "/music/search/?q=Song+{song}&page_size=50", "/music/async/search/?q=Song+{song}&page_size=50"),
+    ("like", 'POST', "/music/like/{song}/", "/music/async/like/{song}/"),
+    ("check-verified", 'GET', "/auth/check-verified/", "/auth/async/check-verified/"),
+]
+
+
+class Command(BaseCommand):
+    help = ("Serves the project with uvicorn and compares requests/s and p50/p99 latency of the sync and the async "
+            "version of each route under many concurrent keep-alive connections, "
+            "run seed_catalog first for realistic data")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=500, help="number of concurrent connections")
+        parser.add_argument('--duration', type=float, default=20, help="seconds each route is measured")
+        parser.add_argument('--warmup', type=float, default=10,
+                            help="seconds each route runs before measuring (the first requests sign the urls)")
+        parser.add_argument('--workers', type=int, default=1, help="number of uvicorn worker processes")
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--routes', nargs='*', choices=[name for name, *_ in ROUTES])
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.song_ids = list(Song.objects.values_list('id', flat=True)[:10000])
+        if not self.song_ids:
+            raise CommandError("No songs, run seed_catalog first")
+        user = CustomUser.objects.filter(username__startswith="seed_user_").order_by('id').first() \
+            or CustomUser.objects.order_by('id').first()
+        if user is None:
+            raise CommandError("No users, run seed_catalog first")
+        self.authorization = f"Bearer {RefreshToken.for_user(user).access_token}"
+        self.port = options['port']
+
+        self.stdout.write(f"uvicorn, {options['workers']} workers, {options['connections']} connections, "
+                          f"{options['duration']:g}s per route")
+        self.stdout.write(f"{'':16}{'':7}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}{'unanswered':>12}")
+        for name, method, sync_path, async_path in ROUTES:
+            if options['routes'] and name not in options['routes']:
+                continue
+            for mode, path in (('sync', sync_path), ('async', async_path)):
+                # a fresh server for every run, so requests left over from the previous one do not slow it down
+                server = self.start_server(options['workers'])
+                try:
+                    result = asyncio.run(self.run_route(method, path, options))
+                finally:
+                    self.stop_server(server)
+                self.stdout.write(f"{name:16}{mode:7}{result['throughput']:>10.1f}{result['p50_ms']:>10.0f}"
+                                  f"{result['p99_ms']:>10.0f}{result['errors']:>8}{result['unanswered']:>12}")
+
+    def start_server(self, workers: int) -> subprocess.Popen:
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'spotechnify_server.asgi:application', '--host', '127.0.0.1',
+             '--port', str(self.port), '--workers', str(workers), '--no-access-log', '--log-level', 'warning',
+             '--timeout-graceful-shutdown', '5'],
+            # every request is slow at this concurrency, logging each one would flood the report
+            env={'REQUEST_TIMING_SLOW_MS': '60000', **os.environ}, stdout=subprocess.DEVNULL
+        )
+        try:
+            self.wait_for_server(server)
+        except BaseException:
+            self.stop_server(server)
+            raise
+        return server
+
+    @staticmethod
+    def stop_server(server: subprocess.Popen) -> None:
+        """stops uvicorn and its workers, the requests still in progress are dropped after 5 seconds
+        """
+        server.terminate()
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+    def wait_for_server(self, server: subprocess.Popen) -> None:
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("uvicorn exited, is it installed (pip install uvicorn)?")
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError("uvicorn did not start listening")
+
+    async def run_route(self, method: str, path: str, options: dict) -> dict:
+        """keeps options['connections'] connections sending requests back to back,
+           counts every response (and connection error) that arrives after the warmup and before the end,
+           whenever its request was sent, so requests slower than the warmup are not left out,
+           the requests still waiting at the end are counted as unanswered
+        """
+        started = time.perf_counter()
+        measure_from = started + options['warmup']
+        deadline = measure_from + options['duration']
+        samples = []
+        errors = [0]
+        waiting = set()
+
+        async def connection(number: int):
+            reader = writer = None
+            try:
+                while time.perf_counter() < deadline:
+                    try:
+                        if writer is None:
+                            reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+                        sent = time.perf_counter()
+                        waiting.add(number)
+                        status_code, close = await self.request(
+                            reader, writer, method, path.format(song=self.random.choice(self.song_ids))
+                        )
+                        waiting.discard(number)
+                        received = time.perf_counter()
+                        if measure_from <= received <= deadline:
+                            samples.append(received - sent)
+                            if status_code >= 400:
+                                errors[0] += 1
+                    except (OSError, asyncio.IncompleteReadError, ValueError):
+                        waiting.discard(number)
+                        if measure_from <= time.perf_counter() <= deadline:
+                            errors[0] += 1
+                        close = True
+                    if close and writer is not None:
+                        writer.close()
+                        reader = writer = None
+            finally:
+                if writer is not None:
+                    writer.close()
+
+        tasks = [asyncio.create_task(connection(number)) for number in range(options['connections'])]
+        await asyncio.wait(tasks, timeout=deadline - time.perf_counter())
+        unanswered = len(waiting)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        latencies = sorted(sample * 1000 for sample in samples) or [0]
+        return {
+            "throughput": len(samples) / options['duration'],
+            "p50_ms": self.percentile(latencies, 50),
+            "p99_ms": self.percentile(latencies, 99),
+            "errors": errors[0],
+            "unanswered": unanswered,
+        }
+
+    async def request(self, reader, writer, method: str, path: str) -> tuple:
+        """sends one HTTP/1.1 request and reads the whole response
+
+        Returns:
+            tuple: (status code, True if the server closes the connection)
+        """
+        writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nAuthorization: {self.authorization}\r\n"
+            f"Content-Length: 0\r\n\r\n".encode()
+        )
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            raise asyncio.IncompleteReadError(b'', None)
+        status_code = int(status_line.split()[1])
+        length = 0
+        chunked = close = False
+        while (line := await reader.readline()) not in (b'\r\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            name, value = name.strip().lower(), value.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'transfer-encoding':
+                chunked = 'chunked' in value
+            elif name == 'connection':
+                close = value == 'close'
+        if chunked:
+            while size := int((await reader.readline()).split(b';')[0], 16):
+                await reader.readexactly(size + 2)
+            await reader.readline()
+        elif length:
+            await reader.readexactly(length)
+        return status_code, close
+
+    @staticmethod
+    def percentile(values: list, percent: float) -> float:
+        """nearest-rank percentile of sorted values
+        """
+        index = max(int(round(percent / 100 * len(values))) - 1, 0)
+        return values[min(index, len(values) - 1)]
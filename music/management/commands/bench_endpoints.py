@@ -0,0 +1,259 @@
+import json
+import logging
+import random
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+from authentication.models import CustomUser
+from music.models import Song
+
+PASSWORD = "bench-password"
+
+
+class Command(BaseCommand):
+    help = ("Runs every route of music/urls.py and authentication/urls.py in process at a given concurrency "
+            "and reports throughput, p50/p95/p99 latency and SQL queries per request, "
+            "run seed_catalog first for realistic data")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help="number of requests sent to every route")
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help="number of threads sending requests at the same time")
+        parser.add_argument('--routes', nargs='*',
+                            help="only run these routes (names as printed in the report, e.g. music/list/)")
+        parser.add_argument('--username',
+                            help="user the requests are sent as (defaults to a seeded user with the most likes)")
+        parser.add_argument('--output',
+                            help="writes the results as JSON to this file")
+        parser.add_argument('--compare',
+                            help="JSON results of an earlier run, prints the ratio of every metric to it")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.song_ids = list(Song.objects.values_list('id', flat=True))
+        if not self.song_ids:
+            raise CommandError("No songs, run seed_catalog first")
+        self.user = self.get_user(options['username'])
+        self.other_user = self.get_other_user()
+        self.access = str(RefreshToken.for_user(self.user).access_token)
+
+        routes = self.get_routes()
+        if options['routes']:
+            unknown = set(options['routes']) - {name for name, *_ in routes}
+            if unknown:
+                raise CommandError(f"Unknown routes: {', '.join(sorted(unknown))}")
+            routes = [route for route in routes if route[0] in options['routes']]
+
+        results = {}
+        # failed requests are counted by status, logging them (e.g. verify with a wrong code,
+        # or streaming seeded songs that have no audio file) would flood the report
+        request_logger = logging.getLogger('django.request')
+        request_log_level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        # every request comes from one address and one account, with the real buckets the auth routes
+        # would mostly measure 429s, the buckets are still read and written, they just never run out
+        unlimited_throttles = override_settings(THROTTLE_BUCKETS={
+            scope: (10 ** 9, seconds) for scope, (_, seconds) in settings.THROTTLE_BUCKETS.items()
+        })
+        try:
+            with unlimited_throttles:
+                for name, method, make_request, authenticated in routes:
+                    results[name] = self.run_route(method, make_request, authenticated,
+                                                   options['requests'], options['concurrency'])
+                    self.stdout.write(self.format_result(name, results[name]))
+        finally:
+            request_logger.setLevel(request_log_level)
+            CustomUser.objects.filter(username__startswith="bench_signup_").delete()
+
+        report = {
+            "commit": self.git_commit(),
+            "created_at": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "requests": options['requests'],
+            "concurrency": options['concurrency'],
+            "songs": len(self.song_ids),
+            "results": results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+        if options['compare']:
+            self.compare(report, options['compare'])
+
+    def get_user(self, username):
+        if username:
+            user = CustomUser.objects.filter(username=username).first()
+            if user is None:
+                raise CommandError(f"No user named {username}")
+        else:
+            user = CustomUser.objects.filter(username__startswith="seed_user_").order_by('id').first()
+            if user is None:
+                user = CustomUser.objects.create_user(username="bench_user", email="bench_user@example.com")
+        # change-password sets the same password again, so this is stable between requests
+        user.set_password(PASSWORD)
+        user.save()
+        return user
+
+    def get_other_user(self):
+        """forgot-password resets the password of this user, not of the user the requests are sent as
+        """
+        user, _ = CustomUser.objects.get_or_create(username="bench_forgot_password",
+                                                   defaults={"email": "bench_forgot_password@example.com"})
+        return user
+
+    def random_song_id(self) -> int:
+        return self.random.choice(self.song_ids)
+
+    def get_routes(self) -> list:
+        """(name, method, request factory, authenticated) of every route
+           a request factory returns the path and the body of one request
+        """
+        def song(prefix):
+            return lambda: (f"{prefix}{self.random_song_id()}/", None)
+
+        def fixed(path, body=None):
+            return lambda: (path, body() if callable(body) else body)
+
+        def batch():
+            return {"like": self.random.sample(self.song_ids, min(10, len(self.song_ids))), "unlike": []}
+
+        def sign_up():
+            name = f"bench_signup_{uuid.uuid4().hex[:12]}"
+            return {"username": name, "email": f"{name}@example.com", "password": PASSWORD}
+
+        def refresh():
+            return {"refresh": str(RefreshToken.for_user(self.user))}
+
+        def access():
+            return {"token": self.access}
+
+        login = {"username": self.user.username, "password": PASSWORD}
+        change_password = {"old_password": PASSWORD, "new_password": PASSWORD}
+        forgot_password = {"email": self.other_user.email}
+        search = lambda: (f"/music/search/?q=Song {self.random_song_id() % 1000}", None)
+        async_search = lambda: (f"/music/async/search/?q=Song {self.random_song_id() % 1000}", None)
+
+        return [
+            ("music/list/", 'get', fixed("/music/list/"), True),
+            ("music/list/?page_size", 'get', fixed("/music/list/?page_size=50"), True),
+            ("music/like/<id>/", 'post', song("/music/like/"), True),
+            ("music/unlike/<id>/", 'delete', song("/music/unlike/"), True),
+            ("music/like/batch/", 'post', fixed("/music/like/batch/", batch), True),
+            ("music/liked/", 'get', fixed("/music/liked/"), True),
+            ("music/recommend/", 'get', fixed("/music/recommend/"), True),
+            ("music/search/", 'get', search, True),
+            ("music/stream/<id>/", 'get', song("/music/stream/"), True),
+            ("music/async/list/", 'get', fixed("/music/async/list/"), True),
+            ("music/async/like/<id>/", 'post', song("/music/async/like/"), True),
+            ("music/async/unlike/<id>/", 'delete', song("/music/async/unlike/"), True),
+            ("music/async/like/batch/", 'post', fixed("/music/async/like/batch/", batch), True),
+            ("music/async/liked/", 'get', fixed("/music/async/liked/"), True),
+            ("music/async/search/", 'get', async_search, True),
+            ("auth/jwt-token/", 'post', fixed("/auth/jwt-token/", login), False),
+            ("auth/jwt-token/refresh/", 'post', fixed("/auth/jwt-token/refresh/", refresh), False),
+            ("auth/jwt-token/verify/", 'post', fixed("/auth/jwt-token/verify/", access), False),
+            ("auth/jwt-token/black-list/", 'post', fixed("/auth/jwt-token/black-list/", refresh), False),
+            ("auth/sign-up/", 'post', fixed("/auth/sign-up/", sign_up), False),
+            ("auth/resend-verification/", 'get', fixed("/auth/resend-verification/"), True),
+            ("auth/verify/", 'post', fixed("/auth/verify/", {"code": "000000"}), True),
+            ("auth/check-verified/", 'get', fixed("/auth/check-verified/"), True),
+            ("auth/forgot-password/", 'post', fixed("/auth/forgot-password/", forgot_password), False),
+            ("auth/change-password/", 'post', fixed("/auth/change-password/", change_password), True),
+            ("auth/async/jwt-token/", 'post', fixed("/auth/async/jwt-token/", login), False),
+            ("auth/async/check-verified/", 'get', fixed("/auth/async/check-verified/"), True),
+            ("auth/async/resend-verification/", 'get', fixed("/auth/async/resend-verification/"), True),
+            ("auth/async/forgot-password/", 'post', fixed("/auth/async/forgot-password/", forgot_password), False),
+        ]
+
+    def run_route(self, method, make_request, authenticated, count, concurrency) -> dict:
+        local = threading.local()
+        headers = {"Authorization": f"Bearer {self.access}"} if authenticated else {}
+
+        def send(_):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = Client(raise_request_exception=False)
+            path, body = make_request()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = getattr(client, method)(path, body, content_type='application/json', headers=headers) \
+                    if body is not None else getattr(client, method)(path, headers=headers)
+                if response.streaming:
+                    for _ in response.streaming_content:
+                        pass
+                elapsed = time.perf_counter() - started
+            # the test client does not close the connections at the end of the request like the server,
+            # the connections of the worker threads would never go back to the pool
+            connections.close_all()
+            return elapsed, len(queries), response.status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(send, range(count)))
+        wall_time = time.perf_counter() - started
+
+        latencies = sorted(elapsed * 1000 for elapsed, _, _ in samples)
+        statuses = {}
+        for _, _, status_code in samples:
+            statuses[str(status_code)] = statuses.get(str(status_code), 0) + 1
+        return {
+            "throughput": count / wall_time,
+            "p50_ms": self.percentile(latencies, 50),
+            "p95_ms": self.percentile(latencies, 95),
+            "p99_ms": self.percentile(latencies, 99),
+            "max_ms": latencies[-1],
+            "queries_mean": sum(queries for _, queries, _ in samples) / count,
+            "queries_max": max(queries for _, queries, _ in samples),
+            "statuses": statuses,
+        }
+
+    @staticmethod
+    def percentile(values: list, percent: float) -> float:
+        """nearest-rank percentile of sorted values
+        """
+        index = max(int(round(percent / 100 * len(values))) - 1, 0)
+        return values[min(index, len(values) - 1)]
+
+    @staticmethod
+    def format_result(name: str, result: dict) -> str:
+        statuses = ' '.join(f"{code}x{n}" for code, n in sorted(result['statuses'].items()))
+        return (f"{name:<36} {result['throughput']:>8.1f} req/s  p50 {result['p50_ms']:>7.1f}ms  "
+                f"p95 {result['p95_ms']:>7.1f}ms  p99 {result['p99_ms']:>7.1f}ms  "
+                f"queries {result['queries_mean']:>5.1f}  [{statuses}]")
+
+    @staticmethod
+    def git_commit():
+        try:
+            return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def compare(self, report: dict, path: str) -> None:
+        """prints current / baseline for every metric of the routes present in both runs
+        """
+        with open(path) as file:
+            baseline = json.load(file)
+        self.stdout.write(f"\nCompared to {path} (commit {baseline.get('commit')}), current / baseline:")
+        metrics = ("throughput", "p50_ms", "p95_ms", "p99_ms", "queries_mean")
+        for name, result in report['results'].items():
+            before = baseline.get('results', {}).get(name)
+            if before is None:
+                continue
+            ratios = '  '.join(
+                f"{metric} {result[metric] / before[metric]:.2f}x" if before[metric] else f"{metric} -"
+                for metric in metrics
+            )
+            self.stdout.write(f"{name:<36} {ratios}")
@@ -0,0 +1,136 @@
+import logging
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.test import Client
+from rest_framework_simplejwt.tokens import RefreshToken
+from authentication.models import CustomUser
+from music.models import Song, Like
+
+
+class Command(BaseCommand):
+    help = ("Times the recommendation ranking of the same users with the original query (counting the Like rows "
+            "of every candidate's genre) and with the maintained GenrePopularity table, then the /music/recommend/ "
+            "endpoint with a cold and a warm cache, run seed_catalog first (e.g. --likes 1400000 for ~1M likes)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20,
+                            help="number of users timed, spread over the range of like counts")
+        parser.add_argument('--repeat', type=int, default=3, help="the best of this many runs of a user is kept")
+        parser.add_argument('--timeout', type=float, default=60,
+                            help="seconds after which a ranking query is cancelled (PostgreSQL only), "
+                                 "a cancelled run counts as the timeout, a lower bound of its time")
+
+    def handle(self, *args, **options):
+        self.timeout = options['timeout']
+        self.timed_out = {}
+        users = self.get_users(options['users'])
+        self.stdout.write(f"{Like.objects.count()} likes, {Song.objects.count()} songs, {len(users)} users "
+                          f"with {min(users.values())} to {max(users.values())} likes")
+        limit = settings.RECOMMENDATION_CACHE_SIZE
+        results = {
+            'correlated_subquery': self.time_users(users, options['repeat'], lambda user: self.rank(
+                'correlated_subquery', self.get_correlated_recommended(user).values_list('id', flat=True)[:limit]
+            )),
+            'genre_popularity': self.time_users(users, options['repeat'], lambda user: self.rank(
+                'genre_popularity', Song.get_genre_recommended_for_user(user).values_list('id', flat=True)[:limit]
+            )),
+        }
+        client = Client()
+
+        def get(user):
+            access = str(RefreshToken.for_user(user).access_token)
+            response = client.get('/music/recommend/?page_size=50', headers={"Authorization": f"Bearer {access}"})
+            if response.status_code != 200:
+                raise CommandError(f"/music/recommend/ answered {response.status_code}")
+
+        def cold(user):
+            cache.delete(Song.RECOMMENDED_IDS_CACHE_KEY.format(user_id=user.pk))
+            get(user)
+
+        # the cold requests are slow on purpose, logging each of them would flood the report
+        timing_logger = logging.getLogger('spotechnify_server.instrumentation')
+        timing_log_level = timing_logger.level
+        timing_logger.setLevel(logging.ERROR)
+        try:
+            results['endpoint_cold'] = self.time_users(users, options['repeat'], cold)
+            results['endpoint_warm'] = self.time_users(users, options['repeat'], get)
+        finally:
+            timing_logger.setLevel(timing_log_level)
+
+        self.stdout.write(f"{'':22}{'p50':>10}{'p95':>10}{'max':>10}  (ms)")
+        for name, timings in results.items():
+            self.stdout.write(f"{name:22}" + "".join(
+                f"{self.percentile(timings, percent):>10.1f}" for percent in (50, 95, 100)
+            ))
+        for name, count in self.timed_out.items():
+            self.stdout.write(self.style.WARNING(
+                f"{name}: {count} runs cancelled after {self.timeout:g}s, its times are lower bounds"
+            ))
+        speedup = self.percentile(results['correlated_subquery'], 50) / self.percentile(results['genre_popularity'], 50)
+        self.stdout.write(self.style.SUCCESS(
+            f"genre_popularity: p50 {'at least ' if self.timed_out else ''}{speedup:.0f}x faster than correlated_subquery"
+        ))
+
+    def rank(self, name: str, ids) -> None:
+        """evaluates the ids queryset, cancelled after the timeout on PostgreSQL
+        """
+        if connection.vendor != 'postgresql':
+            list(ids)
+            return
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL statement_timeout = %s", [int(self.timeout * 1000)])
+                list(ids)
+        except OperationalError:
+            self.timed_out[name] = self.timed_out.get(name, 0) + 1
+
+    def get_users(self, count: int) -> dict:
+        """{user: like count} of count users spread evenly over the users ordered by like count
+        """
+        users = list(CustomUser.objects.annotate(likes=Count('like')).filter(likes__gt=0).order_by('likes', 'id'))
+        if not users:
+            raise CommandError("No user has likes, run seed_catalog first")
+        step = max(len(users) / count, 1)
+        picked = [users[int(index * step)] for index in range(min(count, len(users)))]
+        return {user: user.likes for user in picked}
+
+    @staticmethod
+    def get_correlated_recommended(user: CustomUser):
+        """the ranking before GenrePopularity: the likes of the genre are counted for every candidate song
+        """
+        liked_genres = Song.objects.filter(like__user_id=user.pk).values('genre').distinct()
+        genre_like_counts = Like.objects.filter(song__genre=OuterRef('genre'))\
+            .values('song__genre')\
+            .annotate(genre_likes=Count('id'))\
+            .values('genre_likes')
+        return Song.objects.filter(
+            genre__in=Subquery(liked_genres.values('genre'))).exclude(
+            like__user_id=user.pk
+        ).annotate(genre_likes=Subquery(genre_like_counts, output_field=IntegerField()))\
+        .order_by('-genre_likes', '-id')
+
+    def time_users(self, users: dict, repeat: int, run) -> list:
+        """milliseconds of the best of repeat runs of every user, sorted
+        """
+        timings = []
+        for user in users:
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                run(user)
+                elapsed = min((time.perf_counter() - started) * 1000, self.timeout * 1000)
+                best = elapsed if best is None else min(best, elapsed)
+            timings.append(best)
+        return sorted(timings)
+
+    @staticmethod
+    def percentile(values: list, percent: float) -> float:
+        """nearest-rank percentile of sorted values
+        """
+        index = max(int(round(percent / 100 * len(values))) - 1, 0)
+        return values[min(index, len(values) - 1)]
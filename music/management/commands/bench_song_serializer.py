@@ -0,0 +1,81 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from authentication.models import CustomUser
+from music.models import Song
+from music.serializers import FastSongListSerializer, SongSerializer
+from spotechnify_server.renderers import FastJSONRenderer
+
+
+class Command(BaseCommand):
+    help = ("Serializes and renders the same songs with SongSerializer + JSONRenderer and with "
+            "FastSongListSerializer + FastJSONRenderer, checks that the bytes are the same and reports rows/s "
+            "of each step, run seed_catalog first for realistic data")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=10000, help="number of songs serialized")
+        parser.add_argument('--repeat', type=int, default=5, help="the best of this many runs is reported")
+        parser.add_argument('--liked-song-ids', action='store_true',
+                            help='hand the liked song ids to the serializers instead of annotating "liked"')
+
+    def handle(self, *args, **options):
+        user = CustomUser.objects.annotate(likes=Count('like')).order_by('-likes', 'id').first()
+        if user is None or not Song.objects.exists():
+            raise CommandError("No songs or users, run seed_catalog first")
+        request = Request(RequestFactory().get('/music/list/'))
+        context = {'request': request}
+        if options['liked_song_ids']:
+            context['liked_song_ids'] = set(user.like_set.values_list('song_id', flat=True))
+            queryset = Song.objects.order_by('id')
+        else:
+            queryset = Song.annotate_by_like(user).order_by('id')
+        count = options['songs']
+
+        def serializer_path():
+            songs = list(queryset[:count])
+            yield 'query'
+            data = SongSerializer(songs, many=True, context=context).data
+            yield 'serialize'
+            yield JSONRenderer().render(data)
+
+        def fast_path():
+            serializer = FastSongListSerializer(SongSerializer, context)
+            rows = list(serializer.values(queryset)[:count])
+            yield 'query'
+            data = serializer.serialize(rows)
+            yield 'serialize'
+            yield FastJSONRenderer().render(data)
+
+        results = {}
+        for name, path in (('serializer', serializer_path), ('fast', fast_path)):
+            best = None
+            for _ in range(options['repeat']):
+                steps = {}
+                started = step_started = time.perf_counter()
+                for step in path():
+                    now = time.perf_counter()
+                    if isinstance(step, bytes):
+                        steps['render'] = now - step_started
+                        output = step
+                    else:
+                        steps[step] = now - step_started
+                    step_started = now
+                steps['total'] = time.perf_counter() - started
+                if best is None or steps['total'] < best['total']:
+                    best = steps
+            results[name] = (best, output)
+
+        rows = queryset[:count].count()
+        if results['serializer'][1] != results['fast'][1]:
+            raise CommandError("The fast path does not render the same bytes as SongSerializer")
+        self.stdout.write(f"{rows} songs, {len(results['fast'][1]) / 1024:.0f} KB of JSON, identical output")
+        self.stdout.write(f"{'':12}{'query':>14}{'serialize':>14}{'render':>14}{'total':>14}  (rows/s)")
+        for name, (steps, _) in results.items():
+            self.stdout.write(f"{name:12}" + "".join(
+                f"{rows / steps[step]:>14,.0f}" for step in ('query', 'serialize', 'render', 'total')
+            ))
+        speedup = results['serializer'][0]['total'] / results['fast'][0]['total']
+        self.stdout.write(self.style.SUCCESS(f"fast path: {speedup:.1f}x the rows/s of SongSerializer"))
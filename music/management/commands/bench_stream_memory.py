@@ -0,0 +1,105 @@
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from authentication.models import CustomUser
+from music.models import Song
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Measures the memory held per concurrent /music/stream/<id>/ response (local storage, the S3 storage "
+            "redirects) against reading each file whole: opens --streams ranged streams of one file, reads them "
+            "chunk by chunk in turns and reports the Python memory traced by tracemalloc, "
+            "the song and user it creates are rolled back")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--streams', type=int, default=50, help="number of streams open at the same time")
+        parser.add_argument('--size', type=float, default=4, help="size of the audio file in MB")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        size = int(options['size'] * 1024 * 1024)
+        streams = options['streams']
+        with tempfile.TemporaryDirectory() as directory:
+            storages = {
+                "default": {"BACKEND": "django.core.files.storage.FileSystemStorage",
+                            "OPTIONS": {"location": directory}},
+                "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+            }
+            with open(os.path.join(directory, 'bench.mp3'), 'wb') as file:
+                file.write(os.urandom(size))
+            with override_settings(STORAGES=storages):
+                try:
+                    with transaction.atomic():
+                        results = self.run(streams, size)
+                        raise Rollback()
+                except Rollback:
+                    pass
+
+        self.stdout.write(f"{streams} streams of a {size / 1024 / 1024:.1f} MB file")
+        self.stdout.write(f"{'':10}{'per stream':>14}{'peak':>14}{'time':>10}")
+        for name, (per_stream, peak, elapsed) in results.items():
+            self.stdout.write(f"{name:10}{per_stream / 1024:>11.0f} KB{peak / 1024 / 1024:>11.1f} MB"
+                              f"{elapsed:>9.2f}s")
+        ratio = results['buffered'][0] / results['streamed'][0]
+        self.stdout.write(self.style.SUCCESS(f"streamed: {ratio:.0f}x less memory per stream than buffered"))
+
+    def run(self, streams: int, size: int) -> dict:
+        """{name: (bytes held per open stream, peak traced bytes, seconds)} of both ways of sending the file
+        """
+        user = CustomUser.objects.create_user(username="bench_stream_user", email="bench_stream_user@example.com")
+        song = Song.objects.create(title="Bench Stream", artist_name="Bench", audio_file="bench.mp3", genre="bench")
+        client = Client()
+        headers = {"Authorization": f"Bearer {RefreshToken.for_user(user).access_token}"}
+        client.get(f"/music/stream/{song.id}/", headers=headers)  # caches the user
+        starts = [self.random.randrange(size // 2) for _ in range(streams)]
+
+        def streamed():
+            responses = []
+            for start in starts:
+                response = client.get(f"/music/stream/{song.id}/", headers={**headers, "Range": f"bytes={start}-"})
+                if response.status_code != 206:
+                    raise CommandError(f"/music/stream/ answered {response.status_code}")
+                responses.append(iter(response.streaming_content))
+            return responses
+
+        def buffered():
+            responses = []
+            for start in starts:
+                with default_storage.open(song.audio_file.name, 'rb') as file:
+                    responses.append(iter([file.read()[start:]]))
+            return responses
+
+        return {name: self.measure(open_streams, streams) for name, open_streams in
+                (('streamed', streamed), ('buffered', buffered))}
+
+    @staticmethod
+    def measure(open_streams, streams: int) -> tuple:
+        """opens the streams, reads one chunk of each so every one is in flight, then reads them to the end in turns
+        """
+        tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            responses = open_streams()
+            for response in responses:
+                next(response)
+            held = tracemalloc.get_traced_memory()[0] - before
+            while responses:
+                responses = [response for response in responses if next(response, None) is not None]
+            peak = tracemalloc.get_traced_memory()[1] - before
+        finally:
+            tracemalloc.stop()
+        return held / streams, peak, time.perf_counter() - started
@@ -0,0 +1,115 @@
+import gzip
+import os
+import shutil
+import tempfile
+import time
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from music.models import CatalogChange, CatalogSnapshot, Song
+from music.serializers import CatalogSongSerializer, FastSongListSerializer
+from spotechnify_server.renderers import FastJSONRenderer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Command(BaseCommand):
+    help = ("Writes the whole catalog at the current catalog version to a json file in the default storage, "
+            "with gzip and brotli (if installed) copies, for clients starting without a catalog "
+            "(then /music/sync/?since=<version>), meant to run periodically")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help="build a snapshot even if the latest one is at the current version")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="number of songs read per query")
+        parser.add_argument('--base-url', default=settings.CATALOG_BASE_URL,
+                            help="public url of the server the song urls are made absolute on "
+                                 "(default: CATALOG_BASE_URL)")
+
+    def handle(self, *args, **options):
+        if not options['base_url']:
+            # the sync sends absolute urls like the song lists, the snapshot must match it
+            raise CommandError("Set CATALOG_BASE_URL (or --base-url) to the public url of the server")
+        started = time.perf_counter()
+        # read before the songs: every change up to it is committed (see CatalogCounter),
+        # newer changes in the file are sent again by /music/sync/, which clients apply idempotently
+        version = CatalogChange.get_version()
+        latest = CatalogSnapshot.get_latest()
+        if latest is not None and latest.version == version and not options['force']:
+            self.stdout.write(f"The latest snapshot is already at version {version}")
+            return
+
+        name = f"{settings.CATALOG_SNAPSHOT_DIR}/snapshot-{version}.json"
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'snapshot.json')
+            songs = self.write_snapshot(path, version, options['chunk_size'], options['base_url'])
+            files = {name: path, f"{name}.gz": self.gzip(path)}
+            if brotli is not None:
+                files[f"{name}.br"] = self.brotli(path)
+            stored = {}
+            for target, source in files.items():
+                if default_storage.exists(target):
+                    default_storage.delete(target)
+                with open(source, 'rb') as file:
+                    stored[target] = default_storage.save(target, File(file))
+            sizes = {target: os.path.getsize(source) for target, source in files.items()}
+
+        snapshot = CatalogSnapshot.objects.create(
+            version=version, name=stored[name], gzip_name=stored[f"{name}.gz"],
+            brotli_name=stored.get(f"{name}.br", ""), songs=songs, size=sizes[name]
+        )
+        for old in CatalogSnapshot.objects.order_by('-version', '-id')[settings.CATALOG_SNAPSHOT_KEEP:]:
+            if old.version != snapshot.version:
+                old.delete_files()
+            old.delete()
+
+        compressed = ", ".join(f"{target.rsplit('.', 1)[-1]} {size / 1024:.0f} KB"
+                               for target, size in sizes.items() if target != name)
+        self.stdout.write(self.style.SUCCESS(
+            f"Snapshot of {songs} songs at version {version}: {sizes[name] / 1024:.0f} KB ({compressed}) "
+            f"in {time.perf_counter() - started:.1f}s"
+        ))
+
+    def write_snapshot(self, path: str, version: int, chunk_size: int, base_url: str) -> int:
+        """writes {"version": ..., "songs": [...]} chunk by chunk, so the catalog is never all in memory
+
+        Returns:
+            int: number of songs
+        """
+        serializer = FastSongListSerializer(CatalogSongSerializer, context={'base_url': base_url})
+        renderer = FastJSONRenderer()
+        count = 0
+        last_id = 0
+        with open(path, 'wb') as file:
+            file.write(renderer.render({"version": version})[:-1] + b',"songs":[')
+            while True:
+                rows = list(serializer.values(Song.objects.filter(id__gt=last_id).order_by('id'))[:chunk_size])
+                if not rows:
+                    break
+                if count:
+                    file.write(b',')
+                # the items of the rendered list, without its brackets
+                file.write(renderer.render(serializer.serialize(rows))[1:-1])
+                count += len(rows)
+                last_id = rows[-1]['id']
+            file.write(b']}')
+        return count
+
+    def gzip(self, path: str) -> str:
+        target = f"{path}.gz"
+        with open(path, 'rb') as source, gzip.open(target, 'wb', compresslevel=9) as output:
+            shutil.copyfileobj(source, output)
+        return target
+
+    def brotli(self, path: str) -> str:
+        target = f"{path}.br"
+        compressor = brotli.Compressor(quality=11)
+        with open(path, 'rb') as source, open(target, 'wb') as output:
+            while chunk := source.read(1024 * 1024):
+                output.write(compressor.process(chunk))
+            output.write(compressor.finish())
+        return target
@@ -0,0 +1,119 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from authentication.models import CustomUser
+from music.models import CatalogChange, Song
+from spotechnify_server.images import build_variants_safe
+
+# (model, image field, variants field)
+IMAGE_FIELDS = [
+    (Song, 'image', 'image_variants'),
+    (CustomUser, 'profile_image', 'profile_image_variants'),
+]
+
+
+class Command(BaseCommand):
+    help = ("Builds the resized WebP/JPEG variants of song images and profile images that do not have them yet "
+            "(new uploads and, on the first run, existing rows) in a pool of processes")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="process the pending images and exit (e.g. to backfill), instead of polling forever")
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help="number of worker processes, 0 to resize in this process")
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help="seconds to wait when no image is pending")
+        parser.add_argument('--rebuild', action='store_true',
+                            help="build the variants of every image again, e.g. after IMAGE_VARIANT_SIZES changed")
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            with transaction.atomic():
+                for model, _, variants_field in IMAGE_FIELDS:
+                    model.objects.update(**{variants_field: None})
+                CatalogChange.record(list(Song.objects.values_list('id', flat=True)))
+
+        pool = None
+        if options['processes'] > 0:
+            # spawn, so the workers do not inherit the database connections and storage clients of this process
+            pool = ProcessPoolExecutor(max_workers=options['processes'],
+                                       mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=django.setup)
+        try:
+            while True:
+                started = time.perf_counter()
+                built = failed = replaced = 0
+                for model, image_field, variants_field in IMAGE_FIELDS:
+                    model_built, model_failed, model_replaced = self.build_batch(
+                        pool, model, image_field, variants_field, options
+                    )
+                    built += model_built
+                    failed += model_failed
+                    replaced += model_replaced
+                if built or failed or replaced:
+                    self.stdout.write(f"built: {built}, failed: {failed}, replaced: {replaced} "
+                                      f"in {time.perf_counter() - started:.1f}s")
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def build_batch(self, pool, model, image_field, variants_field, options):
+        """builds the variants of one batch of pending images of the model
+           the images are resized outside of any transaction, then the rows are locked and only those whose image
+           is still the resized one are written, several commands can run (an image picked by two of them is
+           resized twice but written once)
+
+        Returns:
+            tuple: (number of images with variants, number of images that could not be read,
+                    number of images replaced while they were resized, still pending)
+        """
+        rows = list(
+            model.objects.filter(**{f"{variants_field}__isnull": True})
+            .exclude(**{f"{image_field}__isnull": True}).exclude(**{image_field: ""})
+            .order_by('pk').values_list('pk', image_field)[:options['batch_size']]
+        )
+        if not rows:
+            return 0, 0, 0
+        # rows sharing a file are resized once, variants of the same file must not be written concurrently
+        names = list(dict.fromkeys(name for _, name in rows))
+        results = pool.map(build_variants_safe, names) if pool is not None else map(build_variants_safe, names)
+        results = dict(zip(names, results))
+
+        written = []
+        failed = replaced = 0
+        with transaction.atomic():
+            locked = model.objects.select_for_update().filter(
+                pk__in=[pk for pk, _ in rows], **{f"{variants_field}__isnull": True}
+            ).only('pk', image_field, variants_field).order_by('pk')
+            for row in locked:
+                name = getattr(row, image_field).name
+                if name not in results:
+                    # a new image was uploaded meanwhile, its variants are built with the next batch
+                    replaced += 1
+                    continue
+                variants, error = results[name]
+                # failed images are marked done too (with no sizes), they are retried by --rebuild or a new upload
+                setattr(row, variants_field, variants)
+                if error is not None:
+                    failed += 1
+                    self.stderr.write(f"{model.__name__} {row.pk} ({variants['source']}): {error}")
+                written.append(row)
+            model.objects.bulk_update(written, [variants_field])
+
+            # bulk_update bypasses save(), which keeps the caches of the rows up to date
+            if model is Song and written:
+                CatalogChange.record([row.pk for row in written])
+            elif model is CustomUser and written:
+                keys = [CustomUser.CACHE_KEY.format(user_id=row.pk) for row in written]
+                transaction.on_commit(lambda: cache.delete_many(keys))
+        return len(written) - failed, failed, replaced
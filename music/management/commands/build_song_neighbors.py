@@ -0,0 +1,101 @@
+import time
+import numpy as np
+from scipy import sparse
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from music.models import Like, Song, SongNeighbor
+
+
+class Command(BaseCommand):
+    help = "Builds the top-K most similar songs of every song from the Like table (item-item cosine similarity)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=50,
+                            help="number of neighbors kept per song")
+        parser.add_argument('--min-score', type=float, default=0.0,
+                            help="neighbors with a lower cosine similarity are dropped")
+        parser.add_argument('--block-size', type=int, default=2000,
+                            help="number of songs whose similarities are computed (and held in memory) at once")
+        parser.add_argument('--only-missing', action='store_true',
+                            help="only compute the songs that have no neighbors yet, e.g. songs liked for the first time")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        top_k = options['top_k']
+
+        user_ids, song_ids = self.load_likes()
+        if not len(song_ids):
+            SongNeighbor.objects.all().delete()
+            Song.invalidate_recommendations()
+            self.stdout.write("No likes, neighbors cleared")
+            return
+
+        # binary user x song matrix, songs[j] is the id of column j
+        songs, song_index = np.unique(song_ids, return_inverse=True)
+        _, user_index = np.unique(user_ids, return_inverse=True)
+        likes = sparse.csr_matrix(
+            (np.ones(len(song_index), dtype=np.float32), (user_index, song_index)),
+            shape=(user_index.max() + 1, len(songs))
+        )
+        song_users = likes.T.tocsr()
+        norms = np.sqrt(np.asarray(song_users.sum(axis=1)).ravel())
+
+        rows = np.arange(len(songs))
+        if options['only_missing']:
+            built = np.fromiter(SongNeighbor.objects.values_list('song_id', flat=True).distinct(), dtype=np.int64)
+            rows = rows[~np.isin(songs, built)]
+
+        written = 0
+        for start in range(0, len(rows), options['block_size']):
+            block = rows[start:start + options['block_size']]
+            neighbors = self.block_neighbors(block, song_users, likes, norms, songs, top_k, options['min_score'])
+            with transaction.atomic():
+                SongNeighbor.objects.filter(song_id__in=songs[block].tolist()).delete()
+                SongNeighbor.objects.bulk_create(neighbors, batch_size=5000)
+            written += len(neighbors)
+
+        if not options['only_missing']:
+            # songs whose likes were all removed since the last build
+            SongNeighbor.objects.exclude(song_id__in=Like.objects.values('song_id')).delete()
+        Song.invalidate_recommendations()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Built {written} neighbors of {len(rows)} songs from {len(song_ids)} likes in {elapsed:.1f}s"
+        ))
+
+    def load_likes(self):
+        """reads every like as two aligned arrays of user ids and song ids
+        """
+        likes = np.fromiter(
+            Like.objects.values_list('user_id', 'song_id').iterator(chunk_size=100_000),
+            dtype=[('user_id', np.int64), ('song_id', np.int64)]
+        )
+        return likes['user_id'], likes['song_id']
+
+    def block_neighbors(self, block, song_users, likes, norms, songs, top_k, min_score) -> list:
+        """computes the top_k neighbors of the songs (matrix rows) in block
+
+        Returns:
+            list: unsaved SongNeighbor objects
+        """
+        # co-occurrence counts of the block songs with every song, then cosine similarity
+        co_likes = (song_users[block] @ likes).tocsr()
+        row_of_entry = np.repeat(block, np.diff(co_likes.indptr))
+        scores = co_likes.data / (norms[row_of_entry] * norms[co_likes.indices])
+
+        neighbors = []
+        for i, row in enumerate(block):
+            begin, end = co_likes.indptr[i], co_likes.indptr[i + 1]
+            columns, row_scores = co_likes.indices[begin:end], scores[begin:end]
+            keep = (columns != row) & (row_scores > min_score)
+            columns, row_scores = columns[keep], row_scores[keep]
+            if len(columns) > top_k:
+                top = np.argpartition(-row_scores, top_k)[:top_k]
+                columns, row_scores = columns[top], row_scores[top]
+            song_id = int(songs[row])
+            neighbors.extend(
+                SongNeighbor(song_id=song_id, neighbor_id=int(songs[column]), score=float(score))
+                for column, score in zip(columns, row_scores)
+            )
+        return neighbors
@@ -0,0 +1,66 @@
+import json
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from authentication.models import CustomUser
+from music import query_plans
+
+
+class Command(BaseCommand):
+    help = ("Runs EXPLAIN (FORMAT JSON) on the hot song queries (as the views run them) and fails if a plan "
+            "scans music_song or music_like sequentially while the table holds more than --max-seq-rows rows. "
+            "Meant for CI against a seeded PostgreSQL database (see --seed), so that a model or query change "
+            "cannot quietly bring back full scans (music.test_query_plans runs the same check in the test suite)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true',
+                            help="run seed_catalog (with its defaults) first, on an empty database")
+        parser.add_argument('--max-seq-rows', type=int, default=5000,
+                            help="sequential scans of checked tables with more rows than this fail the check")
+        parser.add_argument('--user', type=int,
+                            help="id of the user the queries are run for "
+                                 "(default: the user with the median number of likes)")
+        parser.add_argument('--query', help="search text (default: the last word of a song title)")
+        parser.add_argument('--show-plans', action='store_true', help="print the plan of every query")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Query plans can only be checked on PostgreSQL")
+        if options['seed']:
+            call_command('seed_catalog', stdout=self.stdout, stderr=self.stderr)
+
+        table_rows = query_plans.analyze_tables()
+        user = self.get_user(options['user'])
+        query = options['query'] or self.get_search_text()
+        failures = []
+        for name, queryset in query_plans.get_hot_queries(user, query):
+            plan = query_plans.get_plan(queryset)
+            scans = query_plans.sequential_scans(plan, table_rows, options['max_seq_rows'])
+            if options['show_plans']:
+                self.stdout.write(f"{name}:\n{json.dumps(plan, indent=2)}")
+            if scans:
+                tables = ', '.join(scans)
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f"{name}: sequential scan of {tables}"))
+            else:
+                self.stdout.write(f"{name}: ok ({plan['Node Type']}, cost {plan['Total Cost']})")
+
+        sizes = ', '.join(f"{table} {int(rows)} rows" for table, rows in sorted(table_rows.items()))
+        if failures:
+            raise CommandError(f"Full scans in {', '.join(failures)} ({sizes})")
+        self.stdout.write(self.style.SUCCESS(f"No full scans ({sizes})"))
+
+    def get_user(self, user_id: int) -> CustomUser:
+        if user_id is not None:
+            user = CustomUser.objects.filter(id=user_id).first()
+        else:
+            user = query_plans.get_typical_user()
+        if user is None:
+            raise CommandError("No user to run the queries for, seed the database first (--seed)")
+        return user
+
+    def get_search_text(self) -> str:
+        text = query_plans.get_search_text()
+        if not text:
+            raise CommandError("No song to search for, seed the database first (--seed)")
+        return text
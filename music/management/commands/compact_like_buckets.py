@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from music.models import SongLikeBucket
+
+
+class Command(BaseCommand):
+    help = ("Rolls the hourly like buckets older than TRENDING_HOURLY_HOURS into daily buckets and deletes "
+            "the buckets older than TRENDING_WINDOW_HOURS, meant to run periodically (e.g. hourly from cron)")
+
+    def handle(self, *args, **options):
+        rolled, deleted = SongLikeBucket.compact()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled {rolled} hourly buckets into daily ones, deleted {deleted} expired buckets"
+        ))
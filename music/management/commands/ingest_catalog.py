@@ -0,0 +1,175 @@
+import csv
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from boto3.exceptions import Boto3Error
+from botocore.exceptions import BotoCoreError, ClientError
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from music.models import CatalogChange, Song
+
+REQUIRED_FIELDS = ('title', 'artist_name', 'genre', 'audio')
+# errors of one file upload, they fail its line instead of the run
+# (local files, and S3: error responses, connection errors, failed transfers)
+UPLOAD_ERRORS = (OSError, ClientError, BotoCoreError, Boto3Error)
+
+
+class Command(BaseCommand):
+    help = ("Adds the songs of a CSV or JSONL manifest (title, artist_name, genre, audio, image) to the catalog, "
+            "uploading the files with a pool of threads and inserting the rows in batches. "
+            "Files are stored under names derived from their path, so running it again after a crash "
+            "skips the files already in the storage and the songs already inserted")
+
+    def add_arguments(self, parser):
+        parser.add_argument('manifest', help="path of the .csv or .jsonl manifest")
+        parser.add_argument('--base-dir',
+                            help="directory the audio and image paths are relative to (default: the manifest's)")
+        parser.add_argument('--workers', type=int, default=16,
+                            help="number of files uploaded at the same time")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="number of songs uploaded and inserted per batch")
+
+    def handle(self, *args, **options):
+        manifest = options['manifest']
+        base_dir = options['base_dir'] or os.path.dirname(os.path.abspath(manifest))
+        self.audio_field = Song._meta.get_field('audio_file')
+        self.image_field = Song._meta.get_field('image')
+        self.storage = self.audio_field.storage
+        self.lock = threading.Lock()
+        self.totals = {'created': 0, 'skipped': 0, 'failed': 0, 'uploaded': 0, 'present': 0, 'bytes': 0}
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            batch = []
+            for line, row in self.read_manifest(manifest):
+                batch.append((line, row))
+                if len(batch) >= options['batch_size']:
+                    self.ingest_batch(batch, base_dir, executor, started)
+                    batch = []
+            if batch:
+                self.ingest_batch(batch, base_dir, executor, started)
+
+        elapsed = time.perf_counter() - started
+        totals = self.totals
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {totals['created']} songs, skipped {totals['skipped']} already ingested, "
+            f"{totals['failed']} failed; uploaded {totals['uploaded']} files "
+            f"({totals['bytes'] / 1024 / 1024:.1f} MB), {totals['present']} were already in the storage; "
+            f"{elapsed:.1f}s, {totals['created'] / elapsed:.1f} songs/s, "
+            f"{totals['bytes'] / 1024 / 1024 / elapsed:.1f} MB/s"
+        ))
+
+    def read_manifest(self, path: str):
+        """yields (line number, row) for every row of the manifest, rows are dicts of strings
+        """
+        if path.endswith('.csv'):
+            with open(path, newline='', encoding='utf-8') as file:
+                reader = csv.DictReader(file)
+                missing = set(REQUIRED_FIELDS) - set(reader.fieldnames or [])
+                if missing:
+                    raise CommandError(f"The manifest has no {', '.join(sorted(missing))} column")
+                for line, row in enumerate(reader, start=2):
+                    yield line, row
+        elif path.endswith('.jsonl'):
+            with open(path, encoding='utf-8') as file:
+                for line, text in enumerate(file, start=1):
+                    if text.strip():
+                        try:
+                            yield line, json.loads(text)
+                        except ValueError as e:
+                            self.fail(line, f"invalid JSON: {e}")
+        else:
+            raise CommandError("The manifest must be a .csv or .jsonl file")
+
+    def fail(self, line: int, message: str) -> None:
+        self.totals['failed'] += 1
+        self.stderr.write(f"line {line}: {message}")
+
+    def storage_name(self, field, path: str) -> str:
+        """storage name of a local file, derived from its path so that it is the same on every run
+           (the file name is shortened to fit the field, so the storage never has to rename it)
+        """
+        digest = hashlib.sha1(path.encode('utf-8')).hexdigest()[:16]
+        root, ext = os.path.splitext(os.path.basename(path))
+        name = field.generate_filename(None, f"ingest/{digest}/{root}{ext}")
+        excess = len(name) - field.max_length
+        if excess > 0:
+            name = field.generate_filename(None, f"ingest/{digest}/{root[:max(len(root) - excess, 1)]}{ext}")
+        return name
+
+    def upload(self, path: str, name: str) -> None:
+        """uploads the file to name unless the storage already has it (with the same size)
+        """
+        size = os.path.getsize(path)
+        if self.storage.exists(name):
+            if self.storage.size(name) == size:
+                with self.lock:
+                    self.totals['present'] += 1
+                return
+            # left over from an interrupted run
+            self.storage.delete(name)
+        with open(path, 'rb') as file:
+            self.storage.save(name, File(file))
+        with self.lock:
+            self.totals['uploaded'] += 1
+            self.totals['bytes'] += size
+
+    def ingest_batch(self, batch: list, base_dir: str, executor, started: float) -> None:
+        """uploads the files of the batch concurrently, then inserts its songs with one bulk_create
+        """
+        songs = []
+        for line, row in batch:
+            missing = [field for field in REQUIRED_FIELDS if not row.get(field)]
+            if missing:
+                self.fail(line, f"missing {', '.join(missing)}")
+                continue
+            audio = os.path.join(base_dir, row['audio'])
+            image = os.path.join(base_dir, row['image']) if row.get('image') else None
+            songs.append({
+                'line': line,
+                'row': row,
+                'audio': audio,
+                'audio_name': self.storage_name(self.audio_field, audio),
+                'image': image,
+                'image_name': self.storage_name(self.image_field, image) if image else None,
+            })
+
+        # songs inserted by an earlier run (or earlier in the manifest)
+        existing = set(Song.objects.filter(audio_file__in=[song['audio_name'] for song in songs])
+                       .values_list('audio_file', flat=True))
+        self.totals['skipped'] += sum(song['audio_name'] in existing for song in songs)
+        songs = [song for song in songs if song['audio_name'] not in existing]
+        unique = {song['audio_name']: song for song in reversed(songs)}
+        self.totals['skipped'] += len(songs) - len(unique)
+        songs = sorted(unique.values(), key=lambda song: song['line'])
+
+        def upload_files(song):
+            try:
+                self.upload(song['audio'], song['audio_name'])
+                if song['image']:
+                    self.upload(song['image'], song['image_name'])
+            except UPLOAD_ERRORS as e:
+                return song, e
+            return song, None
+
+        rows = []
+        for song, error in executor.map(upload_files, songs):
+            if error is not None:
+                self.fail(song['line'], str(error))
+                continue
+            row = song['row']
+            rows.append(Song(title=row['title'], artist_name=row['artist_name'], genre=row['genre'],
+                             audio_file=song['audio_name'], image=song['image_name']))
+
+        if rows:
+            rows = Song.objects.bulk_create(rows)
+            Song.update_search_vectors(Song.objects.filter(id__in=[song.id for song in rows]))
+            CatalogChange.record([song.id for song in rows])
+            self.totals['created'] += len(rows)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"{self.totals['created']} songs created, {self.totals['skipped']} skipped, "
+                          f"{self.totals['failed']} failed, {self.totals['created'] / elapsed:.1f} songs/s")
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from music.models import GenrePopularity
+
+
+class Command(BaseCommand):
+    help = "Recounts the likes of every genre from the Like table"
+
+    def handle(self, *args, **options):
+        genres = GenrePopularity.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt like counts of {genres} genres"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from music.models import Song
+
+
+class Command(BaseCommand):
+    help = "Recounts the likes of every song from the Like table and fixes the like counts that drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help="number of songs recounted per query")
+
+    def handle(self, *args, **options):
+        fixed = Song.reconcile_like_counts(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Fixed the like count of {fixed} songs"))
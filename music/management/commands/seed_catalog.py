@@ -0,0 +1,106 @@
+import time
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from authentication.models import CustomUser
+from music.models import CatalogChange, Song, Like, GenrePopularity
+
+
+class Command(BaseCommand):
+    help = ("Generates users, songs and likes with realistic skew for local load testing: "
+            "song popularity follows a Zipf distribution and users mostly like songs of a few favorite genres")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--songs', type=int, default=10000)
+        parser.add_argument('--genres', type=int, default=20)
+        parser.add_argument('--likes', type=int, default=100000,
+                            help="number of likes to generate (duplicates are dropped, so slightly fewer are created)")
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help="exponent of the Zipf distribution of song, genre and user activity")
+        parser.add_argument('--genre-affinity', type=float, default=0.8,
+                            help="probability that a like goes to one of the user's favorite genres")
+        parser.add_argument('--password', default="seed-password",
+                            help="password of the generated users (usernames are seed_user_<n>)")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        self.rng = np.random.default_rng(options['seed'])
+        self.zipf = options['zipf']
+        batch_size = options['batch_size']
+
+        user_ids = self.create_users(options['users'], options['password'], batch_size)
+        song_ids, song_genres = self.create_songs(options['songs'], options['genres'], batch_size)
+        likes = self.create_likes(user_ids, song_ids, song_genres, options['genres'],
+                                  options['likes'], options['genre_affinity'], batch_size)
+        GenrePopularity.rebuild()
+        Song.reconcile_like_counts()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(user_ids)} users, {len(song_ids)} songs and {likes} likes in {elapsed:.1f}s"
+        ))
+
+    def zipf_weights(self, n: int) -> np.ndarray:
+        weights = 1.0 / np.arange(1, n + 1) ** self.zipf
+        return weights / weights.sum()
+
+    def create_users(self, count: int, password: str, batch_size: int) -> np.ndarray:
+        start = CustomUser.objects.count()
+        password = make_password(password)  # hashed once, shared by all generated users
+        users = [
+            CustomUser(username=f"seed_user_{n}", email=f"seed_user_{n}@example.com", password=password)
+            for n in range(start, start + count)
+        ]
+        users = CustomUser.objects.bulk_create(users, batch_size=batch_size)
+        return np.array([user.id for user in users])
+
+    def create_songs(self, count: int, genres: int, batch_size: int):
+        start = Song.objects.count()
+        # genre sizes are skewed too: a few big genres and a long tail
+        song_genres = self.rng.choice(genres, size=count, p=self.zipf_weights(genres))
+        artists = max(count // 10, 1)
+        songs = [
+            Song(
+                title=f"Seed Song {n}",
+                artist_name=f"Seed Artist {self.rng.integers(artists)}",
+                audio_file=f"songs/seed/{n}.mp3",
+                genre=f"genre_{genre}"
+            )
+            for n, genre in zip(range(start, start + count), song_genres)
+        ]
+        songs = Song.objects.bulk_create(songs, batch_size=batch_size)
+        song_ids = np.array([song.id for song in songs])
+        Song.update_search_vectors(Song.objects.filter(id__range=(song_ids.min(), song_ids.max())))
+        CatalogChange.record([song.id for song in songs])
+        return song_ids, song_genres
+
+    def create_likes(self, user_ids, song_ids, song_genres, genres, count, genre_affinity, batch_size) -> int:
+        # popularity rank of every song, overall and inside its genre
+        popularity = self.zipf_weights(len(song_ids))[self.rng.permutation(len(song_ids))]
+        songs_of_genre = [np.flatnonzero(song_genres == genre) for genre in range(genres)]
+        genre_popularity = [popularity[songs] / popularity[songs].sum() if len(songs) else None
+                            for songs in songs_of_genre]
+        genre_weights = self.zipf_weights(genres)
+
+        # a few heavy users like most songs
+        users = self.rng.choice(len(user_ids), size=count, p=self.zipf_weights(len(user_ids)))
+        favorite_genres = self.rng.choice(genres, size=(len(user_ids), 3), p=genre_weights)
+
+        songs = self.rng.choice(len(song_ids), size=count, p=popularity)
+        in_favorite = self.rng.random(count) < genre_affinity
+        favorite = favorite_genres[users, self.rng.integers(3, size=count)]
+        for genre in range(genres):
+            mask = in_favorite & (favorite == genre)
+            if genre_popularity[genre] is not None and mask.any():
+                songs[mask] = self.rng.choice(songs_of_genre[genre], size=mask.sum(), p=genre_popularity[genre])
+
+        pairs = np.unique(np.stack([user_ids[users], song_ids[songs]], axis=1), axis=0)
+        for start in range(0, len(pairs), batch_size):
+            Like.objects.bulk_create(
+                [Like(user_id=int(user_id), song_id=int(song_id)) for user_id, song_id in pairs[start:start + batch_size]],
+                ignore_conflicts=True
+            )
+        return len(pairs)
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Song',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=256)),
+                ('artist_name', models.CharField(max_length=256)),
+                ('audio_file', models.FileField(upload_to='songs/')),
+                ('image', models.ImageField(default=None, null=True, upload_to='song_images')),
+                ('genre', models.CharField(max_length=128)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Like',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='music.song')),
+            ],
+            options={
+                'unique_together': {('user', 'song')},
+            },
+        ),
+    ]
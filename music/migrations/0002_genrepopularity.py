@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:41
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_genre_likes(apps, schema_editor):
+    Like = apps.get_model('music', 'Like')
+    GenrePopularity = apps.get_model('music', 'GenrePopularity')
+    counts = Like.objects.values('song__genre').annotate(like_count=Count('id'))
+    GenrePopularity.objects.bulk_create(
+        [GenrePopularity(genre=row['song__genre'], like_count=row['like_count']) for row in counts],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenrePopularity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('genre', models.CharField(max_length=128, unique=True)),
+                ('like_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_genre_likes, migrations.RunPython.noop),
+    ]
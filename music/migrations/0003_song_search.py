@@ -0,0 +1,47 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:42
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+def fill_search_vectors(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Song = apps.get_model('music', 'Song')
+    Song.objects.update(
+        search_vector=SearchVector('title', weight='A', config='simple')
+        + SearchVector('artist_name', weight='A', config='simple')
+        + SearchVector('genre', weight='B', config='simple')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0002_genrepopularity'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='song',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='song',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='song_search_vector_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['title'], name='song_title_trgm_gin', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['artist_name'], name='song_artist_name_trgm_gin', opclasses=['gin_trgm_ops']),
+        ),
+    ]
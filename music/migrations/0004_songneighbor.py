@@ -0,0 +1,26 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0003_song_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbor_of', to='music.song')),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='music.song')),
+            ],
+            options={
+                'unique_together': {('song', 'neighbor')},
+            },
+        ),
+    ]
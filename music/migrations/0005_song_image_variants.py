@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 11:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0004_songneighbor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='image_variants',
+            field=models.JSONField(default=None, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.1 on 2026-10-18 11:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0005_song_image_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=1024)),
+                ('upload_id', models.CharField(max_length=1024)),
+                ('size', models.BigIntegerField()),
+                ('part_size', models.BigIntegerField()),
+                ('content_type', models.CharField(max_length=128)),
+                ('title', models.CharField(max_length=256)),
+                ('artist_name', models.CharField(max_length=256)),
+                ('genre', models.CharField(max_length=128)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('aborted', 'Aborted')], default='pending', max_length=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('song', models.OneToOneField(default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, to='music.song')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.1 on 2026-10-18 11:12
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_song_likes(apps, schema_editor):
+    Like = apps.get_model('music', 'Like')
+    Song = apps.get_model('music', 'Song')
+    counts = Like.objects.filter(song=OuterRef('pk')).order_by().values('song')\
+        .annotate(count=Count('id')).values('count')
+    Song.objects.update(like_count=Coalesce(Subquery(counts, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0006_songupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='like_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['like_count', 'id'], name='song_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['genre', 'like_count', 'id'], name='song_genre_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['genre', 'id'], name='song_genre_idx'),
+        ),
+        migrations.RunPython(count_song_likes, migrations.RunPython.noop),
+    ]
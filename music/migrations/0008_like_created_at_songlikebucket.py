@@ -0,0 +1,40 @@
+# Generated by Django 5.2.1 on 2026-10-18 11:14
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0007_song_like_count'),
+    ]
+
+    operations = [
+        # the likes that already exist were made at an unknown time, they are not counted in any bucket
+        migrations.AddField(
+            model_name='like',
+            name='created_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='like',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, null=True),
+        ),
+        migrations.CreateModel(
+            name='SongLikeBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.IntegerField()),
+                ('hours', models.SmallIntegerField(default=1)),
+                ('count', models.IntegerField(default=0)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='music.song')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hours', 'hour'], name='songlikebucket_hours_hour_idx')],
+                'unique_together': {('song', 'hours', 'hour')},
+            },
+        ),
+    ]
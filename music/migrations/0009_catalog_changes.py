@@ -0,0 +1,55 @@
+# Generated by Django 5.2.1 on 2026-10-18 11:22
+
+from django.db import migrations, models
+
+
+def record_existing_songs(apps, schema_editor):
+    Song = apps.get_model('music', 'Song')
+    CatalogChange = apps.get_model('music', 'CatalogChange')
+    CatalogCounter = apps.get_model('music', 'CatalogCounter')
+    song_ids = Song.objects.order_by('id').values_list('id', flat=True)
+    CatalogChange.objects.bulk_create(
+        (CatalogChange(song_id=song_id, version=1) for song_id in song_ids.iterator(chunk_size=10000)),
+        batch_size=10000
+    )
+    CatalogCounter.objects.create(id=1, version=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0008_like_created_at_songlikebucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('song_id', models.BigIntegerField(unique=True)),
+                ('version', models.BigIntegerField(db_index=True)),
+                ('deleted', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CatalogCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CatalogSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField()),
+                ('name', models.CharField(max_length=255)),
+                ('gzip_name', models.CharField(max_length=255)),
+                ('brotli_name', models.CharField(blank=True, max_length=255)),
+                ('songs', models.IntegerField()),
+                ('size', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(record_existing_songs, migrations.RunPython.noop),
+    ]
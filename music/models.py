@@ -1,59 +1,309 @@
-from django.db import models
-from django.db.models import Exists, OuterRef
+import math
+import os
+import uuid
+from collections import Counter
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    SearchVectorField,
+    TrigramWordSimilarity
+)
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import connection, models, transaction
+from django.db.models import (
+    Count, Exists, ExpressionWrapper, F, FloatField, IntegerField, OuterRef, Q, QuerySet, Subquery, Sum, Value
+)
+from django.db.models.functions import Cast, Coalesce, Exp, Greatest
+from django.utils import timezone
 from authentication.models import CustomUser
-from django.db.models import QuerySet
-from django.db.models import Count, Q, Subquery, OuterRef
-from django.db.models import Count, OuterRef, Subquery, IntegerField, Q
+from spotechnify_server import db_router
+from spotechnify_server.images import current_variants
+from spotechnify_server.instrumentation import get_cache_stats
+from . import conditional
 
 # Create your models here.
 
+class SongQuerySet(QuerySet):
+    def delete(self):
+        """records the deletes in the catalog changes (tombstones), like Song.delete()
+        """
+        with transaction.atomic():
+            song_ids = list(self.values_list('id', flat=True))
+            result = super().delete()
+            CatalogChange.record(song_ids, deleted=True)
+        return result
+
+
 class Song(models.Model):
     title = models.CharField(max_length=256)
     artist_name = models.CharField(max_length=256)
     audio_file = models.FileField(upload_to='songs/')
     image = models.ImageField(upload_to="song_images", default=None, null=True)
     genre = models.CharField(max_length=128)
+    # resized copies of image, built in the background by the build_image_variants command (see images.py)
+    image_variants = models.JSONField(null=True, default=None, editable=False)
+    # number of likes, kept up to date by Like.apply_changes (reconcile_like_counts fixes drift)
+    like_count = models.IntegerField(default=0, editable=False)
+    # tsvector of title, artist_name and genre, kept up to date by save() (postgres only)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    SEARCH_CONFIG = 'simple'
+    CATALOG_VERSION_CACHE_KEY = "catalog_version"
+    RECOMMENDED_IDS_CACHE_KEY = "recommended_ids:{user_id}"
+    RECOMMENDATION_EPOCH_CACHE_KEY = "recommendation_epoch"
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='song_search_vector_gin'),
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='song_title_trgm_gin'),
+            GinIndex(fields=['artist_name'], opclasses=['gin_trgm_ops'], name='song_artist_name_trgm_gin'),
+            # popular songs, overall and per genre (scanned backwards for the descending order)
+            models.Index(fields=['like_count', 'id'], name='song_popular_idx'),
+            models.Index(fields=['genre', 'like_count', 'id'], name='song_genre_popular_idx'),
+            # newest songs of a genre (see get_genre_recommended_for_user)
+            models.Index(fields=['genre', 'id'], name='song_genre_idx'),
+        ]
+
+    objects = SongQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        self.image_variants = current_variants(self.image, self.image_variants)
+        super().save(*args, **kwargs)
+        Song.update_search_vectors(Song.objects.filter(pk=self.pk))
+        CatalogChange.record([self.pk])
+
+    def delete(self, *args, **kwargs):
+        song_id = self.pk
+        result = super().delete(*args, **kwargs)
+        CatalogChange.record([song_id], deleted=True)
+        return result
+
+    @staticmethod
+    def get_catalog_version() -> str:
+        """version of the song catalog, changes on every song write (used in the ETags of song lists)
+        """
+        return conditional.get_version(Song.CATALOG_VERSION_CACHE_KEY)
+
+    @staticmethod
+    async def aget_catalog_version() -> str:
+        return await conditional.aget_version(Song.CATALOG_VERSION_CACHE_KEY)
+
+    @staticmethod
+    def bump_catalog_version() -> None:
+        """called by CatalogChange.record, which must be called after writes that bypass save()/delete()
+           (bulk_create, update)
+        """
+        conditional.bump_version(Song.CATALOG_VERSION_CACHE_KEY)
+
+    @staticmethod
+    def update_search_vectors(queryset: QuerySet) -> int:
+        """recomputes the search vector of the songs of the queryset
+           must be called after writes that bypass save() (bulk_create, update)
+
+        Args:
+            queryset (QuerySet): songs to update
+
+        Returns:
+            int: number of updated songs
+        """
+        if connection.vendor != 'postgresql':
+            return 0
+        search_vector = SearchVector('title', weight='A', config=Song.SEARCH_CONFIG) \
+            + SearchVector('artist_name', weight='A', config=Song.SEARCH_CONFIG) \
+            + SearchVector('genre', weight='B', config=Song.SEARCH_CONFIG)
+        return queryset.update(search_vector=search_vector)
 
     @staticmethod
     def annotate_by_like(user: CustomUser, queryset: QuerySet=None)-> QuerySet:
         if not queryset:
             queryset = Song.objects.all()
-        liked_subquery = Like.objects.filter(user=user, song=OuterRef('pk'))
+        liked_subquery = Like.objects.filter(user_id=user.pk, song=OuterRef('pk'))
         annotated_by_like = queryset.annotate(liked=Exists(liked_subquery))
         return annotated_by_like
 
 
 
     @staticmethod
-    def get_liked_by_user(user: CustomUser)-> QuerySet:
-        return Song.annotate_by_like(user).filter(like__user=user)
+    def get_liked_by_user(user: CustomUser, annotate_liked: bool=True)-> QuerySet:
+        if not annotate_liked:
+            return Song.objects.filter(like__user_id=user.pk)
+        return Song.annotate_by_like(user).filter(like__user_id=user.pk)
 
     @staticmethod
     def get_recommended_for_user(user: CustomUser)-> QuerySet:
+        """songs not liked by the user, scored by the similarity ("score") of their neighbors to the liked songs
+           falls back to get_genre_recommended_for_user if no neighbors are built for the liked songs
+        """
+        if not Song.has_neighbors(user):
+            return Song.get_genre_recommended_for_user(user)
+        return Song.get_neighbor_recommended_for_user(user)
+
+    @staticmethod
+    def has_neighbors(user: CustomUser) -> bool:
+        return SongNeighbor.objects.filter(song__like__user_id=user.pk).exists()
 
-        # Step 1: Get genres the user has liked
-        liked_genres = Song.objects.filter(like__user=user).values('genre').distinct()
-        # Step 2: Subquery to count likes per genre
-        genre_like_counts = Like.objects.filter(song__genre=OuterRef('genre'))\
-            .values('song__genre')\
-            .annotate(genre_likes=Count('id'))\
-            .values('genre_likes')
-        # Step 3: Filter songs not liked by the user, with liked genres, and annotate
-        recommendation = Song.objects.filter(
-            genre__in=Subquery(liked_genres.values('genre'))).exclude(
-            like__user=user
-        ).annotate(genre_likes=Subquery(genre_like_counts, output_field=IntegerField()))\
-        .order_by('-genre_likes', '-id')  # sort by genre like count (ascending), then id as tie-breaker
+    @staticmethod
+    def get_neighbor_recommended_for_user(user: CustomUser)-> QuerySet:
+        recommendation = Song.objects.filter(neighbor_of__song__like__user_id=user.pk).exclude(
+            like__user_id=user.pk
+        ).annotate(score=Sum('neighbor_of__score'))\
+        .order_by('-score', '-id')
         return recommendation
 
     @staticmethod
-    def search(user: CustomUser, query: str)-> QuerySet:
+    def get_recommended_ids_for_user(user: CustomUser) -> list:
+        """ids of get_recommended_for_user, best first, at most RECOMMENDATION_CACHE_SIZE of them
+           the list is cached with the likes version of the user and the recommendation epoch it was computed at,
+           it is stale (and recomputed on the next read) once the user likes/unlikes a song
+           or the epoch changes (see invalidate_recommendations)
+           a genre fallback list also keeps the like counts of its genres, and is stale once one of them moved by
+           more than RECOMMENDATION_GENRE_DRIFT of itself (see GenrePopularity.has_drifted),
+           the neighbor lists do not depend on the genre counts
+        """
+        key = Song.RECOMMENDED_IDS_CACHE_KEY.format(user_id=user.pk)
+        likes_version_key = Like.LIKES_VERSION_CACHE_KEY.format(user_id=user.pk)
+        cached = cache.get_many([key, likes_version_key, Song.RECOMMENDATION_EPOCH_CACHE_KEY,
+                                 GenrePopularity.COUNTS_CACHE_KEY])
+        # versions are read before computing, so a list computed from data older than a bump is never valid
+        likes_version = cached.get(likes_version_key) or Like.get_likes_version(user)
+        epoch = cached.get(Song.RECOMMENDATION_EPOCH_CACHE_KEY) \
+            or conditional.get_version(Song.RECOMMENDATION_EPOCH_CACHE_KEY)
+        stats = get_cache_stats('recommendations')
+        entry = cached.get(key)
+        if entry is not None and entry['likes_version'] == likes_version and entry['epoch'] == epoch and (
+            entry['genre_counts'] is None or not GenrePopularity.has_drifted(
+                entry['genre_counts'], cached.get(GenrePopularity.COUNTS_CACHE_KEY) or GenrePopularity.get_counts()
+            )
+        ):
+            stats.hit()
+            return entry['ids']
+        stats.miss(stale=entry is not None)
+
+        limit = settings.RECOMMENDATION_CACHE_SIZE
+        if Song.has_neighbors(user):
+            ids = list(Song.get_neighbor_recommended_for_user(user).values_list('id', flat=True)[:limit])
+            genre_counts = None
+        else:
+            counts = cached.get(GenrePopularity.COUNTS_CACHE_KEY) or GenrePopularity.get_counts()
+            # genre_likes is selected anyway, the union is ordered by it
+            rows = list(Song.get_genre_recommended_for_user(user).values_list('id', 'genre', 'genre_likes')[:limit])
+            ids = [song_id for song_id, _, _ in rows]
+            genre_counts = {genre: counts.get(genre, 0) for _, genre, _ in rows}
+        cache.set(key, {'likes_version': likes_version, 'epoch': epoch, 'genre_counts': genre_counts, 'ids': ids},
+                  settings.RECOMMENDATION_CACHE_TIMEOUT)
+        return ids
+
+    @staticmethod
+    def invalidate_recommendations() -> None:
+        """makes the cached recommendations of every user stale, e.g. after the neighbors are rebuilt
+        """
+        conditional.bump_version(Song.RECOMMENDATION_EPOCH_CACHE_KEY)
+
+    @staticmethod
+    def get_by_ids(ids: list) -> list:
+        """the songs with the ids, in the order of ids (missing songs are skipped), with one query
+        """
+        songs = Song.objects.in_bulk(ids)
+        return [songs[song_id] for song_id in ids if song_id in songs]
+
+    @staticmethod
+    def get_genre_recommended_for_user(user: CustomUser)-> QuerySet:
+        """songs not liked by the user, of the genres of the liked songs, by the like count of their genre
+           ("genre_likes"), then id
+           each genre is read on its own through song_genre_idx, newest first and at most
+           RECOMMENDATION_CACHE_SIZE songs of it, so only the first RECOMMENDATION_CACHE_SIZE songs are complete
+        """
+        # Step 1: Get genres the user has liked, with the maintained like count of the genre
+        genre_like_counts = GenrePopularity.objects.filter(genre=OuterRef('genre'))\
+            .values('like_count')[:1]
+        liked_genres = Song.get_liked_genres(user)\
+            .annotate(genre_likes=Coalesce(Subquery(genre_like_counts, output_field=IntegerField()), 0))
+        # Step 2: The newest songs not liked by the user of each genre, sorted by genre like count, then id
+        limit = settings.RECOMMENDATION_CACHE_SIZE
+        songs_of_genres = [
+            Song.objects.filter(genre=genre).exclude(like__user_id=user.pk)
+            .annotate(genre_likes=Value(genre_likes, output_field=IntegerField())).order_by('-id')[:limit]
+            for genre, genre_likes in liked_genres
+        ]
+        if not songs_of_genres:
+            return Song.objects.annotate(genre_likes=Value(0, output_field=IntegerField())).none()
+        if len(songs_of_genres) == 1:
+            return songs_of_genres[0]
+        return songs_of_genres[0].union(*songs_of_genres[1:], all=True).order_by('-genre_likes', '-id')
+
+    @staticmethod
+    def get_liked_genres(user: CustomUser) -> QuerySet:
+        """distinct genres of the songs liked by the user, as values_list('genre')
+        """
+        return Song.objects.filter(like__user_id=user.pk).values_list('genre').distinct()
+
+    @staticmethod
+    def get_popular(user: CustomUser, genre: str=None, annotate_liked: bool=True)-> QuerySet:
+        """songs by like count (then id), optionally of one genre
+        """
+        songs = Song.annotate_by_like(user) if annotate_liked else Song.objects.all()
+        if genre:
+            songs = songs.filter(genre=genre)
+        return songs.order_by('-like_count', '-id')
+
+    @staticmethod
+    def reconcile_like_counts(batch_size: int = 10000) -> int:
+        """recounts like_count from the Like table, batch_size songs at a time
+
+        Returns:
+            int: number of songs whose like_count had drifted
+        """
+        counts = Like.objects.filter(song=OuterRef('pk')).order_by().values('song')\
+            .annotate(count=Count('id')).values('count')
+        fixed = 0
+        last_id = 0
+        while True:
+            ids = list(Song.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return fixed
+            last_id = ids[-1]
+            drifted = [
+                Song(id=song_id, like_count=actual)
+                for song_id, actual in Song.objects.filter(id__in=ids)
+                .annotate(actual=Coalesce(Subquery(counts, output_field=IntegerField()), 0))
+                .exclude(like_count=F('actual')).values_list('id', 'actual')
+            ]
+            Song.objects.bulk_update(drifted, ['like_count'])
+            fixed += len(drifted)
+
+    @staticmethod
+    def search(user: CustomUser, query: str, annotate_liked: bool=True)-> QuerySet:
+        """songs matching the query, ordered by relevance ("rank") then id
+           on postgres whole words are matched with the search vector and partial words with trigrams,
+           other databases fall back to icontains with a constant rank
+        """
+        songs = Song.annotate_by_like(user) if annotate_liked else Song.objects.all()
         query_words = query.split()
-        q_objects = Q()
-        for word in query_words:
-            q_objects |= Q(title__icontains=word)
-            q_objects |= Q(artist_name__icontains=word)
-        similar_songs = Song.annotate_by_like(user).filter(q_objects).distinct()
+        if not query_words or connection.vendor != 'postgresql':
+            q_objects = Q()
+            for word in query_words:
+                q_objects |= Q(title__icontains=word)
+                q_objects |= Q(artist_name__icontains=word)
+                q_objects |= Q(genre__icontains=word)
+            return songs.filter(q_objects)\
+                .annotate(rank=Value(0.0, output_field=FloatField()))\
+                .order_by('-rank', '-id')
+
+        query = ' '.join(query_words)
+        search_query = SearchQuery(query, search_type='websearch', config=Song.SEARCH_CONFIG)
+        similarity = Greatest(TrigramWordSimilarity(query, 'title'), TrigramWordSimilarity(query, 'artist_name'))
+        similar_songs = songs.filter(
+            Q(search_vector=search_query)
+            | Q(title__trigram_word_similar=query)
+            | Q(artist_name__trigram_word_similar=query)
+        ).annotate(
+            # double precision, a real rank would not round-trip through the pagination cursor exactly
+            rank=Cast(SearchRank(F('search_vector'), search_query) + similarity, FloatField())
+        ).order_by('-rank', '-id')
         return similar_songs
 
 
@@ -62,13 +312,608 @@ class Song(models.Model):
 
 
 class Like(models.Model):
-    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    LIKED_SONG_IDS_CACHE_KEY = "liked_song_ids:{user_id}"
+    LIKES_VERSION_CACHE_KEY = "likes_version:{user_id}"
+    # results of apply_changes for each song id
+    LIKED = "liked"
+    ALREADY_LIKED = "already_liked"
+    UNLIKED = "unliked"
+    NOT_LIKED = "not_liked"
+    NOT_FOUND = "not_found"
+
+    # lookups by user use the (user, song) unique index, a separate user index would only slow down writes
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, db_index=False)
     song = models.ForeignKey(Song, on_delete=models.CASCADE)
+    # null for the likes made before it was added, they are not counted in any trending bucket
+    created_at = models.DateTimeField(default=timezone.now, null=True)
 
     class Meta:
         unique_together = [
             ("user", "song")
         ]
 
+    @staticmethod
+    def apply_changes(user: CustomUser, like_song_ids: list, unlike_song_ids: list) -> dict:
+        """likes and unlikes songs for the user in one transaction
+           likes are inserted with one INSERT ... ON CONFLICT DO NOTHING and unlikes removed with one DELETE,
+           and the like counts of the songs and genres, the trending buckets and the cached liked song ids
+           are updated accordingly,
+           and the user's reads are pinned to the primary for a while, so the replicas' lag is not visible to them
+
+        Args:
+            user (CustomUser): the user who likes/unlikes
+            like_song_ids (list): ids of the songs to like
+            unlike_song_ids (list): ids of the songs to unlike
+
+        Returns:
+            dict: song id -> result (LIKED, ALREADY_LIKED, UNLIKED, NOT_LIKED or NOT_FOUND)
+        """
+        like_song_ids = list(dict.fromkeys(like_song_ids))
+        unlike_song_ids = list(dict.fromkeys(unlike_song_ids))
+        results = {}
+        with transaction.atomic():
+            # concurrent changes of the user run one after the other, so two unlikes of a song
+            # never both see it liked and both decrement its like count
+            CustomUser.objects.select_for_update().only('id').get(pk=user.pk)
+            song_genres = dict(
+                Song.objects.filter(id__in=like_song_ids + unlike_song_ids).values_list('id', 'genre')
+            )
+            liked_before = set(
+                Like.objects.filter(user_id=user.pk, song_id__in=song_genres).values_list('song_id', flat=True)
+            )
+            to_like = [song_id for song_id in like_song_ids if song_id in song_genres and song_id not in liked_before]
+            to_unlike = [song_id for song_id in unlike_song_ids if song_id in liked_before]
+
+            if to_like:
+                Like.objects.bulk_create([Like(user_id=user.pk, song_id=song_id) for song_id in to_like],
+                                         ignore_conflicts=True)
+                Song.objects.filter(id__in=to_like).update(like_count=F('like_count') + 1)
+                SongLikeBucket.add_likes(to_like)
+            if to_unlike:
+                unliked = Like.objects.filter(user_id=user.pk, song_id__in=to_unlike)
+                SongLikeBucket.remove_likes(unliked.values_list('song_id', 'created_at'))
+                unliked.delete()
+                Song.objects.filter(id__in=to_unlike).update(like_count=F('like_count') - 1)
+
+            genre_deltas = Counter(song_genres[song_id] for song_id in to_like)
+            genre_deltas.subtract(song_genres[song_id] for song_id in to_unlike)
+            for genre, delta in genre_deltas.items():
+                if delta:
+                    GenrePopularity.add_likes(genre, delta)
+            if to_like or to_unlike:
+                Like.bump_likes_version(user)
+                db_router.pin_to_primary(user.pk)
+
+        for song_id in like_song_ids:
+            if song_id not in song_genres:
+                results[song_id] = Like.NOT_FOUND
+            else:
+                results[song_id] = Like.ALREADY_LIKED if song_id in liked_before else Like.LIKED
+        for song_id in unlike_song_ids:
+            if song_id not in song_genres:
+                results[song_id] = Like.NOT_FOUND
+            else:
+                results[song_id] = Like.UNLIKED if song_id in liked_before else Like.NOT_LIKED
+        return results
+
+    @staticmethod
+    def get_liked_song_ids(user: CustomUser) -> set:
+        """ids of the songs liked by the user, read from the cache if LIKED_SONGS_MODE is "cache"
+           the cached set is kept with the likes version of the user it was read at,
+           it is stale (and read again) once the user likes/unlikes a song
+
+        Args:
+            user (CustomUser): the user
+
+        Returns:
+            set: ids of the liked songs
+        """
+        liked_song_ids = Like.objects.filter(user_id=user.pk).values_list('song_id', flat=True)
+        if settings.LIKED_SONGS_MODE != 'cache':
+            return set(liked_song_ids)
+        key = Like.LIKED_SONG_IDS_CACHE_KEY.format(user_id=user.pk)
+        likes_version_key = Like.LIKES_VERSION_CACHE_KEY.format(user_id=user.pk)
+        cached = cache.get_many([key, likes_version_key])
+        # the version is read before the likes, so a set read before a like/unlike commits is never valid after it
+        likes_version = cached.get(likes_version_key) or Like.get_likes_version(user)
+        entry = cached.get(key)
+        if entry is not None and entry['likes_version'] == likes_version:
+            return entry['ids']
+        ids = set(liked_song_ids)
+        cache.set(key, {'likes_version': likes_version, 'ids': ids}, settings.LIKED_SONG_IDS_CACHE_TIMEOUT)
+        return ids
+
+    @staticmethod
+    async def aget_liked_song_ids(user: CustomUser) -> set:
+        """same as get_liked_song_ids, for async views
+        """
+        liked_song_ids = Like.objects.filter(user_id=user.pk).values_list('song_id', flat=True)
+        if settings.LIKED_SONGS_MODE != 'cache':
+            return {song_id async for song_id in liked_song_ids}
+        key = Like.LIKED_SONG_IDS_CACHE_KEY.format(user_id=user.pk)
+        likes_version_key = Like.LIKES_VERSION_CACHE_KEY.format(user_id=user.pk)
+        cached = await cache.aget_many([key, likes_version_key])
+        likes_version = cached.get(likes_version_key) or await Like.aget_likes_version(user)
+        entry = cached.get(key)
+        if entry is not None and entry['likes_version'] == likes_version:
+            return entry['ids']
+        ids = {song_id async for song_id in liked_song_ids}
+        await cache.aset(key, {'likes_version': likes_version, 'ids': ids}, settings.LIKED_SONG_IDS_CACHE_TIMEOUT)
+        return ids
+
+    @staticmethod
+    def get_likes_version(user: CustomUser) -> str:
+        """version of the likes of the user, changes on every like/unlike (used in the ETags of song lists)
+        """
+        return conditional.get_version(Like.LIKES_VERSION_CACHE_KEY.format(user_id=user.pk))
+
+    @staticmethod
+    async def aget_likes_version(user: CustomUser) -> str:
+        return await conditional.aget_version(Like.LIKES_VERSION_CACHE_KEY.format(user_id=user.pk))
+
+    @staticmethod
+    def bump_likes_version(user: CustomUser) -> None:
+        conditional.bump_version(Like.LIKES_VERSION_CACHE_KEY.format(user_id=user.pk))
+
+    def __str__(self):
+        return f"{self.user}, {self.song}"
+
+
+class GenrePopularity(models.Model):
+    """total number of likes of the songs of each genre
+       kept up to date by the like/unlike views, so ranking does not need to count the Like table
+    """
+    genre = models.CharField(max_length=128, unique=True)
+    like_count = models.IntegerField(default=0)
+
+    COUNTS_CACHE_KEY = "genre_like_counts"
+
+    @staticmethod
+    def get_counts() -> dict:
+        """like count of every genre, cached for GENRE_COUNTS_CACHE_TIMEOUT seconds
+
+        Returns:
+            dict: {genre: like count}
+        """
+        counts = dict(GenrePopularity.objects.values_list('genre', 'like_count'))
+        cache.set(GenrePopularity.COUNTS_CACHE_KEY, counts, settings.GENRE_COUNTS_CACHE_TIMEOUT)
+        return counts
+
+    @staticmethod
+    def has_drifted(snapshot: dict, counts: dict) -> bool:
+        """True once the like count of a genre of snapshot moved by more than RECOMMENDATION_GENRE_DRIFT of itself
+
+        Args:
+            snapshot (dict): {genre: like count} when a ranking was computed
+            counts (dict): current {genre: like count} (see get_counts)
+        """
+        return any(abs(counts.get(genre, 0) - count) > settings.RECOMMENDATION_GENRE_DRIFT * max(count, 1)
+                   for genre, count in snapshot.items())
+
+    @staticmethod
+    def add_likes(genre: str, count: int) -> None:
+        """adds count (may be negative) to the like count of the genre
+
+        Args:
+            genre (str): genre of the liked/unliked song
+            count (int): number of likes added, negative for unlikes
+        """
+        updated = GenrePopularity.objects.filter(genre=genre).update(like_count=F('like_count') + count)
+        if not updated:
+            GenrePopularity.objects.bulk_create([GenrePopularity(genre=genre)], ignore_conflicts=True)
+            GenrePopularity.objects.filter(genre=genre).update(like_count=F('like_count') + count)
+
+    @staticmethod
+    def rebuild() -> int:
+        """recounts the likes of every genre from the Like table
+
+        Returns:
+            int: number of genres
+        """
+        counts = Like.objects.values('song__genre').annotate(like_count=Count('id'))
+        rows = [GenrePopularity(genre=row['song__genre'], like_count=row['like_count']) for row in counts]
+        with transaction.atomic():
+            GenrePopularity.objects.all().delete()
+            GenrePopularity.objects.bulk_create(rows, batch_size=1000)
+        return len(rows)
+
+    def __str__(self):
+        return f"{self.genre}: {self.like_count}"
+
+
+class SongLikeBucket(models.Model):
+    """number of current likes of a song that were made in one hour (hours=1) or one day (hours=24),
+       likes go to the bucket of the current hour, and the compact_like_buckets command
+       rolls old hourly buckets into daily ones and deletes the buckets that left the trending window
+    """
+    TRENDING_IDS_CACHE_KEY = "trending_song_ids"
+    HOUR = 1
+    DAY = 24
+
+    song = models.ForeignKey(Song, on_delete=models.CASCADE)
+    # hours since the epoch of the start of the bucket
+    hour = models.IntegerField()
+    hours = models.SmallIntegerField(default=HOUR)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [
+            ("song", "hours", "hour")
+        ]
+        indexes = [
+            # the buckets of the trending window and the ones compact() rolls up or deletes, by kind
+            models.Index(fields=['hours', 'hour'], name='songlikebucket_hours_hour_idx'),
+        ]
+
+    @staticmethod
+    def hour_of(moment) -> int:
+        return int(moment.timestamp()) // 3600
+
+    @staticmethod
+    def add_likes(song_ids: list) -> None:
+        """counts a new like of each song in the bucket of the current hour
+        """
+        hour = SongLikeBucket.hour_of(timezone.now())
+        SongLikeBucket.objects.bulk_create([SongLikeBucket(song_id=song_id, hour=hour) for song_id in song_ids],
+                                           ignore_conflicts=True)
+        SongLikeBucket.objects.filter(song_id__in=song_ids, hours=SongLikeBucket.HOUR, hour=hour)\
+            .update(count=F('count') + 1)
+
+    @staticmethod
+    def remove_likes(likes) -> None:
+        """uncounts removed likes from the buckets they were counted in (hourly, or daily once compacted),
+           likes older than the trending window have no bucket anymore, likes without created_at never had one
+
+        Args:
+            likes (iterable): (song id, created_at) of the removed likes, at most one per song
+        """
+        condition = Q()
+        for song_id, created_at in likes:
+            if created_at is None:
+                continue
+            hour = SongLikeBucket.hour_of(created_at)
+            condition |= Q(song_id=song_id, hours=SongLikeBucket.HOUR, hour=hour)
+            condition |= Q(song_id=song_id, hours=SongLikeBucket.DAY, hour=hour - hour % SongLikeBucket.DAY)
+        if condition:
+            SongLikeBucket.objects.filter(condition).update(count=F('count') - 1)
+
+    @staticmethod
+    def compact(now=None) -> tuple:
+        """rolls the hourly buckets older than TRENDING_HOURLY_HOURS into daily buckets
+           and deletes the buckets that ended before the trending window
+
+        Returns:
+            tuple: (number of hourly buckets rolled up, number of buckets deleted)
+        """
+        current_hour = SongLikeBucket.hour_of(now or timezone.now())
+        window_start = current_hour - settings.TRENDING_WINDOW_HOURS
+        # only whole days are rolled up, so a daily bucket never receives hourly ones twice
+        rollup_end = current_hour - settings.TRENDING_HOURLY_HOURS
+        rollup_end -= rollup_end % SongLikeBucket.DAY
+        with transaction.atomic():
+            deleted, _ = SongLikeBucket.objects.filter(
+                Q(hours=SongLikeBucket.HOUR, hour__lt=window_start)
+                | Q(hours=SongLikeBucket.DAY, hour__lte=window_start - SongLikeBucket.DAY)
+            ).delete()
+            hourly = SongLikeBucket.objects.select_for_update()\
+                .filter(hours=SongLikeBucket.HOUR, hour__lt=rollup_end)
+            days = Counter()
+            rolled = 0
+            for song_id, hour, count in hourly.values_list('song_id', 'hour', 'count'):
+                days[(song_id, hour - hour % SongLikeBucket.DAY)] += count
+                rolled += 1
+            SongLikeBucket.objects.bulk_create(
+                [SongLikeBucket(song_id=song_id, hour=day, hours=SongLikeBucket.DAY)
+                 for song_id, day in days],
+                ignore_conflicts=True, batch_size=1000
+            )
+            for (song_id, day), count in days.items():
+                if count:
+                    SongLikeBucket.objects.filter(song_id=song_id, hours=SongLikeBucket.DAY, hour=day)\
+                        .update(count=F('count') + count)
+            hourly.delete()
+        return rolled, deleted
+
+    @staticmethod
+    def get_window_buckets(current_hour: int) -> QuerySet:
+        """the hourly and daily buckets of the trending window, read through songlikebucket_hours_hour_idx
+           a daily bucket counts while any hour of it is in the window, as compact() keeps it until then
+        """
+        window_start = current_hour - settings.TRENDING_WINDOW_HOURS
+        return SongLikeBucket.objects.filter(
+            Q(hours=SongLikeBucket.HOUR, hour__gte=window_start)
+            | Q(hours=SongLikeBucket.DAY, hour__gt=window_start - SongLikeBucket.DAY)
+        )
+
+    @staticmethod
+    def get_trending_ids() -> list:
+        """ids of the TRENDING_SIZE songs with the highest trending score, highest first, cached for
+           TRENDING_CACHE_TIMEOUT seconds; the score is the sum of the bucket counts of the trending window,
+           each decayed exponentially (TRENDING_HALF_LIFE_HOURS) by the age of the middle of its bucket
+           every bucket of the window is aggregated, never the Like table: one row per song and hour liked in
+           the last TRENDING_HOURLY_HOURS and one per song and day before that, as long as compact_like_buckets
+           runs, so the cost follows the number of songs liked lately, not the number of likes
+        """
+        stats = get_cache_stats('trending')
+        cached = cache.get(SongLikeBucket.TRENDING_IDS_CACHE_KEY)
+        if cached is not None:
+            stats.hit()
+            return cached
+        stats.miss()
+        current_hour = SongLikeBucket.hour_of(timezone.now())
+        decay = math.log(2) / settings.TRENDING_HALF_LIFE_HOURS
+        age = ExpressionWrapper(
+            Value(current_hour + 0.5) - F('hour') - F('hours') / Value(2.0), output_field=FloatField()
+        )
+        ids = list(
+            SongLikeBucket.get_window_buckets(current_hour)
+            .values('song_id')
+            .annotate(score=Sum(F('count') * Exp(-decay * age), output_field=FloatField()))
+            .filter(score__gt=0)
+            .order_by('-score', '-song_id')
+            .values_list('song_id', flat=True)[:settings.TRENDING_SIZE]
+        )
+        cache.set(SongLikeBucket.TRENDING_IDS_CACHE_KEY, ids, settings.TRENDING_CACHE_TIMEOUT)
+        return ids
+
+    def __str__(self):
+        return f"{self.song_id} @ {self.hour} (+{self.hours}h): {self.count}"
+
+
+class SongNeighbor(models.Model):
+    """one of the most similar songs of a song, by cosine similarity of the sets of users who liked them
+       built offline by the build_song_neighbors command
+    """
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='neighbor_of')
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = [
+            ("song", "neighbor")
+        ]
+
+    def __str__(self):
+        return f"{self.song_id} -> {self.neighbor_id}: {self.score}"
+
+
+class SongUpload(models.Model):
+    """a resumable multipart upload of an audio file that the client sends straight to the bucket,
+       in parts of part_size bytes to presigned urls, so the file never passes through a request worker
+       completing it creates the Song
+    """
+    PENDING = "pending"
+    COMPLETED = "completed"
+    ABORTED = "aborted"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (COMPLETED, "Completed"),
+        (ABORTED, "Aborted"),
+    ]
+    MIN_PART_SIZE = 5 * 1024 * 1024  # S3 limits
+    MAX_PARTS = 10_000
+
+    class IncompleteUpload(Exception):
+        """the bucket has not received every part of the upload
+        """
+
+    class NotPending(Exception):
+        """the upload was completed or aborted, possibly by a concurrent request
+        """
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    name = models.CharField(max_length=1024)  # storage name of the audio file
+    upload_id = models.CharField(max_length=1024)
+    size = models.BigIntegerField()
+    part_size = models.BigIntegerField()
+    content_type = models.CharField(max_length=128)
+    title = models.CharField(max_length=256)
+    artist_name = models.CharField(max_length=256)
+    genre = models.CharField(max_length=128)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    song = models.OneToOneField(Song, on_delete=models.SET_NULL, default=None, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @staticmethod
+    def get_storage():
+        """storage of Song.audio_file, None if it does not support multipart uploads (not S3)
+        """
+        storage = Song._meta.get_field('audio_file').storage
+        return storage if hasattr(storage, 'create_multipart_upload') else None
+
+    @staticmethod
+    def start(user: CustomUser, filename: str, size: int, content_type: str,
+              title: str, artist_name: str, genre: str) -> 'SongUpload':
+        """starts the multipart upload of an audio file in the bucket
+
+        Args:
+            user (CustomUser): the uploader
+            filename (str): name of the file on the client, kept as the last part of the storage name
+            size (int): size of the file in bytes
+
+        Returns:
+            SongUpload: the pending upload
+        """
+        audio_file = Song._meta.get_field('audio_file')
+        # a directory per upload, so uploads of files with the same name do not overwrite each other
+        name = audio_file.generate_filename(None, f"{uuid.uuid4().hex}/{os.path.basename(filename)}")
+        part_size = max(settings.UPLOAD_PART_SIZE, SongUpload.MIN_PART_SIZE, -(-size // SongUpload.MAX_PARTS))
+        upload_id = SongUpload.get_storage().create_multipart_upload(name, content_type)
+        return SongUpload.objects.create(
+            user=user, name=name, upload_id=upload_id, size=size, part_size=part_size,
+            content_type=content_type, title=title, artist_name=artist_name, genre=genre
+        )
+
+    @property
+    def part_count(self) -> int:
+        return max(-(-self.size // self.part_size), 1)
+
+    def get_part_urls(self, part_numbers: list) -> dict:
+        """presigned PUT urls of the parts
+
+        Returns:
+            dict: part number -> url
+        """
+        storage = SongUpload.get_storage()
+        return {number: storage.multipart_part_url(self.name, self.upload_id, number) for number in part_numbers}
+
+    def get_uploaded_parts(self) -> list:
+        """the parts the bucket has received, the client resumes by uploading the others
+        """
+        return SongUpload.get_storage().list_multipart_parts(self.name, self.upload_id)
+
+    def lock_pending(self) -> None:
+        """locks the row until the end of the transaction and reloads it, so concurrent complete/abort calls
+           of the upload run one after the other and each sees the status the previous one left
+
+        Raises:
+            SongUpload.NotPending: if the upload is not pending anymore (the instance has its current status)
+        """
+        self.refresh_from_db(from_queryset=SongUpload.objects.select_for_update())
+        if self.status != SongUpload.PENDING:
+            raise SongUpload.NotPending(f"Upload is {self.status}")
+
+    def complete(self) -> Song:
+        """assembles the parts into the audio file and creates the song
+           the parts are listed from the bucket, so the client does not have to keep their ETags
+
+        Raises:
+            SongUpload.IncompleteUpload: if a part is missing or the parts do not add up to size
+            SongUpload.NotPending: if the upload was completed or aborted meanwhile
+
+        Returns:
+            Song: the new song
+        """
+        with transaction.atomic():
+            self.lock_pending()
+            parts = self.get_uploaded_parts()
+            missing = sorted(set(range(1, self.part_count + 1)) - {part['PartNumber'] for part in parts})
+            if missing:
+                raise SongUpload.IncompleteUpload(f"Missing parts: {missing[:20]}")
+            parts = [part for part in parts if part['PartNumber'] <= self.part_count]
+            uploaded_size = sum(part['Size'] for part in parts)
+            if uploaded_size != self.size:
+                raise SongUpload.IncompleteUpload(f"Uploaded {uploaded_size} bytes instead of {self.size}")
+
+            SongUpload.get_storage().complete_multipart_upload(self.name, self.upload_id, parts)
+            song = Song(title=self.title, artist_name=self.artist_name, genre=self.genre, audio_file=self.name)
+            song.save()
+            self.song = song
+            self.status = SongUpload.COMPLETED
+            self.save(update_fields=['song', 'status', 'updated_at'])
+        return song
+
+    def abort(self) -> None:
+        """drops the parts uploaded so far
+
+        Raises:
+            SongUpload.NotPending: if the upload was completed or aborted meanwhile
+        """
+        with transaction.atomic():
+            self.lock_pending()
+            SongUpload.get_storage().abort_multipart_upload(self.name, self.upload_id)
+            self.status = SongUpload.ABORTED
+            self.save(update_fields=['status', 'updated_at'])
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
+
+
+class CatalogCounter(models.Model):
+    """the current catalog change version, a single row
+       it is locked by CatalogChange.record until the transaction commits, so versions commit in order
+       and a client that has version v can never miss a change with a lower version committed later
+    """
+    version = models.BigIntegerField(default=0)
+
+
+class CatalogChange(models.Model):
+    """the last change of each song, with the catalog change version it was made in:
+       inserts and updates, or deletes (tombstones), so clients can sync the catalog from a version
+    """
+    song_id = models.BigIntegerField(unique=True)
+    version = models.BigIntegerField(db_index=True)
+    deleted = models.BooleanField(default=False)
+
+    @staticmethod
+    def record(song_ids: list, deleted: bool = False) -> int:
+        """records that the songs were inserted/updated (or deleted) under a new version and bumps the catalog version
+           must be called after writes to songs that bypass save()/delete() (bulk_create, update)
+
+        Returns:
+            int: the new version
+        """
+        with transaction.atomic():
+            CatalogCounter.objects.bulk_create([CatalogCounter(id=1)], ignore_conflicts=True)
+            counter = CatalogCounter.objects.select_for_update().get(id=1)
+            counter.version += 1
+            counter.save(update_fields=['version'])
+            CatalogChange.objects.bulk_create(
+                [CatalogChange(song_id=song_id, version=counter.version, deleted=deleted) for song_id in song_ids],
+                update_conflicts=True, unique_fields=['song_id'], update_fields=['version', 'deleted'],
+                batch_size=1000
+            )
+            Song.bump_catalog_version()
+        return counter.version
+
+    @staticmethod
+    def get_version() -> int:
+        """the last committed version (0 before the first change)
+        """
+        return CatalogCounter.objects.filter(id=1).values_list('version', flat=True).first() or 0
+
+    @staticmethod
+    def get_changes(since: int, version: int, limit: int):
+        """the songs changed after since up to version
+
+        Returns:
+            tuple: (ids of the inserted/updated songs, ids of the deleted songs),
+                   or None if more than limit songs changed (the client should start from a snapshot)
+        """
+        changes = list(
+            CatalogChange.objects.filter(version__gt=since, version__lte=version)
+            .order_by('version', 'song_id').values_list('song_id', 'deleted')[:limit + 1]
+        )
+        if len(changes) > limit:
+            return None
+        return ([song_id for song_id, deleted in changes if not deleted],
+                [song_id for song_id, deleted in changes if deleted])
+
+
+class CatalogSnapshot(models.Model):
+    """a full copy of the catalog at a version, as a json file in the default storage
+       with gzip and brotli precompressed copies, built by the build_catalog_snapshot command
+    """
+    version = models.BigIntegerField()
+    name = models.CharField(max_length=255)
+    gzip_name = models.CharField(max_length=255)
+    brotli_name = models.CharField(max_length=255, blank=True)
+    songs = models.IntegerField()
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def get_latest():
+        return CatalogSnapshot.objects.order_by('-version', '-id').first()
+
+    def get_file(self, accept_encoding: str) -> tuple:
+        """the copy to send for an Accept-Encoding header
+
+        Returns:
+            tuple: (storage name, content encoding or None)
+        """
+        encodings = {encoding.split(';')[0].strip() for encoding in accept_encoding.split(',')}
+        if self.brotli_name and 'br' in encodings:
+            return self.brotli_name, 'br'
+        if 'gzip' in encodings:
+            return self.gzip_name, 'gzip'
+        return self.name, None
+
+    def delete_files(self) -> None:
+        for name in (self.name, self.gzip_name, self.brotli_name):
+            if name:
+                default_storage.delete(name)
+
     def __str__(self):
-        return f"{self.user}, {self.song}"
\ No newline at end of file
+        return f"{self.name} ({self.songs} songs)"
@@ -0,0 +1,218 @@
+import base64
+import json
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class SongKeysetPagination(BasePagination):
+    """cursor pagination keyed on the ordering of the queryset (e.g. ('id',) or ('-genre_likes', '-id'))
+       the cursor holds the ordering values of the last song of the page,
+       so the next page is a range condition on those values, and its cost does not grow with page depth
+
+       clients that send neither "cursor" nor "page_size" get the whole list as before,
+       unless allow_unpaginated is False
+    """
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    allow_unpaginated = True
+    invalid_cursor_message = 'Invalid cursor'
+    # json types a cursor value may have, by internal type of its ordering field (bool is never accepted)
+    cursor_value_types = {
+        'AutoField': (int,),
+        'BigAutoField': (int,),
+        'IntegerField': (int,),
+        'BigIntegerField': (int,),
+        'PositiveIntegerField': (int,),
+        'FloatField': (int, float),
+        'CharField': (str,),
+        'TextField': (str,),
+    }
+
+    def paginate_queryset(self, queryset: QuerySet, request: Request, view=None):
+        page_queryset = self.get_page_queryset(queryset, request)
+        if page_queryset is None:
+            return None
+        return self.get_page(list(page_queryset))
+
+    async def apaginate_queryset(self, queryset: QuerySet, request: Request, view=None):
+        """same as paginate_queryset, for async views
+        """
+        page_queryset = self.get_page_queryset(queryset, request)
+        if page_queryset is None:
+            return None
+        return self.get_page([song async for song in page_queryset])
+
+    def get_page_queryset(self, queryset: QuerySet, request: Request):
+        """returns the (unevaluated) queryset of the songs of the page plus one,
+           or None if the client did not ask for pagination
+        """
+        if (self.allow_unpaginated
+                and self.cursor_query_param not in request.query_params
+                and self.page_size_query_param not in request.query_params):
+            return None
+
+        self.request = request
+        self.ordering = self.get_ordering(queryset)
+        self.current_page_size = self.get_page_size(request)
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            position = self.decode_cursor(encoded)
+            self.check_position(position, queryset)
+            queryset = queryset.filter(self.get_after_filter(position))
+        return queryset[:self.current_page_size + 1]
+
+    def paginate_id_list(self, ids: list, request: Request):
+        """pages an already ranked list of ids (e.g. cached recommendations) instead of a queryset,
+           here the cursor holds the position in the list
+
+        Returns:
+            list: the ids of the page, or None if the client did not ask for pagination
+        """
+        if (self.allow_unpaginated
+                and self.cursor_query_param not in request.query_params
+                and self.page_size_query_param not in request.query_params):
+            return None
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        offset = 0
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            position = self.decode_cursor(encoded)
+            if len(position) != 1 or not isinstance(position[0], int) or position[0] < 0:
+                raise NotFound(self.invalid_cursor_message)
+            offset = position[0]
+        end = offset + page_size
+        self.has_next = end < len(ids)
+        self.next_position = [end] if self.has_next else None
+        return ids[offset:end]
+
+    def get_page(self, songs: list) -> list:
+        """cuts the extra song off and remembers the position of the next page
+        """
+        page_size = self.current_page_size
+        self.has_next = len(songs) > page_size
+        songs = songs[:page_size]
+        self.next_position = None
+        if self.has_next:
+            last = songs[-1]
+            # values() rows (see FastSongListSerializer) are dicts
+            if isinstance(last, dict):
+                self.next_position = [last[field] for field, _ in self.ordering]
+            else:
+                self.next_position = [getattr(last, field) for field, _ in self.ordering]
+        return songs
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                    'format': 'uri',
+                },
+                'results': schema,
+            },
+        }
+
+    def get_ordering(self, queryset: QuerySet) -> list:
+        """returns the (field name, descending) pairs of the ordering of the queryset
+
+        Args:
+            queryset (QuerySet): an ordered queryset, the last field must be unique (normally id)
+
+        Returns:
+            list: list of (field name, descending) tuples
+        """
+        order_by = queryset.query.order_by
+        assert order_by, 'SongKeysetPagination requires an ordered queryset'
+        return [(field.lstrip('-'), field.startswith('-')) for field in order_by]
+
+    def get_page_size(self, request: Request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def check_position(self, position: list, queryset: QuerySet) -> None:
+        """checks that the cursor has one value per ordering field, of the type of the field
+
+        Raises:
+            NotFound: if it does not, a forged cursor must not reach the query
+        """
+        if len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        for (field, _), value in zip(self.ordering, position):
+            if field in queryset.query.annotations:
+                output_field = queryset.query.annotations[field].output_field
+            elif field == 'pk':
+                output_field = queryset.model._meta.pk
+            else:
+                output_field = queryset.model._meta.get_field(field)
+            if not isinstance(value, self.cursor_value_types.get(output_field.get_internal_type(), ())):
+                raise NotFound(self.invalid_cursor_message)
+
+    def get_after_filter(self, position: list) -> Q:
+        """builds the condition that selects the rows after position in the ordering
+           for ordering (a, b) it is: a after position[0] OR (a = position[0] AND b after position[1])
+
+        Args:
+            position (list): ordering values of the last row of the previous page
+
+        Returns:
+            Q: filter for the rows of the next pages
+        """
+        condition = Q()
+        equal_fields = {}
+        for (field, descending), value in zip(self.ordering, position):
+            lookup = f"{field}__lt" if descending else f"{field}__gt"
+            condition |= Q(**equal_fields, **{lookup: value})
+            equal_fields[field] = value
+        return condition
+
+    def encode_cursor(self, position: list) -> str:
+        data = json.dumps(position, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(data).decode('ascii')
+
+    def decode_cursor(self, encoded: str) -> list:
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        # only json scalars, a list or an object in the cursor would break the filter
+        if not isinstance(position, list) or any(
+            isinstance(value, bool) or not isinstance(value, (int, float, str)) for value in position
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+
+class PopularSongPagination(SongKeysetPagination):
+    """the popular songs are the whole catalog, so they are always paginated
+    """
+    allow_unpaginated = False
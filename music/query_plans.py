@@ -0,0 +1,91 @@
+import json
+from django.db.models import Count
+from django.conf import settings
+from django.db import connection
+from rest_framework.settings import api_settings
+from authentication.models import CustomUser
+from music.models import Song, Like
+
+# tables that must never be read with a full sequential scan once they are large
+CHECKED_TABLES = ('music_song', 'music_like')
+
+
+def analyze_tables() -> dict:
+    """refreshes the statistics and GIN indexes of the checked tables, so the planner sees them as a vacuumed
+       database would (PostgreSQL only)
+
+    Returns:
+        dict: table name -> estimated number of rows
+    """
+    with connection.cursor() as cursor:
+        # rows inserted since the last vacuum wait in the pending list of the GIN indexes, which the planner
+        # prices as a scan of the list, move them into the indexes as autovacuum would
+        cursor.execute(
+            "SELECT gin_clean_pending_list(i.indexrelid) FROM pg_index i JOIN pg_class t ON t.oid = i.indrelid "
+            "JOIN pg_class c ON c.oid = i.indexrelid JOIN pg_am a ON a.oid = c.relam "
+            "WHERE t.relname = ANY(%s) AND a.amname = 'gin'", [list(CHECKED_TABLES)]
+        )
+        cursor.execute(f"ANALYZE {', '.join(CHECKED_TABLES)}")
+        cursor.execute("SELECT relname, reltuples FROM pg_class WHERE relname = ANY(%s)", [list(CHECKED_TABLES)])
+        return {name: rows for name, rows in cursor.fetchall()}
+
+
+def get_hot_queries(user: CustomUser, query: str) -> list:
+    """(name, queryset) of the hot song queries, limited the way the views limit them
+    """
+    page_size = api_settings.PAGE_SIZE
+    genre = Song.objects.order_by('id').values_list('genre', flat=True).first()
+    return [
+        ('list', Song.annotate_by_like(user).order_by('id')[:page_size]),
+        ('liked', Song.get_liked_by_user(user).order_by('id')[:page_size]),
+        ('liked_song_ids', Like.objects.filter(user_id=user.pk).values_list('song_id', flat=True)),
+        ('liked_genres', Song.get_liked_genres(user)),
+        ('recommended', Song.get_recommended_for_user(user)
+            .values_list('id', flat=True)[:settings.RECOMMENDATION_CACHE_SIZE]),
+        ('genre_recommended', Song.get_genre_recommended_for_user(user)
+            .values_list('id', flat=True)[:settings.RECOMMENDATION_CACHE_SIZE]),
+        ('search', Song.search(user, query)[:page_size]),
+        ('popular', Song.get_popular(user)[:page_size]),
+        ('popular_genre', Song.get_popular(user, genre=genre)[:page_size]),
+    ]
+
+
+def get_typical_user() -> CustomUser:
+    """the user with the median number of likes among the users who liked a song (None without likes),
+       the heaviest users like a large part of the catalog, reading it whole is the right plan for them
+    """
+    users = CustomUser.objects.annotate(likes=Count('like')).filter(likes__gt=0).order_by('likes', 'id')
+    count = users.count()
+    return users[count // 2] if count else None
+
+
+def get_search_text() -> str:
+    """the last word of the title of the song in the middle of the catalog (None without songs),
+       the words every title shares (e.g. "Seed Song" of seed_catalog) match the whole table
+    """
+    titles = Song.objects.order_by('id').values_list('title', flat=True)
+    title = titles[titles.count() // 2] if titles.exists() else None
+    return title.split()[-1] if title and title.split() else None
+
+
+def get_plan(queryset) -> dict:
+    """the root node of the EXPLAIN (FORMAT JSON) plan of the queryset
+    """
+    return json.loads(queryset.explain(format='json'))[0]['Plan']
+
+
+def walk(node: dict):
+    """yields the node and every node below it (including the init plans and subplans)
+    """
+    yield node
+    for child in node.get('Plans', []):
+        yield from walk(child)
+
+
+def sequential_scans(plan: dict, table_rows: dict, max_rows: int) -> list:
+    """names of the checked tables with more than max_rows rows that the plan scans sequentially
+    """
+    return sorted({
+        node['Relation Name'] for node in walk(plan)
+        if node['Node Type'] == 'Seq Scan' and table_rows.get(node.get('Relation Name'), 0) > max_rows
+    })
@@ -1,13 +1,231 @@
+from operator import itemgetter
+from django.db.models import QuerySet
+from django.urls import reverse
 from rest_framework import serializers
-from .models import Song, Like
+from rest_framework.settings import api_settings
+from spotechnify_server.images import ImageVariantsField, variant_urls
+from spotechnify_server.instrumentation import TimedListSerializer, TimedSerializerMixin, timed
+from django.conf import settings
+from .models import Song, Like, SongUpload
 
-class SongSerializer(serializers.ModelSerializer):
-    liked = serializers.BooleanField(read_only=True)
+class LikedField(serializers.BooleanField):
+    """reads "liked" from the liked_song_ids set of the context if the view provides it,
+       otherwise from the "liked" annotation of the song
+    """
+
+    def get_attribute(self, instance):
+        liked_song_ids = self.context.get('liked_song_ids')
+        if liked_song_ids is not None:
+            return instance.id in liked_song_ids
+        return super().get_attribute(instance)
+
+
+class SongSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    liked = LikedField(read_only=True)
+    image_variants = ImageVariantsField('image', 'image_variants')
     class Meta:
         model = Song
-        fields = "__all__"
+        # like_count changes without a catalog version bump, the song lists would keep stale ETags
+        exclude = ("search_vector", "like_count")
+        list_serializer_class = TimedListSerializer
+
+class PopularSongSerializer(SongSerializer):
+    class Meta(SongSerializer.Meta):
+        exclude = ("search_vector",)
+
+def catalog_url(path: str, context: dict) -> str:
+    """absolute url of a path of this server: on context['base_url'] if it is given (CATALOG_BASE_URL),
+       otherwise on the host of context['request'] like the song lists, relative without either
+    """
+    base_url = context.get('base_url')
+    if base_url:
+        return base_url.rstrip('/') + path
+    request = context.get('request')
+    return request.build_absolute_uri(path) if request is not None else path
+
+class SongFileUrlField(serializers.Field):
+    """stable url of a file of the song: the endpoint of this server that redirects to it (or serves it),
+       not a presigned url, which expires while the clients still keep the catalog
+       None if the song has no such file
+    """
+    def __init__(self, file_field: str, url_name: str, **kwargs):
+        kwargs['read_only'] = True
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+        self.file_field = file_field
+        self.url_name = url_name
+        self.columns = ('id', file_field)
+
+    def from_row(self, row: dict):
+        if not row[self.file_field]:
+            return None
+        return catalog_url(reverse(self.url_name, args=[row['id']]), self.context)
+
+    def to_representation(self, instance):
+        return self.from_row({'id': instance.id, self.file_field: getattr(instance, self.file_field).name})
+
+class SongImageVariantsUrlField(serializers.Field):
+    """stable urls of the resized variants of the image of the song, {size: {image_format: url}}
+       (see SongFileUrlField), empty until the variants of the current image are built
+    """
+    columns = ('id', 'image', 'image_variants')
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def from_row(self, row: dict) -> dict:
+        variants = row['image_variants']
+        # see current_variants, rows read from the database are committed
+        if not row['image'] or variants is None or variants.get('source') != row['image']:
+            return {}
+        path = reverse('song_image', args=[row['id']])
+        return {
+            size: {image_format: catalog_url(f"{path}?size={size}&image_format={image_format}", self.context)
+                   for image_format in formats}
+            for size, formats in variants['sizes'].items()
+        }
+
+    def to_representation(self, instance):
+        return self.from_row({'id': instance.id, 'image': instance.image.name,
+                              'image_variants': instance.image_variants})
+
+class CatalogSongSerializer(SongSerializer):
+    """SongSerializer without "liked", for the catalog snapshots and sync which are the same for every user,
+       with the stable urls of the files, clients keep the catalog for longer than a presigned url is valid
+    """
+    liked = None
+    audio_file = SongFileUrlField('audio_file', 'song_stream')
+    image = SongFileUrlField('image', 'song_image')
+    image_variants = SongImageVariantsUrlField()
+
+class FastSongListSerializer:
+    """builds the same output as serializer_class(songs, many=True) from values() rows instead of model instances,
+       with a handler precomputed for each field, so a song costs a few dict lookups (and the storage url calls)
+       supported is False when the serializer has a field without a handler, then serializer_class must be used
+    """
+    # serializer fields whose representation of a database value is the value itself
+    PLAIN_FIELDS = (serializers.IntegerField, serializers.CharField)
+
+    def __init__(self, serializer_class=SongSerializer, context: dict = None):
+        self.context = context or {}
+        self.model = serializer_class.Meta.model
+        self.columns = []
+        self.handlers = []
+        self.supported = True
+        for name, field in serializer_class(context=self.context).fields.items():
+            handler = self.get_handler(field)
+            if handler is None:
+                self.supported = False
+                return
+            self.handlers.append((name, handler))
 
-class LikeSerializer(serializers.ModelSerializer):
+    def use_columns(self, *columns) -> None:
+        self.columns.extend(column for column in columns if column not in self.columns)
+
+    def get_handler(self, field):
+        """function of a values() row returning the representation of field, None if the field is not supported
+        """
+        request = self.context.get('request')
+        if isinstance(field, (SongFileUrlField, SongImageVariantsUrlField)):
+            self.use_columns(*field.columns)
+            return field.from_row
+        if isinstance(field, LikedField):
+            liked_song_ids = self.context.get('liked_song_ids')
+            if liked_song_ids is not None:
+                self.use_columns('id')
+                return lambda row: row['id'] in liked_song_ids
+            self.use_columns('liked')
+            return lambda row: bool(row['liked'])
+        if isinstance(field, ImageVariantsField):
+            image_field, variants_field = field.image_field, field.variants_field
+            self.use_columns(image_field, variants_field)
+
+            def image_variants(row):
+                variants = row[variants_field]
+                # see current_variants, rows read from the database are committed
+                if not row[image_field] or variants is None or variants.get('source') != row[image_field]:
+                    return {}
+                return variant_urls(variants, request)
+            return image_variants
+        if '.' in field.source or field.source == '*':
+            return None
+        column = field.source
+        if isinstance(field, serializers.FileField):
+            self.use_columns(column)
+            if not getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+                return lambda row: row[column] or None
+            storage = self.model._meta.get_field(column).storage
+
+            def file_url(row):
+                name = row[column]
+                if not name:
+                    return None
+                url = storage.url(name)
+                return request.build_absolute_uri(url) if request is not None else url
+            return file_url
+        if type(field) in self.PLAIN_FIELDS:
+            self.use_columns(column)
+            return itemgetter(column)
+        return None
+
+    def values(self, queryset: QuerySet) -> QuerySet:
+        """the rows the handlers need, plus the ordering fields (used by the keyset pagination)
+        """
+        ordering = [field.lstrip('-') for field in queryset.query.order_by]
+        return queryset.values(*self.columns, *(field for field in ordering if field not in self.columns))
+
+    def serialize(self, rows) -> list:
+        handlers = self.handlers
+        with timed('serialize'):
+            return [{name: handler(row) for name, handler in handlers} for row in rows]
+
+class LikeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Like
-        fields = "__all__"
\ No newline at end of file
+        fields = "__all__"
+        list_serializer_class = TimedListSerializer
+
+class LikeBatchSerializer(serializers.Serializer):
+    """ids of the songs to like and to unlike in one request
+    """
+    MAX_SONGS = 500
+    like = serializers.ListField(child=serializers.IntegerField(min_value=1), default=list, max_length=MAX_SONGS)
+    unlike = serializers.ListField(child=serializers.IntegerField(min_value=1), default=list, max_length=MAX_SONGS)
+
+    def validate(self, data):
+        if set(data['like']) & set(data['unlike']):
+            raise serializers.ValidationError("A song can not be both liked and unliked.")
+        return data
+
+
+class SongUploadSerializer(serializers.ModelSerializer):
+    part_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = SongUpload
+        fields = ("id", "status", "size", "part_size", "part_count", "content_type",
+                  "title", "artist_name", "genre", "song", "created_at", "updated_at")
+
+class SongUploadStartSerializer(serializers.Serializer):
+    """the audio file to upload and the song to create from it
+    """
+    filename = serializers.CharField(max_length=255)
+    size = serializers.IntegerField(min_value=1)
+    content_type = serializers.RegexField(r"^audio/[\w.+-]+$", max_length=128)
+    title = serializers.CharField(max_length=256)
+    artist_name = serializers.CharField(max_length=256)
+    genre = serializers.CharField(max_length=128)
+
+    def validate_size(self, size):
+        if size > settings.UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f"Files larger than {settings.UPLOAD_MAX_SIZE} bytes are not accepted.")
+        return size
+
+class SongUploadPartsSerializer(serializers.Serializer):
+    """numbers of the parts to get upload urls for
+    """
+    MAX_PARTS = 1000
+    part_numbers = serializers.ListField(child=serializers.IntegerField(min_value=1),
+                                         min_length=1, max_length=MAX_PARTS)
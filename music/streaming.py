@@ -0,0 +1,90 @@
+import re
+from django.core.files.storage import Storage
+from django.utils.http import parse_http_date_safe
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    """the requested byte range does not overlap the file
+    """
+
+
+def parse_range(header: str, size: int):
+    """parses a single "bytes=start-end" Range header
+
+    Args:
+        header (str): value of the Range header
+        size (int): size of the file in bytes
+
+    Raises:
+        RangeNotSatisfiable: if the range starts after the end of the file
+
+    Returns:
+        tuple: (start, end) inclusive byte positions, or None if the whole file should be sent
+        (no header, a malformed header, or several ranges, which are not supported)
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # suffix range: the last "end" bytes
+        length = int(end)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = int(end) if end else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def if_range_matches(if_range: str, etag: str, last_modified: float) -> bool:
+    """checks the If-Range header, if it does not match the current file, the whole file is sent
+
+    Args:
+        if_range (str): value of the If-Range header (an etag or an http date)
+        etag (str): current etag of the file
+        last_modified (float): current modification time of the file (timestamp)
+
+    Returns:
+        bool: True if the Range header should be honored
+    """
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    if_range_time = parse_http_date_safe(if_range)
+    return if_range_time is not None and last_modified is not None and int(last_modified) <= if_range_time
+
+
+def file_etag(size: int, last_modified: float) -> str:
+    return f'"{size:x}-{int(last_modified or 0):x}"'
+
+
+def file_last_modified(storage: Storage, name: str):
+    try:
+        return storage.get_modified_time(name).timestamp()
+    except (NotImplementedError, OSError):
+        return None
+
+
+def iter_file_range(storage: Storage, name: str, start: int, end: int, chunk_size: int):
+    """yields the bytes start..end (inclusive) of the file in chunks of at most chunk_size bytes,
+       so only one chunk per stream is held in memory
+    """
+    with storage.open(name, 'rb') as file:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
@@ -0,0 +1,30 @@
+from io import StringIO
+from unittest import skipUnless
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from music import query_plans
+
+
+@skipUnless(connection.vendor == 'postgresql', "query plans are checked on PostgreSQL")
+class QueryPlanTest(TestCase):
+    """the hot song queries read music_song and music_like through indexes once the tables are large
+       (check_query_plans runs the same check against a bigger seeded database)
+    """
+    max_seq_rows = 5000
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_catalog', users=300, songs=20000, likes=100000, stdout=StringIO())
+        cls.table_rows = query_plans.analyze_tables()
+        cls.user = query_plans.get_typical_user()
+
+    def test_tables_are_large(self):
+        for table in query_plans.CHECKED_TABLES:
+            self.assertGreater(self.table_rows[table], self.max_seq_rows, table)
+
+    def test_no_sequential_scans(self):
+        for name, queryset in query_plans.get_hot_queries(self.user, query_plans.get_search_text()):
+            with self.subTest(query=name):
+                plan = query_plans.get_plan(queryset)
+                self.assertEqual(query_plans.sequential_scans(plan, self.table_rows, self.max_seq_rows), [])
@@ -1,3 +1,1156 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
+import boto3
+import requests
+from botocore.exceptions import EndpointConnectionError
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections
+from io import BytesIO, StringIO
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import http_date
+import orjson
+from moto import mock_aws
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from authentication.models import CustomUser
+from music import streaming
+from music.models import CatalogChange, Song, Like, GenrePopularity, SongLikeBucket, SongNeighbor, SongUpload
+from music.serializers import FastSongListSerializer, SongSerializer
+from spotechnify_server import db_router, images
+from spotechnify_server.instrumentation import get_cache_stats
 
-# Create your tests here.
+# song files are only named in these tests, the urls of a local storage need no bucket
+LOCAL_STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+# multipart uploads need the S3 storage, against a moto bucket
+S3_STORAGES = {
+    "default": {"BACKEND": "spotechnify_server.storage.CachedUrlS3Storage",
+                "OPTIONS": {"access_key": "testing", "secret_key": "testing", "bucket_name": "songs-bucket",
+                            "region_name": "us-east-1", "endpoint_url": None}},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+AUDIO = b"audio bytes"
+
+
+def create_songs(count: int, start: int = 0) -> list:
+    songs = Song.objects.bulk_create([
+        Song(title=f"Song {n}", artist_name=f"Artist {n % 7}", audio_file=f"songs/{n}.mp3",
+             image=f"song_images/{n}.jpg", genre=("rock", "pop", "jazz")[n % 3])
+        for n in range(start, start + count)
+    ])
+    Song.update_search_vectors(Song.objects.all())
+    return songs
+
+
+class MusicTestCase(TestCase):
+    """a user with an authenticated client, and empty caches (they outlive the test transactions)
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username="listener", email="listener@example.com",
+                                                   password="a-long-password")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+
+    def like(self, songs: list) -> None:
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.apply_changes(self.user, [song.id for song in songs], [])
+
+
+class MusicFilesTestCase(MusicTestCase):
+    """MusicTestCase with the default storage in a temporary directory, for the tests that read the files
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        storages = override_settings(STORAGES={
+            **LOCAL_STORAGES,
+            "default": {"BACKEND": "django.core.files.storage.FileSystemStorage",
+                        "OPTIONS": {"location": directory.name}},
+        })
+        storages.enable()
+        self.addCleanup(storages.disable)
+        super().setUp()
+
+
+@override_settings(STORAGES=LOCAL_STORAGES)
+class SongListQueryCountTest(MusicTestCase):
+    """the song lists run the same number of queries whatever the number of songs and liked songs
+    """
+    urls = ('/music/list/', '/music/liked/', '/music/search/?q=Song',
+            '/music/async/list/', '/music/async/liked/', '/music/async/search/?q=Song')
+
+    def assert_queries(self, mode: str, queries: int) -> None:
+        """the lists run `queries` queries with 3 songs (1 liked) and with 60 songs (30 liked)
+        """
+        self.like(create_songs(3)[:1])
+        with override_settings(LIKED_SONGS_MODE=mode):
+            for url in self.urls:
+                self.client.get(url)  # caches the user (and the liked song ids)
+                with self.subTest(url=url, songs=3), self.assertNumQueries(queries):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+            self.like(create_songs(57, start=3)[::2])
+            for url in self.urls:
+                self.client.get(url)
+                with self.subTest(url=url, songs=60), self.assertNumQueries(queries):
+                    response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(len(response.json()), 30 if 'liked' in url else 60)
+
+    def test_annotate(self):
+        # the songs, with the liked flag as an Exists subquery
+        self.assert_queries('annotate', 1)
+
+    def test_request(self):
+        # the liked song ids, then the songs
+        self.assert_queries('request', 2)
+
+    def test_cache(self):
+        # only the songs, the liked song ids are cached
+        self.assert_queries('cache', 1)
+
+
+@override_settings(STORAGES=LOCAL_STORAGES)
+class FastSongListTest(MusicTestCase):
+    """the fast path (values() rows, FastSongListSerializer) renders the same bytes as SongSerializer
+    """
+    urls = ('/music/list/?page_size=4', '/music/liked/?page_size=1', '/music/search/?q=Song&page_size=4',
+            '/music/popular/?page_size=4', '/music/popular/?genre=rock&page_size=4',
+            '/music/async/list/?page_size=4', '/music/async/liked/?page_size=1')
+
+    def setUp(self):
+        super().setUp()
+        self.songs = create_songs(6)
+        Song.objects.filter(id=self.songs[2].id).update(image=None)
+        Song.objects.filter(id=self.songs[5].id).update(image="")
+        variants = {"64": {"webp": "song_images/0_64.webp", "jpeg": "song_images/0_64.jpg"},
+                    "256": {"webp": "song_images/0_256.webp", "jpeg": "song_images/0_256.jpg"}}
+        Song.objects.filter(id=self.songs[0].id).update(image_variants={"source": "song_images/0.jpg", "sizes": variants})
+        # built from an earlier image of the song
+        Song.objects.filter(id=self.songs[3].id).update(image_variants={"source": "song_images/old.jpg", "sizes": variants})
+        self.like([self.songs[1], self.songs[3]])
+
+    def get(self, url: str, fast_path: bool) -> bytes:
+        with override_settings(SONG_LIST_FAST_PATH=fast_path):
+            cache.clear()  # the cached ETags and liked song ids
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def test_same_bytes(self):
+        for mode in ('annotate', 'request'):
+            for url in self.urls:
+                with self.subTest(mode=mode, url=url), override_settings(LIKED_SONGS_MODE=mode):
+                    self.assertEqual(self.get(url, fast_path=True), self.get(url, fast_path=False))
+
+    def test_page_covers_every_case(self):
+        songs = json.loads(self.get('/music/list/?page_size=4', fast_path=True))['results']
+        self.assertEqual([song['liked'] for song in songs], [False, True, False, True])
+        self.assertEqual([song['image'] is None for song in songs], [False, False, True, False])
+        self.assertEqual(set(songs[0]['image_variants']), {"64", "256"})
+        self.assertEqual(songs[3]['image_variants'], {})
+
+    def test_serializers(self):
+        rows_serializer = FastSongListSerializer(SongSerializer, {'liked_song_ids': {self.songs[1].id}})
+        rows = rows_serializer.values(Song.objects.order_by('id'))
+        songs = Song.objects.order_by('id')
+        context = {'liked_song_ids': {self.songs[1].id}}
+        self.assertEqual(orjson.dumps(rows_serializer.serialize(rows)),
+                         orjson.dumps(SongSerializer(songs, many=True, context=context).data))
+
+
+@override_settings(LIKED_SONGS_MODE='cache')
+class LikedSongIdsCacheTest(MusicTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.songs = create_songs(3)
+
+    def test_like_and_unlike(self):
+        self.assertEqual(Like.get_liked_song_ids(self.user), set())
+        self.like(self.songs[:2])
+        self.assertEqual(Like.get_liked_song_ids(self.user), {self.songs[0].id, self.songs[1].id})
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.apply_changes(self.user, [], [self.songs[0].id])
+        self.assertEqual(Like.get_liked_song_ids(self.user), {self.songs[1].id})
+
+    def test_set_read_before_a_like_is_stale(self):
+        # a request that read the likes version and the likes before a like committed,
+        # and writes its set to the cache after the like
+        likes_version = Like.get_likes_version(self.user)
+        self.like(self.songs[:1])
+        cache.set(Like.LIKED_SONG_IDS_CACHE_KEY.format(user_id=self.user.pk),
+                  {'likes_version': likes_version, 'ids': set()})
+        self.assertEqual(Like.get_liked_song_ids(self.user), {self.songs[0].id})
+
+
+@override_settings(STORAGES=LOCAL_STORAGES)
+class KeysetPaginationTest(MusicTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.songs = create_songs(7)
+
+    def get_pages(self, url: str) -> list:
+        """follows the next links from url, returns the ids of every page
+        """
+        pages = []
+        while url:
+            self.assertLess(len(pages), 10, "the next links do not advance")
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([song['id'] for song in response.json()['results']])
+            url = response.json()['next']
+        return pages
+
+    def test_pages_chain(self):
+        ids = [song.id for song in self.songs]
+        for url in ('/music/list/?page_size=3', '/music/async/list/?page_size=3'):
+            with self.subTest(url=url):
+                self.assertEqual(self.get_pages(url), [ids[:3], ids[3:6], ids[6:]])
+
+    def test_pages_of_a_descending_ordering(self):
+        # (-rank, -id) on search, (-like_count, -id) on popular
+        self.like(self.songs[2:4])
+        for url in ('/music/search/?q=Song&page_size=2', '/music/popular/?page_size=2'):
+            with self.subTest(url=url):
+                pages = self.get_pages(url)
+                self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+                self.assertEqual(sorted(sum(pages, [])), [song.id for song in self.songs])
+        self.assertEqual(self.get_pages('/music/popular/?page_size=2')[0], [self.songs[3].id, self.songs[2].id])
+
+    def test_last_page(self):
+        response = self.client.get('/music/list/?page_size=7')
+        self.assertEqual(len(response.json()['results']), 7)
+        self.assertIsNone(response.json()['next'])
+
+    def test_max_page_size(self):
+        create_songs(200, start=7)
+        response = self.client.get('/music/list/?page_size=1000')
+        self.assertEqual(len(response.json()['results']), 200)
+        self.assertIsNotNone(response.json()['next'])
+
+    def test_invalid_cursors(self):
+        def encode(position) -> str:
+            return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+        cursors = ["!!!", encode("not a list")[:-2], encode({"id": 1}), encode([{"a": 1}]), encode([[1], 2]),
+                   encode([True]), encode(["1"]), encode([1, 2]), encode([])]
+        for url in ('/music/list/', '/music/async/list/', '/music/recommend/'):
+            for cursor in cursors:
+                with self.subTest(url=url, cursor=cursor):
+                    self.assertEqual(self.client.get(url, {'cursor': cursor}).status_code, 404)
+        # rank is a float, the id an int
+        for cursor in (encode(["0.5", 1]), encode([0.5, 1.5]), encode([None, 1])):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get('/music/search/', {'q': "Song", 'cursor': cursor}).status_code, 404)
+
+
+class BatchLikeTest(MusicTestCase):
+    urls = ('/music/like/batch/', '/music/async/like/batch/')
+
+    def setUp(self):
+        super().setUp()
+        self.songs = create_songs(6)  # rock, pop, jazz, rock, pop, jazz
+
+    def batch(self, url: str, like: list, unlike: list = ()) -> dict:
+        response = self.client.post(url, {"like": like, "unlike": list(unlike)}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return {result['song_id']: result['result'] for result in response.json()['results']}
+
+    def test_results(self):
+        first, second, third = (song.id for song in self.songs[:3])
+        for url in self.urls:
+            Like.objects.all().delete()
+            self.like(self.songs[:1])
+            with self.subTest(url=url):
+                self.assertEqual(self.batch(url, [first, second, second, 999999], [third]), {
+                    first: Like.ALREADY_LIKED, second: Like.LIKED, 999999: Like.NOT_FOUND, third: Like.NOT_LIKED
+                })
+                self.assertEqual(self.batch(url, [], [first, second]), {first: Like.UNLIKED, second: Like.UNLIKED})
+                self.assertEqual(Like.get_liked_song_ids(self.user), set())
+
+    def test_counts(self):
+        self.batch(self.urls[0], [song.id for song in self.songs])
+        self.batch(self.urls[0], [], [self.songs[0].id])
+        self.assertEqual(dict(Song.objects.values_list('id', 'like_count')),
+                         {song.id: int(song != self.songs[0]) for song in self.songs})
+        self.assertEqual(dict(GenrePopularity.objects.values_list('genre', 'like_count')),
+                         {"rock": 1, "pop": 2, "jazz": 2})
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        create_songs(44, start=6)
+        ids = list(Song.objects.order_by('id').values_list('id', flat=True))
+        # the user is cached and the genres have a like count row after the first batch
+        self.batch(self.urls[0], ids[:3], ())
+        self.batch(self.urls[0], [], ids[:3])
+        queries = []
+        for like, unlike in ((ids[:5], ()), (ids[5:], ()), ((), ids[:5]), ((), ids[5:])):
+            with CaptureQueriesContext(connection) as captured:
+                self.batch(self.urls[0], like, unlike)
+            queries.append(len(captured))
+        # one batch of 5 songs and one of 45 run the same queries
+        self.assertEqual(queries[0], queries[1])
+        self.assertEqual(queries[2], queries[3])
+
+    def test_invalid_batches(self):
+        song_id = self.songs[0].id
+        for url in self.urls:
+            for body in ({"like": [song_id], "unlike": [song_id]}, {"like": ["a"]}, {"like": [0]},
+                         {"like": list(range(1, 502))}):
+                with self.subTest(url=url, body=str(body)[:40]):
+                    self.assertEqual(self.client.post(url, body, format='json').status_code, 400)
+        self.assertFalse(Like.objects.exists())
+
+    def test_single_song_views(self):
+        song_id = self.songs[0].id
+        self.assertEqual(self.client.post(f'/music/like/{song_id}/').status_code, 201)
+        self.assertEqual(self.client.post(f'/music/like/{song_id}/').json(),
+                         {"message": "You already liked this song."})
+        self.assertEqual(self.client.delete(f'/music/unlike/{song_id}/').json(),
+                         {"message": "Song unliked successfully."})
+        self.assertEqual(self.client.delete(f'/music/unlike/{song_id}/').json(),
+                         {"message": "You haven't liked this song."})
+        self.assertEqual(self.client.post('/music/like/999999/').status_code, 404)
+        self.assertEqual(Song.objects.get(id=song_id).like_count, 0)
+
+
+class SearchTest(MusicTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.songs = Song.objects.bulk_create([
+            Song(title="Blue Monday", artist_name="New Order", audio_file="songs/0.mp3", genre="synthpop"),
+            Song(title="Blue in Green", artist_name="Miles Davis", audio_file="songs/1.mp3", genre="jazz"),
+            Song(title="Monday Morning", artist_name="Fleetwood Mac", audio_file="songs/2.mp3", genre="rock"),
+        ])
+        Song.update_search_vectors(Song.objects.all())
+
+    def search(self, query: str) -> list:
+        return [self.songs.index(song) for song in Song.search(self.user, query)]
+
+    @skipUnless(connection.vendor == 'postgresql', "full-text and trigram search run on PostgreSQL")
+    def test_search(self):
+        # whole words through the search vector, of the title, the artist or the genre
+        self.assertEqual(self.search("monday"), [2, 0])
+        self.assertEqual(self.search("jazz"), [1])
+        # the song matching every word first
+        self.assertEqual(self.search("blue monday")[0], 0)
+        # partial and misspelled words through the trigrams
+        self.assertEqual(sorted(self.search("Mond")), [0, 2])
+        self.assertEqual(self.search("Fleetwod"), [2])
+        self.assertEqual(self.search("xylophone"), [])
+
+    def test_icontains_fallback(self):
+        with mock.patch('music.models.connection', mock.Mock(vendor='sqlite')):
+            # any word in the title, the artist or the genre, newest first
+            self.assertEqual(self.search("MON"), [2, 0])
+            self.assertEqual(self.search("jazz order"), [1, 0])
+            self.assertEqual(self.search("xylophone"), [])
+            self.assertEqual({song.rank for song in Song.search(self.user, "blue")}, {0.0})
+
+    def test_empty_query(self):
+        self.assertEqual(self.search("  "), [2, 1, 0])
+
+    def test_view(self):
+        self.like(self.songs[:1])
+        response = self.client.get('/music/search/', {'q': "blue"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted((song['title'], song['liked']) for song in response.json()),
+                         [("Blue Monday", True), ("Blue in Green", False)])
+
+
+class ParseRangeTest(SimpleTestCase):
+
+    def test_ranges(self):
+        for header, byte_range in (
+            ("bytes=0-99", (0, 99)),
+            ("bytes=100-", (100, 1023)),  # open-ended
+            ("bytes=1000-5000", (1000, 1023)),  # the end is cut to the file
+            ("bytes=-24", (1000, 1023)),  # suffix: the last 24 bytes
+            ("bytes=-5000", (0, 1023)),
+            (" bytes=5-5 ", (5, 5)),
+        ):
+            with self.subTest(header=header):
+                self.assertEqual(streaming.parse_range(header, 1024), byte_range)
+
+    def test_whole_file(self):
+        # no range, a malformed one, or several ranges, which are not supported
+        for header in (None, "", "bytes=-", "items=0-1", "bytes=a-b", "bytes=0-1,5-6", "bytes=0-1, 5-"):
+            with self.subTest(header=header):
+                self.assertIsNone(streaming.parse_range(header, 1024))
+
+    def test_unsatisfiable(self):
+        for header in ("bytes=1024-", "bytes=2000-3000", "bytes=5-2", "bytes=-0"):
+            with self.subTest(header=header), self.assertRaises(streaming.RangeNotSatisfiable):
+                streaming.parse_range(header, 1024)
+        with self.assertRaises(streaming.RangeNotSatisfiable):
+            streaming.parse_range("bytes=0-", 0)
+
+
+class StreamSongTest(MusicFilesTestCase):
+    audio = bytes(range(256)) * 4
+
+    def setUp(self):
+        super().setUp()
+        self.song = create_songs(1)[0]
+        default_storage.save(self.song.audio_file.name, ContentFile(self.audio))
+        self.url = f'/music/stream/{self.song.id}/'
+        self.last_modified = default_storage.get_modified_time(self.song.audio_file.name).timestamp()
+
+    def get(self, **headers):
+        response = self.client.get(self.url, headers=headers)
+        content = b"".join(response.streaming_content) if response.streaming else response.content
+        return response, content
+
+    def test_whole_file(self):
+        response, content = self.get()
+        self.assertEqual((response.status_code, content), (200, self.audio))
+        self.assertEqual((response['Accept-Ranges'], response['Content-Length']), ('bytes', '1024'))
+        self.assertEqual(response['ETag'], streaming.file_etag(1024, self.last_modified))
+        self.assertEqual(response['Last-Modified'], http_date(self.last_modified))
+
+    def test_range(self):
+        response, content = self.get(Range="bytes=-24")
+        self.assertEqual((response.status_code, content), (206, self.audio[1000:]))
+        self.assertEqual((response['Content-Range'], response['Content-Length']), ("bytes 1000-1023/1024", '24'))
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.get(Range="bytes=1024-")
+        self.assertEqual((response.status_code, response['Content-Range']), (416, "bytes */1024"))
+
+    def test_if_range(self):
+        etag = streaming.file_etag(1024, self.last_modified)
+        for if_range, status_code in (
+            (etag, 206),
+            ('"0-0"', 200),  # the file changed since the client read the first bytes
+            (f"W/{etag}", 200),  # If-Range only takes strong etags
+            (http_date(self.last_modified), 206),
+            (http_date(self.last_modified + 60), 206),
+            (http_date(self.last_modified - 60), 200),
+            ("not a date", 200),
+        ):
+            with self.subTest(if_range=if_range):
+                response, content = self.get(Range="bytes=0-9", **{"If-Range": if_range})
+                self.assertEqual(response.status_code, status_code)
+                self.assertEqual(content, self.audio[:10] if status_code == 206 else self.audio)
+
+    def test_missing_file(self):
+        default_storage.delete(self.song.audio_file.name)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        Song.objects.filter(id=self.song.id).update(audio_file="")
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.get('/music/stream/999999/').status_code, 404)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class LikeConcurrencyTest(TransactionTestCase):
+
+    def test_concurrent_unlikes_count_once(self):
+        user = CustomUser.objects.create_user(username="listener", email="listener@example.com")
+        song = create_songs(1)[0]
+        Like.apply_changes(user, [song.id], [])
+        remove_likes = SongLikeBucket.remove_likes
+        in_transaction = threading.Event()
+        results = []
+
+        def slow_remove_likes(likes):
+            # the second unlike starts after the first read the likes of the user, before it commits
+            in_transaction.set()
+            time.sleep(0.5)
+            remove_likes(likes)
+
+        def unlike() -> None:
+            try:
+                results.append(Like.apply_changes(user, [], [song.id])[song.id])
+            finally:
+                connections.close_all()
+
+        with mock.patch.object(SongLikeBucket, 'remove_likes', side_effect=slow_remove_likes):
+            first = threading.Thread(target=unlike)
+            first.start()
+            in_transaction.wait(10)
+            second = threading.Thread(target=unlike)
+            second.start()
+            first.join()
+            second.join()
+
+        self.assertEqual(results, [Like.UNLIKED, Like.NOT_LIKED])
+        song.refresh_from_db()
+        self.assertEqual(song.like_count, 0)
+        self.assertEqual(GenrePopularity.objects.get(genre=song.genre).like_count, 0)
+
+
+class SongLikeBucketTest(MusicTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.song = create_songs(1)[0]
+        self.other = CustomUser.objects.create_user(username="other", email="other@example.com")
+
+    def bucket_count(self) -> int:
+        return sum(SongLikeBucket.objects.filter(song=self.song).values_list('count', flat=True))
+
+    def test_unlike_is_uncounted_from_its_bucket(self):
+        self.like([self.song])
+        Like.apply_changes(self.other, [self.song.id], [])
+        Like.apply_changes(self.other, [], [self.song.id])
+        self.assertEqual(self.bucket_count(), 1)
+
+    def test_unlike_of_a_like_without_created_at(self):
+        # made before created_at existed, it was never counted in a bucket
+        Like.objects.create(user=self.other, song=self.song, created_at=None)
+        self.like([self.song])
+        Like.apply_changes(self.other, [], [self.song.id])
+        self.assertEqual(self.bucket_count(), 1)
+
+
+@override_settings(TRENDING_WINDOW_HOURS=7 * 24, TRENDING_HOURLY_HOURS=48, TRENDING_HALF_LIFE_HOURS=24)
+class TrendingTest(MusicTestCase):
+    """buckets of songs 0..4, at hours relative to the current hour (a day-aligned hour)
+    """
+    now = datetime(2026, 10, 18, 0, 30, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        super().setUp()
+        self.songs = create_songs(5)
+        self.hour = SongLikeBucket.hour_of(self.now)
+        clock = mock.patch('music.models.timezone.now', return_value=self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def add_bucket(self, song: int, hours_ago: int, count: int, hours: int = SongLikeBucket.HOUR) -> None:
+        SongLikeBucket.objects.create(song=self.songs[song], hour=self.hour - hours_ago, hours=hours, count=count)
+
+    def buckets(self) -> dict:
+        return {
+            (self.songs.index(bucket.song), self.hour - bucket.hour, bucket.hours): bucket.count
+            for bucket in SongLikeBucket.objects.select_related('song')
+        }
+
+    def test_decay_ranking(self):
+        self.add_bucket(0, 0, 6)  # 6
+        self.add_bucket(1, 30, 10)  # 30 hours old: 10 / 2 ** 1.25 = 4.2
+        self.add_bucket(1, 24 * 6, 1000, hours=SongLikeBucket.DAY)  # middle 132 hours old: 1000 / 2 ** 5.5 = 22.1
+        self.add_bucket(2, 24 * 5, 40, hours=SongLikeBucket.DAY)  # middle 108 hours old: 40 / 2 ** 4.5 = 1.8
+        self.add_bucket(3, 2, 0)
+        self.add_bucket(4, 24 * 7 + 1, 1000)  # out of the window
+        self.add_bucket(4, 24 * 8, 1000, hours=SongLikeBucket.DAY)  # ended when the window starts
+        self.assertEqual(SongLikeBucket.get_trending_ids(), [self.songs[n].id for n in (1, 0, 2)])
+
+    def test_daily_bucket_counts_while_part_of_it_is_in_the_window(self):
+        self.add_bucket(0, 24 * 7 + 23, 100, hours=SongLikeBucket.DAY)
+        self.assertEqual(SongLikeBucket.get_trending_ids(), [self.songs[0].id])
+
+    def test_ranking_is_cached(self):
+        self.add_bucket(0, 0, 1)
+        self.assertEqual(SongLikeBucket.get_trending_ids(), [self.songs[0].id])
+        self.add_bucket(1, 0, 2)
+        self.assertEqual(SongLikeBucket.get_trending_ids(), [self.songs[0].id])
+        cache.delete(SongLikeBucket.TRENDING_IDS_CACHE_KEY)
+        self.assertEqual(SongLikeBucket.get_trending_ids(), [self.songs[1].id, self.songs[0].id])
+
+    def test_compact(self):
+        self.add_bucket(0, 47, 1)  # recent enough to stay hourly
+        self.add_bucket(0, 24 * 2 + 1, 2)  # rolled into the day 72 hours ago (3 days before the current hour)
+        self.add_bucket(0, 24 * 3, 3)
+        self.add_bucket(0, 24 * 3, 10, hours=SongLikeBucket.DAY)  # rolled up before
+        self.add_bucket(1, 24 * 2 + 23, 0)
+        self.add_bucket(1, 24 * 7 + 1, 5)  # out of the window
+        self.add_bucket(1, 24 * 8, 5, hours=SongLikeBucket.DAY)
+        self.add_bucket(1, 24 * 7 + 23, 5, hours=SongLikeBucket.DAY)  # still partly in the window
+        stdout = StringIO()
+        call_command('compact_like_buckets', stdout=stdout)
+        self.assertIn("Rolled 3 hourly buckets into daily ones, deleted 2 expired buckets", stdout.getvalue())
+        self.assertEqual(self.buckets(), {
+            (0, 47, SongLikeBucket.HOUR): 1,
+            (0, 24 * 3, SongLikeBucket.DAY): 15,
+            (1, 24 * 3, SongLikeBucket.DAY): 0,
+            (1, 24 * 7 + 23, SongLikeBucket.DAY): 5,
+        })
+        # nothing left to do
+        self.assertEqual(SongLikeBucket.compact(), (0, 0))
+
+    def test_unlike_after_compaction(self):
+        Like.objects.create(user=self.user, song=self.songs[0], created_at=self.now - timedelta(hours=60))
+        self.add_bucket(0, 60, 1)
+        self.add_bucket(0, 59, 4)
+        SongLikeBucket.compact()
+        Like.apply_changes(self.user, [], [self.songs[0].id])
+        self.assertEqual(self.buckets(), {(0, 24 * 3, SongLikeBucket.DAY): 4})
+
+
+@override_settings(RECOMMENDATION_GENRE_DRIFT=0.1)
+class RecommendationCacheTest(MusicTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.songs = create_songs(6)  # rock, pop, jazz, rock, pop, jazz
+        GenrePopularity.add_likes("rock", 99)
+        self.like(self.songs[:1])  # the 100th like of rock
+
+    def add_rock_likes(self, count: int) -> None:
+        GenrePopularity.add_likes("rock", count)
+        cache.delete(GenrePopularity.COUNTS_CACHE_KEY)  # the cached counts timed out
+
+    def assert_recomputed(self, recomputed: bool) -> None:
+        stats = get_cache_stats('recommendations')
+        misses = stats.misses
+        self.assertEqual(Song.get_recommended_ids_for_user(self.user), self.expected)
+        self.assertEqual(stats.misses - misses, int(recomputed))
+
+    def test_genre_fallback_is_stale_after_a_relative_drift(self):
+        self.expected = [self.songs[3].id]
+        self.assert_recomputed(True)
+        self.add_rock_likes(10)
+        self.assert_recomputed(False)
+        self.add_rock_likes(-21)
+        self.assert_recomputed(True)
+        # relative to the 89 likes the list was ranked with now
+        self.add_rock_likes(-8)
+        self.assert_recomputed(False)
+        self.add_rock_likes(-1)
+        self.assert_recomputed(True)
+
+    def test_neighbor_list_ignores_the_genre_counts(self):
+        SongNeighbor.objects.create(song=self.songs[0], neighbor=self.songs[2], score=0.5)
+        self.expected = [self.songs[2].id]
+        self.assert_recomputed(True)
+        self.add_rock_likes(1000)
+        self.assert_recomputed(False)
+
+    def test_like_makes_the_list_stale(self):
+        self.expected = [self.songs[3].id]
+        self.assert_recomputed(True)
+        self.like(self.songs[3:4])
+        self.expected = []
+        self.assert_recomputed(True)
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.apply_changes(self.user, [], [self.songs[3].id])
+        self.expected = [self.songs[3].id]
+        self.assert_recomputed(True)
+
+    def test_epoch_makes_the_list_stale(self):
+        self.expected = [self.songs[3].id]
+        self.assert_recomputed(True)
+        # neighbors are only used once the cached lists are invalidated, as build_song_neighbors does
+        SongNeighbor.objects.create(song=self.songs[0], neighbor=self.songs[2], score=0.5)
+        self.assert_recomputed(False)
+        Song.invalidate_recommendations()
+        self.expected = [self.songs[2].id]
+        self.assert_recomputed(True)
+        self.assert_recomputed(False)
+
+    @skipUnlessDBFeature('supports_slicing_ordering_in_compound')  # the genres are read in a union of slices
+    def test_list_is_cut_at_the_cache_size(self):
+        self.like(self.songs[1:2])  # pop, after the rock songs
+        with override_settings(RECOMMENDATION_CACHE_SIZE=2):
+            cache.clear()
+            response = self.client.get('/music/recommend/')
+            self.assertEqual([song['id'] for song in response.json()], [self.songs[3].id, self.songs[4].id])
+            self.assertEqual(response['X-Result-Limit'], "2")
+            response = self.client.get('/music/recommend/', {'page_size': 1})
+            self.assertEqual(response['X-Result-Limit'], "2")
+            response = self.client.get(response.json()['next'])
+            self.assertEqual([song['id'] for song in response.json()['results']], [self.songs[4].id])
+            self.assertIsNone(response.json()['next'])
+        with override_settings(RECOMMENDATION_CACHE_SIZE=3):
+            cache.clear()
+            response = self.client.get('/music/recommend/')
+            self.assertEqual(len(response.json()), 2)
+            self.assertNotIn('X-Result-Limit', response)
+
+
+class SongNeighborTest(MusicTestCase):
+    """song 0 and 1 are liked by the same users, song 2 by one of them, song 3 by someone else
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.songs = create_songs(5)
+        self.users = [CustomUser.objects.create_user(username=f"user{n}", email=f"user{n}@example.com")
+                      for n in range(3)]
+        self.add_likes([(0, 0), (0, 1), (1, 0), (1, 1), (1, 2), (2, 3)])
+
+    def add_likes(self, likes: list) -> None:
+        Like.objects.bulk_create([Like(user=self.users[user], song=self.songs[song]) for user, song in likes])
+
+    def build(self, **options) -> None:
+        call_command("build_song_neighbors", stdout=StringIO(), **options)
+
+    def neighbors(self) -> dict:
+        index = {song.id: n for n, song in enumerate(self.songs)}
+        return {
+            (index[song_id], index[neighbor_id]): round(score, 3)
+            for song_id, neighbor_id, score in SongNeighbor.objects.values_list('song_id', 'neighbor_id', 'score')
+        }
+
+    def test_cosine_similarity(self):
+        self.build()
+        self.assertEqual(self.neighbors(), {
+            (0, 1): 1.0, (1, 0): 1.0, (0, 2): 0.707, (2, 0): 0.707, (1, 2): 0.707, (2, 1): 0.707
+        })
+
+    def test_top_k_and_min_score(self):
+        self.build(top_k=1)
+        neighbors = self.neighbors()
+        self.assertEqual(sorted(song for song, _ in neighbors), [0, 1, 2])
+        self.assertEqual((neighbors[0, 1], neighbors[1, 0]), (1.0, 1.0))
+        self.build(min_score=0.8)
+        self.assertEqual(self.neighbors(), {(0, 1): 1.0, (1, 0): 1.0})
+
+    def test_only_missing(self):
+        self.build()
+        SongNeighbor.objects.filter(song=self.songs[0], neighbor=self.songs[1]).update(score=0.5)
+        self.add_likes([(2, 4)])
+        self.build(only_missing=True)
+        neighbors = self.neighbors()
+        self.assertEqual(neighbors[0, 1], 0.5)  # song 0 already had neighbors, it was not rebuilt
+        self.assertEqual((neighbors[3, 4], neighbors[4, 3]), (1.0, 1.0))
+
+    def test_unliked_songs_lose_their_neighbors(self):
+        self.build()
+        Like.objects.filter(song=self.songs[2]).delete()
+        self.build()
+        self.assertEqual(self.neighbors(), {(0, 1): 1.0, (1, 0): 1.0})
+        Like.objects.all().delete()
+        self.build()
+        self.assertFalse(SongNeighbor.objects.exists())
+
+    def test_build_invalidates_the_recommendations(self):
+        self.like(self.songs[3:4])
+        self.assertEqual(Song.get_recommended_ids_for_user(self.user), [self.songs[0].id])  # genre fallback
+        self.add_likes([(2, 4)])
+        self.build()
+        self.assertEqual(Song.get_recommended_ids_for_user(self.user), [self.songs[4].id])
+
+    def test_neighbor_recommendations(self):
+        self.build()
+        self.like(self.songs[2:3])
+        recommended = Song.get_recommended_for_user(self.user)
+        self.assertEqual([(song.id, round(song.score, 3)) for song in recommended],
+                         [(self.songs[1].id, 0.707), (self.songs[0].id, 0.707)])
+        # the scores of the neighbors of every liked song add up, liked songs are left out
+        self.like(self.songs[1:2])
+        recommended = Song.get_recommended_for_user(self.user)
+        self.assertEqual([(song.id, round(song.score, 3)) for song in recommended],
+                         [(self.songs[0].id, 1.707)])
+
+
+@override_settings(STORAGES=LOCAL_STORAGES)
+class ListETagTest(MusicTestCase):
+    urls = ('/music/list/', '/music/liked/', '/music/async/list/', '/music/async/liked/')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # a file cache is shared by the worker processes of a host, unlike the test cache (LocMemCache)
+        shared_cache = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name}})
+        shared_cache.enable()
+        self.addCleanup(shared_cache.disable)
+        super().setUp()
+        self.songs = create_songs(3)
+
+    def get(self, url: str, etag: str = None):
+        return self.client.get(url, headers={'If-None-Match': etag} if etag else {})
+
+    def test_not_modified(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                etag = self.get(url)['ETag']
+                response = self.get(url, etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+
+    def test_like_changes_the_etag(self):
+        etags = {url: self.get(url)['ETag'] for url in self.urls}
+        self.like(self.songs[:1])
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.get(url, etags[url]).status_code, 200)
+
+    def test_url_signing_period_changes_the_etag(self):
+        with mock.patch('music.conditional.default_storage') as storage:
+            storage.url_period.return_value = 1
+            etags = {url: self.get(url)['ETag'] for url in self.urls}
+            storage.url_period.return_value = 2
+            for url in self.urls:
+                with self.subTest(url=url):
+                    self.assertEqual(self.get(url, etags[url]).status_code, 200)
+
+    def test_no_etag_without_a_shared_cache(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            for url in self.urls:
+                with self.subTest(url=url):
+                    response = self.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertNotIn('ETag', response)
+
+
+# on SQLite the mirror connection waits on the locks of the test transaction instead of reading past it
+@skipUnless(connection.vendor == 'postgresql', "the replica is stood in for on PostgreSQL")
+@override_settings(STORAGES=LOCAL_STORAGES)
+class ReplicaRoutingTest(MusicTestCase):
+    """a second connection to the test database stands in for a replica, it is a test mirror,
+       so it is outside the test transaction and never sees the rows of the test, like a replica far behind
+    """
+    replica = 'replica_test'
+
+    @classmethod
+    def setUpClass(cls):
+        # added once the test database exists, so it is the only replica of these tests
+        connections.settings[cls.replica] = {**connections['default'].settings_dict, 'TEST': {'MIRROR': 'default'}}
+        cls.databases = {'default', cls.replica}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[cls.replica].close()
+        if connections[cls.replica].vendor == 'postgresql':
+            connections[cls.replica].close_pool()
+        del connections[cls.replica]
+        del connections.settings[cls.replica]
+
+    def setUp(self):
+        super().setUp()
+        self.songs = create_songs(3)
+
+    def get(self, url: str) -> tuple:
+        """the songs of the response, the number of queries run on the primary and on the replicas
+        """
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[self.replica]) as replica:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(primary), len(replica)
+
+    def test_lists_read_from_the_replica(self):
+        self.client.get('/music/list/')  # caches the user
+        for url in ('/music/list/', '/music/liked/', '/music/search/?q=Song', '/music/popular/',
+                    '/music/async/list/', '/music/async/liked/', '/music/async/search/?q=Song'):
+            with self.subTest(url=url):
+                songs, primary_queries, replica_queries = self.get(url)
+                self.assertEqual(songs if isinstance(songs, list) else songs['results'], [])
+                self.assertEqual(primary_queries, 0)
+                self.assertGreater(replica_queries, 0)
+
+    def test_writes_go_to_the_primary(self):
+        with db_router.read_from_replica():
+            Like.objects.create(user=self.user, song=self.songs[0])
+        self.assertTrue(Like.objects.filter(user=self.user, song=self.songs[0]).exists())
+        self.assertFalse(Like.objects.using(self.replica).exists())
+
+    def test_reads_after_a_like_go_to_the_primary(self):
+        response = self.client.post(f'/music/like/{self.songs[0].id}/')
+        self.assertEqual(response.status_code, 201)
+        for url in ('/music/list/', '/music/async/list/'):
+            with self.subTest(url=url):
+                songs, primary_queries, replica_queries = self.get(url)
+                self.assertEqual([(song['id'], song['liked']) for song in songs],
+                                 [(song.id, song == self.songs[0]) for song in self.songs])
+                self.assertEqual(replica_queries, 0)
+
+        # the pin ends after REPLICA_PIN_SECONDS
+        cache.delete(db_router.PIN_CACHE_KEY.format(user_id=self.user.pk))
+        songs, _, replica_queries = self.get('/music/list/')
+        self.assertEqual(songs, [])
+        self.assertGreater(replica_queries, 0)
+
+    def test_pin_is_per_user(self):
+        self.like(self.songs[:1])
+        self.assertFalse(db_router.should_read_from_replica(self.user.pk))
+        other = CustomUser.objects.create_user(username="other", email="other@example.com")
+        self.assertTrue(db_router.should_read_from_replica(other.pk))
+
+
+def start_upload(user: CustomUser) -> SongUpload:
+    """a one part upload whose part the bucket has received
+    """
+    boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="songs-bucket")
+    upload = SongUpload.start(user, "song.mp3", len(AUDIO), "audio/mpeg", "Uploaded", "Artist", "rock")
+    requests.put(upload.get_part_urls([1])[1], data=AUDIO).raise_for_status()
+    return upload
+
+
+class CatalogUrlTest(MusicFilesTestCase):
+    """the catalog sync and snapshots carry urls of this server, which stay valid, instead of presigned urls
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.song = create_songs(1)[0]
+        CatalogChange.record([self.song.id])
+        default_storage.save(self.song.image.name, ContentFile(b"cover"))
+        default_storage.save("song_images/0_64.webp", ContentFile(b"small cover"))
+        self.song.image_variants = {"source": self.song.image.name, "sizes": {"64": {"webp": "song_images/0_64.webp"}}}
+        self.song.save()
+
+    def synced_song(self) -> dict:
+        response = self.client.get('/music/sync/?since=0')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['songs'][0]
+
+    def snapshot_song(self, **options) -> dict:
+        call_command('build_catalog_snapshot', stdout=StringIO(), **options)
+        response = self.client.get('/music/snapshot/')
+        return json.loads(b"".join(response.streaming_content))['songs'][0]
+
+    def test_sync_urls_are_absolute_on_the_request(self):
+        song = self.synced_song()
+        self.assertEqual(song['audio_file'], f"http://testserver/music/stream/{self.song.id}/")
+        self.assertEqual(song['image'], f"http://testserver/music/image/{self.song.id}/")
+        self.assertEqual(song['image_variants'],
+                         {"64": {"webp": f"http://testserver/music/image/{self.song.id}/?size=64&image_format=webp"}})
+
+    @override_settings(CATALOG_BASE_URL="https://api.example.com")
+    def test_snapshot_and_sync_are_the_same(self):
+        song = self.snapshot_song()
+        self.assertEqual(song, self.synced_song())
+        self.assertEqual(song['audio_file'], f"https://api.example.com/music/stream/{self.song.id}/")
+
+    def test_snapshot_needs_the_base_url(self):
+        with self.assertRaises(CommandError):
+            call_command('build_catalog_snapshot', stdout=StringIO())
+        song = self.snapshot_song(base_url="https://api.example.com/")
+        self.assertEqual(song['image'], f"https://api.example.com/music/image/{self.song.id}/")
+
+    def test_image_urls(self):
+        song = self.synced_song()
+        for url, content in ((song['image'], b"cover"), (song['image_variants']['64']['webp'], b"small cover")):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(b"".join(response.streaming_content), content)
+        self.assertEqual(self.client.get(f"/music/image/{self.song.id}/?size=640&image_format=webp").status_code, 404)
+
+
+def png(width: int, height: int) -> bytes:
+    output = BytesIO()
+    Image.new('RGBA', (width, height), (200, 30, 30, 128)).save(output, format='PNG')
+    return output.getvalue()
+
+
+class ImageVariantsTest(MusicFilesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.song = create_songs(1)[0]
+        self.song.image = default_storage.save("song_images/cover.png", ContentFile(png(800, 400)))
+        self.song.save()
+
+    def build(self) -> str:
+        stderr = StringIO()
+        call_command('build_image_variants', once=True, processes=0, stdout=StringIO(), stderr=stderr)
+        self.song.refresh_from_db()
+        return stderr.getvalue()
+
+    def test_variants(self):
+        self.user.profile_image = default_storage.save("profile_images/me.png", ContentFile(png(100, 50)))
+        self.user.save()
+        version = CatalogChange.get_version()
+        self.assertEqual(self.build(), "")
+        self.assertEqual(self.song.image_variants["source"], "song_images/cover.png")
+        self.assertGreater(CatalogChange.get_version(), version)
+        for owner, variants, dimensions in (
+            ("song", self.song.image_variants, {"64": (64, 32), "256": (256, 128), "640": (640, 320)}),
+            # never enlarged
+            ("user", CustomUser.objects.get(id=self.user.id).profile_image_variants,
+             {"64": (64, 32), "256": (100, 50), "640": (100, 50)}),
+        ):
+            self.assertEqual(set(variants["sizes"]), set(dimensions))
+            for size, formats in variants["sizes"].items():
+                for image_format, pillow_format in (("webp", "WEBP"), ("jpeg", "JPEG")):
+                    with self.subTest(owner=owner, size=size, image_format=image_format):
+                        with default_storage.open(formats[image_format]) as file, Image.open(file) as image:
+                            self.assertEqual((image.format, image.size), (pillow_format, dimensions[size]))
+
+    def test_unreadable_image(self):
+        Song.objects.filter(id=self.song.id).update(image="song_images/missing.png")
+        errors = self.build()
+        self.assertIn(f"Song {self.song.id} (song_images/missing.png): FileNotFoundError", errors)
+        # marked done, not retried on every run
+        self.assertEqual(self.song.image_variants, {"source": "song_images/missing.png", "sizes": {}})
+        self.assertEqual(self.build(), "")
+
+    def test_image_replaced_while_resizing(self):
+        atomic_blocks = len(connection.atomic_blocks)
+        build_variants_safe = images.build_variants_safe
+
+        def replaced_while_resizing(name):
+            # resized outside of any transaction, so the rows are not locked meanwhile
+            self.assertEqual(len(connection.atomic_blocks), atomic_blocks)
+            if name == "song_images/cover.png":
+                song = Song.objects.get(id=self.song.id)
+                song.image = default_storage.save("song_images/new_cover.png", ContentFile(png(300, 300)))
+                song.save()
+            return build_variants_safe(name)
+
+        with mock.patch('music.management.commands.build_image_variants.build_variants_safe',
+                        side_effect=replaced_while_resizing) as resize:
+            self.build()
+        self.assertEqual([call.args[0] for call in resize.call_args_list],
+                         ["song_images/cover.png", "song_images/new_cover.png"])
+        self.assertEqual(self.song.image_variants["source"], "song_images/new_cover.png")
+
+    def test_format_negotiation(self):
+        self.build()
+        url = f'/music/image/{self.song.id}/'
+        for params, accept, content_type in (
+            ({}, "image/webp,*/*", "image/png"),
+            ({'size': 64}, "image/avif,image/webp,*/*", "image/webp"),
+            ({'size': 64}, "image/jpeg,*/*", "image/jpeg"),
+            ({'size': 64}, None, "image/jpeg"),
+            ({'size': 64, 'image_format': 'jpeg'}, "image/webp,*/*", "image/jpeg"),
+        ):
+            with self.subTest(params=params, accept=accept):
+                response = self.client.get(url, params, headers={'Accept': accept} if accept else {})
+                self.assertEqual((response.status_code, response['Content-Type']), (200, content_type))
+                self.assertIn('Accept', [header.strip() for header in response['Vary'].split(',')])
+        self.assertEqual(self.client.get(url, {'size': 32}).status_code, 404)
+        self.assertEqual(self.client.get(url, {'size': 64, 'image_format': 'gif'}).status_code, 404)
+
+    def test_variants_of_a_replaced_image_are_not_served(self):
+        self.build()
+        self.song.image = default_storage.save("song_images/new_cover.png", ContentFile(png(300, 300)))
+        self.song.save()
+        self.assertEqual(self.client.get(f'/music/image/{self.song.id}/', {'size': 64}).status_code, 404)
+
+
+@mock_aws
+@override_settings(STORAGES=S3_STORAGES)
+class SongUploadTest(MusicTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user.is_staff = True
+        self.user.save()
+        self.upload = start_upload(self.user)
+
+    def test_complete(self):
+        response = self.client.post(f'/music/uploads/{self.upload.id}/complete/')
+        self.assertEqual(response.status_code, 201)
+        song = Song.objects.get(id=response.json()['id'])
+        self.assertEqual(song.audio_file.read(), AUDIO)
+        # completing again returns the same song
+        response = self.client.post(f'/music/uploads/{self.upload.id}/complete/')
+        self.assertEqual((response.status_code, response.json()['id']), (200, song.id))
+
+    def test_complete_after_a_concurrent_complete(self):
+        # the instance was loaded while the upload was pending, the status is checked again under the lock
+        stale = SongUpload.objects.get(id=self.upload.id)
+        song = self.upload.complete()
+        with self.assertRaises(SongUpload.NotPending):
+            stale.complete()
+        self.assertEqual((stale.status, stale.song), (SongUpload.COMPLETED, song))
+        self.assertEqual(Song.objects.count(), 1)
+
+    def test_abort_after_complete(self):
+        stale = SongUpload.objects.get(id=self.upload.id)
+        self.upload.complete()
+        with self.assertRaises(SongUpload.NotPending):
+            stale.abort()
+        self.assertEqual(SongUpload.objects.get(id=self.upload.id).status, SongUpload.COMPLETED)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+@mock_aws
+@override_settings(STORAGES=S3_STORAGES)
+class SongUploadConcurrencyTest(TransactionTestCase):
+
+    def test_concurrent_completes_create_one_song(self):
+        upload = start_upload(CustomUser.objects.create_user(username="admin", email="admin@example.com"))
+        storage = SongUpload.get_storage()
+        complete_multipart_upload = storage.complete_multipart_upload
+        in_bucket = threading.Event()
+        results = {}
+
+        def slow_complete_multipart_upload(*args):
+            # the second call starts while the first is assembling the parts
+            in_bucket.set()
+            time.sleep(0.5)
+            complete_multipart_upload(*args)
+
+        def complete(name: str) -> None:
+            try:
+                results[name] = SongUpload.objects.get(id=upload.id).complete()
+            except SongUpload.NotPending as e:
+                results[name] = e
+            finally:
+                connections.close_all()
+
+        with mock.patch.object(storage, 'complete_multipart_upload', side_effect=slow_complete_multipart_upload):
+            first = threading.Thread(target=complete, args=("first",))
+            first.start()
+            in_bucket.wait(10)
+            second = threading.Thread(target=complete, args=("second",))
+            second.start()
+            first.join()
+            second.join()
+
+        self.assertIsInstance(results["first"], Song)
+        self.assertIsInstance(results["second"], SongUpload.NotPending)
+        self.assertEqual(list(Song.objects.values_list('id', flat=True)), [results["first"].id])
+
+
+@mock_aws
+@override_settings(STORAGES=S3_STORAGES)
+class IngestCatalogTest(TestCase):
+    """S3 errors of one file fail its line, the other songs are still created
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.manifest = os.path.join(directory.name, "manifest.jsonl")
+        with open(self.manifest, "w") as manifest:
+            for n in range(3):
+                with open(os.path.join(directory.name, f"{n}.mp3"), "wb") as audio:
+                    audio.write(AUDIO)
+                manifest.write(json.dumps({"title": f"Song {n}", "artist_name": "Artist", "genre": "rock",
+                                           "audio": f"{n}.mp3"}) + "\n")
+
+    def ingest(self) -> str:
+        stderr = StringIO()
+        call_command("ingest_catalog", self.manifest, workers=2, stdout=StringIO(), stderr=stderr)
+        return stderr.getvalue()
+
+    def test_client_error(self):
+        # the bucket does not exist
+        errors = self.ingest()
+        self.assertEqual(errors.count("NoSuchBucket"), 3)
+        self.assertFalse(Song.objects.exists())
+
+    def test_connection_error(self):
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="songs-bucket")
+        storage = Song._meta.get_field('audio_file').storage
+        save = storage.save
+
+        def unreachable_for_song_1(name, content, **kwargs):
+            if content.name.endswith("1.mp3"):
+                raise EndpointConnectionError(endpoint_url="https://bucket.example.com")
+            return save(name, content, **kwargs)
+
+        with mock.patch.object(storage, 'save', side_effect=unreachable_for_song_1):
+            errors = self.ingest()
+        self.assertIn("line 2: Could not connect to the endpoint URL", errors)
+        self.assertEqual(sorted(Song.objects.values_list('title', flat=True)), ["Song 0", "Song 2"])
@@ -1,11 +1,30 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 
 urlpatterns = [
     path("list/", views.SongListAPIView.as_view()),
     path("like/<int:song_id>/", views.LikeSongAPIView.as_view()),
     path("unlike/<int:song_id>/", views.UnlikeSongAPIView.as_view()),
+    path("like/batch/", views.BatchLikeAPIView.as_view()),
     path("liked/", views.LikedListAPIView.as_view()),
     path("recommend/", views.RecommendSongListAPIView.as_view()),
-    path("search/", views.SearchSongListAPIView.as_view())
+    path("search/", views.SearchSongListAPIView.as_view()),
+    path("popular/", views.PopularSongListAPIView.as_view()),
+    path("trending/", views.TrendingSongListAPIView.as_view()),
+    path("sync/", views.CatalogSyncAPIView.as_view()),
+    path("snapshot/", views.CatalogSnapshotAPIView.as_view()),
+    path("stream/<int:song_id>/", views.StreamSongAPIView.as_view(), name="song_stream"),
+    path("image/<int:song_id>/", views.SongImageAPIView.as_view(), name="song_image"),
+    path("uploads/", views.SongUploadStartAPIView.as_view()),
+    path("uploads/<int:upload_id>/", views.SongUploadAPIView.as_view()),
+    path("uploads/<int:upload_id>/parts/", views.SongUploadPartsAPIView.as_view()),
+    path("uploads/<int:upload_id>/complete/", views.SongUploadCompleteAPIView.as_view()),
+
+    # async versions, for serving under ASGI
+    path("async/list/", async_views.song_list),
+    path("async/like/<int:song_id>/", async_views.like_song),
+    path("async/unlike/<int:song_id>/", async_views.unlike_song),
+    path("async/like/batch/", async_views.batch_like),
+    path("async/liked/", async_views.liked_list),
+    path("async/search/", async_views.search)
 ]
\ No newline at end of file
@@ -1,37 +1,145 @@
 from rest_framework import views, generics
-from .models import Song, Like
-from .serializers import SongSerializer
+from .models import Song, Like, SongLikeBucket, SongUpload, CatalogChange, CatalogSnapshot
+from .serializers import (
+    SongSerializer,
+    FastSongListSerializer,
+    CatalogSongSerializer,
+    PopularSongSerializer,
+    LikeBatchSerializer,
+    SongUploadSerializer,
+    SongUploadStartSerializer,
+    SongUploadPartsSerializer
+)
 from rest_framework import permissions
-from django.shortcuts import get_object_or_404
+from rest_framework.renderers import BrowsableAPIRenderer
+from django.http import Http404
 from rest_framework.response import Response
 from rest_framework.request import Request
 from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date
+from storages.backends.s3 import S3Storage
+from spotechnify_server import db_router
+from spotechnify_server.images import current_variants
+from spotechnify_server.renderers import FastJSONRenderer
+from . import conditional, streaming
+from .pagination import PopularSongPagination
+import mimetypes
+
+class LikedSongIdsMixin:
+    """unless LIKED_SONGS_MODE is "annotate", the liked song ids of the user are loaded once
+       and handed to the serializer, instead of annotating every song with an Exists subquery
+    """
+
+    def annotate_liked(self) -> bool:
+        return settings.LIKED_SONGS_MODE == 'annotate'
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if not self.annotate_liked():
+            context['liked_song_ids'] = Like.get_liked_song_ids(self.request.user)
+        return context
+
+class ReplicaReadMixin:
+    """GET requests read from the replicas, unless the user liked/unliked recently (see db_router.pin_to_primary)
+    """
+    replica_token = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in ('GET', 'HEAD') and db_router.should_read_from_replica(request.user.pk):
+            self.replica_token = db_router.reading_from_replica.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if self.replica_token is not None:
+            db_router.reading_from_replica.reset(self.replica_token)
+            self.replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+class ConditionalListMixin:
+    """song lists carry an ETag built from the catalog version, the likes version of the user and the url signing
+       period (only with a cache shared by the workers, see conditional.list_etag), a request whose If-None-Match matches it gets 304 without running the song query or the serializer
+    """
 
-class SongListAPIView(generics.ListAPIView):
+    def get_etag(self, request):
+        user = request.user
+        return conditional.list_etag(request, user.pk, Song.get_catalog_version(), Like.get_likes_version(user))
+
+    def list(self, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        if etag is not None and conditional.etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        response = super().list(request, *args, **kwargs)
+        if etag is not None:
+            response['ETag'] = etag
+            # clients may keep the list, but have to revalidate it
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+class FastSongListMixin:
+    """song lists are read as values() rows, serialized by FastSongListSerializer and encoded with orjson,
+       with the same output as serializer_class, unless SONG_LIST_FAST_PATH is off
+    """
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def list(self, request, *args, **kwargs):
+        if not settings.SONG_LIST_FAST_PATH:
+            return super().list(request, *args, **kwargs)
+        serializer = FastSongListSerializer(self.get_serializer_class(), self.get_serializer_context())
+        if not serializer.supported:
+            return super().list(request, *args, **kwargs)
+        rows = serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serializer.serialize(page))
+        return Response(serializer.serialize(rows))
+
+class SongListAPIView(ReplicaReadMixin, ConditionalListMixin, FastSongListMixin, LikedSongIdsMixin,
+                      generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = SongSerializer
 
     def get_queryset(self):
-        return Song.annotate_by_like(self.request.user)
+        if not self.annotate_liked():
+            return Song.objects.order_by('id')
+        return Song.annotate_by_like(self.request.user).order_by('id')
 
-class LikedListAPIView(generics.ListAPIView):
+class LikedListAPIView(ReplicaReadMixin, ConditionalListMixin, FastSongListMixin, LikedSongIdsMixin,
+                       generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = SongSerializer
 
     def get_queryset(self):
         user = self.request.user
-        return Song.get_liked_by_user(user)
+        return Song.get_liked_by_user(user, annotate_liked=self.annotate_liked()).order_by('id')
 
-class RecommendSongListAPIView(generics.ListAPIView):
+class RecommendSongListAPIView(ReplicaReadMixin, generics.ListAPIView):
+    """the best RECOMMENDATION_CACHE_SIZE recommendations of the user, the list ends there, paged or not
+       (see Song.get_recommended_ids_for_user), a list cut at the limit has an X-Result-Limit header
+    """
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = SongSerializer
 
-    def get_queryset(self):
-        user = self.request.user
-        recommendation = Song.get_recommended_for_user(user)
-        return recommendation
+    def list(self, request, *args, **kwargs):
+        # the ranked ids are cached, only the songs of the page are loaded
+        ids = Song.get_recommended_ids_for_user(request.user)
+        page_ids = self.paginator.paginate_id_list(ids, request)
+        songs = Song.get_by_ids(ids if page_ids is None else page_ids)
+        serializer = self.get_serializer(songs, many=True)
+        if page_ids is None:
+            response = Response(serializer.data)
+        else:
+            response = self.get_paginated_response(serializer.data)
+        if len(ids) >= settings.RECOMMENDATION_CACHE_SIZE:
+            response['X-Result-Limit'] = str(settings.RECOMMENDATION_CACHE_SIZE)
+        return response
 
-class SearchSongListAPIView(generics.ListAPIView):
+class SearchSongListAPIView(ReplicaReadMixin, FastSongListMixin, LikedSongIdsMixin, generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = SongSerializer
 
@@ -39,22 +147,50 @@ class SearchSongListAPIView(generics.ListAPIView):
         request: Request = self.request
         user = self.request.user
         query = request.GET.get('q', '').strip()
-        search_result = Song.search(user, query)
+        search_result = Song.search(user, query, annotate_liked=self.annotate_liked())
         return search_result
 
+class PopularSongListAPIView(ReplicaReadMixin, FastSongListMixin, LikedSongIdsMixin, generics.ListAPIView):
+    """songs with the most likes first, optionally of one genre (?genre=)
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = PopularSongSerializer
+    pagination_class = PopularSongPagination
+
+    def get_queryset(self):
+        genre = self.request.GET.get('genre', '').strip()
+        return Song.get_popular(self.request.user, genre=genre, annotate_liked=self.annotate_liked())
+
+class TrendingSongListAPIView(ReplicaReadMixin, generics.ListAPIView):
+    """songs liked the most recently, by the decayed like counts of the last TRENDING_WINDOW_HOURS
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = SongSerializer
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        # the songs are loaded by id without the "liked" annotation
+        context['liked_song_ids'] = Like.get_liked_song_ids(self.request.user)
+        return context
+
+    def list(self, request, *args, **kwargs):
+        ids = SongLikeBucket.get_trending_ids()
+        page_ids = self.paginator.paginate_id_list(ids, request)
+        songs = Song.get_by_ids(ids if page_ids is None else page_ids)
+        serializer = self.get_serializer(songs, many=True)
+        if page_ids is None:
+            return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
+
 class LikeSongAPIView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, song_id):
-        song = get_object_or_404(Song, id=song_id)
+        result = Like.apply_changes(request.user, [song_id], [])[song_id]
 
-        like, created = Like.objects.get_or_create(
-            user=request.user,
-            song=song,
-            defaults={'user': request.user, 'song': song}
-        )
-
-        if created:
+        if result == Like.NOT_FOUND:
+            raise Http404("No Song matches the given query.")
+        if result == Like.LIKED:
             return Response(
                 {"message": "Song liked successfully."},
                 status=status.HTTP_201_CREATED
@@ -69,11 +205,11 @@ class UnlikeSongAPIView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def delete(self, request, song_id):
-        song = get_object_or_404(Song, id=song_id)
-        like = Like.objects.filter(user=request.user, song=song).first()
+        result = Like.apply_changes(request.user, [], [song_id])[song_id]
 
-        if like:
-            like.delete()
+        if result == Like.NOT_FOUND:
+            raise Http404("No Song matches the given query.")
+        if result == Like.UNLIKED:
             return Response(
                 {"message": "Song unliked successfully."},
                 status=status.HTTP_200_OK
@@ -82,4 +218,249 @@ class UnlikeSongAPIView(views.APIView):
             return Response(
                 {"message": "You haven't liked this song."},
                 status=status.HTTP_200_OK
-            )
\ No newline at end of file
+            )
+
+class BatchLikeAPIView(views.APIView):
+    """likes and unlikes many songs in one transaction, e.g. to sync likes made offline
+       body: {"like": [song ids], "unlike": [song ids]}
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = LikeBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = Like.apply_changes(
+            request.user,
+            serializer.validated_data['like'],
+            serializer.validated_data['unlike']
+        )
+        return Response(
+            {"results": [{"song_id": song_id, "result": result} for song_id, result in results.items()]},
+            status=status.HTTP_200_OK
+        )
+
+class StreamSongAPIView(ReplicaReadMixin, views.APIView):
+    """streams the audio file of a song, honoring Range/If-Range so clients can seek
+       on S3 the client is redirected to a presigned url, S3 itself serves the ranges,
+       otherwise the file is read from the storage in STREAM_CHUNK_SIZE chunks
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, song_id):
+        song = get_object_or_404(Song, id=song_id)
+        audio_file = song.audio_file
+        storage = audio_file.storage
+        if isinstance(storage, S3Storage):
+            return HttpResponseRedirect(storage.url(audio_file.name))
+
+        try:
+            if not audio_file.name:
+                raise FileNotFoundError()
+            size = storage.size(audio_file.name)
+        except OSError:
+            # the row outlived its file (or never had one)
+            raise Http404("The song has no audio file.")
+        last_modified = streaming.file_last_modified(storage, audio_file.name)
+        etag = streaming.file_etag(size, last_modified)
+        content_type = mimetypes.guess_type(audio_file.name)[0] or 'application/octet-stream'
+
+        byte_range = None
+        if streaming.if_range_matches(request.headers.get('If-Range'), etag, last_modified):
+            try:
+                byte_range = streaming.parse_range(request.headers.get('Range'), size)
+            except streaming.RangeNotSatisfiable:
+                response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+                response['Content-Range'] = f"bytes */{size}"
+                return response
+
+        start, end = byte_range or (0, size - 1)
+        response = StreamingHttpResponse(
+            streaming.iter_file_range(storage, audio_file.name, start, end, settings.STREAM_CHUNK_SIZE),
+            status=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+            content_type=content_type
+        )
+        response['Accept-Ranges'] = 'bytes'
+        response['Content-Length'] = str(end - start + 1)
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        if byte_range:
+            response['Content-Range'] = f"bytes {start}-{end}/{size}"
+        return response
+
+class CatalogSyncAPIView(views.APIView):
+    """the songs inserted/updated and deleted since the catalog version the client has (?since=),
+       a client that is up to date costs one primary key lookup
+       reads go to the primary: the version and the changes must come from the same database
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def get(self, request):
+        try:
+            since = int(request.GET.get('since', ''))
+        except ValueError:
+            return Response({"error": "since must be a catalog version"}, status=status.HTTP_400_BAD_REQUEST)
+        version = CatalogChange.get_version()
+        if since == version:
+            return Response({"version": version, "reset": False, "songs": [], "deleted": []})
+        changes = None
+        if 0 <= since < version:
+            changes = CatalogChange.get_changes(since, version, settings.CATALOG_SYNC_MAX_CHANGES)
+        if changes is None:
+            # too far behind (or a version of another database), start again from /music/snapshot/
+            return Response({"version": version, "reset": True, "songs": [], "deleted": []})
+        updated, deleted = changes
+        serializer = FastSongListSerializer(CatalogSongSerializer,
+                                            context={'request': request, 'base_url': settings.CATALOG_BASE_URL})
+        songs = serializer.serialize(serializer.values(Song.objects.filter(id__in=updated).order_by('id')))
+        return Response({"version": version, "reset": False, "songs": songs, "deleted": deleted})
+
+class SongImageAPIView(ReplicaReadMixin, views.APIView):
+    """the image of a song, or with ?size=&image_format= one of its resized variants (see build_image_variants),
+       with ?size= alone the WebP variant if the client accepts image/webp, else the JPEG one,
+       the stable image url of the catalog snapshot and sync, on S3 the client is redirected to a presigned url
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, song_id):
+        song = get_object_or_404(Song.objects.only('image', 'image_variants'), id=song_id)
+        name = song.image.name
+        size, image_format = request.GET.get('size'), request.GET.get('image_format')
+        if size is not None or image_format is not None:
+            variants = current_variants(song.image, song.image_variants) or {'sizes': {}}
+            formats = variants['sizes'].get(size, {})
+            if image_format is None:
+                # APIView already sends Vary: Accept
+                accepts_webp = 'image/webp' in request.headers.get('Accept', '')
+                image_format = 'webp' if accepts_webp and 'webp' in formats else 'jpeg'
+            name = formats.get(image_format)
+        if not name:
+            raise Http404("The song has no such image.")
+        storage = song.image.storage
+        if isinstance(storage, S3Storage):
+            return HttpResponseRedirect(storage.url(name))
+        return FileResponse(storage.open(name, 'rb'),
+                            content_type=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+
+class CatalogSnapshotAPIView(views.APIView):
+    """the latest full catalog snapshot (see the build_catalog_snapshot command), precompressed with brotli or gzip
+       when the client accepts it, on S3 the client is redirected to the file
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        snapshot = CatalogSnapshot.get_latest()
+        if snapshot is None:
+            raise Http404("No catalog snapshot has been built yet.")
+        name, encoding = snapshot.get_file(request.headers.get('Accept-Encoding', ''))
+        storage = default_storage
+        if isinstance(storage, S3Storage):
+            # the object was stored with its Content-Encoding
+            return HttpResponseRedirect(storage.url(name))
+
+        etag = f'"catalog-{snapshot.version}-{encoding or "identity"}"'
+        if conditional.etag_matches(request, etag):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = FileResponse(storage.open(name, 'rb'), content_type='application/json')
+            if encoding is not None:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        response['Vary'] = 'Accept-Encoding'
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+class NotImplementedUpload(APIException):
+    status_code = status.HTTP_501_NOT_IMPLEMENTED
+    default_detail = "Direct uploads need an S3 storage."
+    default_code = "not_implemented"
+
+class SongUploadMixin:
+    """uploads need a storage with multipart uploads (S3), each admin sees their own uploads
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if SongUpload.get_storage() is None:
+            raise NotImplementedUpload()
+
+    def get_upload(self, upload_id) -> SongUpload:
+        return get_object_or_404(SongUpload, id=upload_id, user_id=self.request.user.pk)
+
+    def get_pending_upload(self, upload_id) -> SongUpload:
+        upload = self.get_upload(upload_id)
+        if upload.status != SongUpload.PENDING:
+            raise ValidationError({"error": f"Upload is {upload.status}"})
+        return upload
+
+class SongUploadStartAPIView(SongUploadMixin, views.APIView):
+    """starts a multipart upload of an audio file straight to the bucket
+       body: {"filename", "size", "content_type", "title", "artist_name", "genre"}
+       the client then gets part urls from SongUploadPartsAPIView, PUTs the parts to them
+       and calls SongUploadCompleteAPIView
+    """
+
+    def post(self, request):
+        serializer = SongUploadStartSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = SongUpload.start(request.user, **serializer.validated_data)
+        return Response(SongUploadSerializer(upload).data, status=status.HTTP_201_CREATED)
+
+class SongUploadAPIView(SongUploadMixin, views.APIView):
+    """GET: the upload and the parts the bucket already has, to resume after a dropped connection
+       DELETE: aborts the upload
+    """
+
+    def get(self, request, upload_id):
+        upload = self.get_upload(upload_id)
+        data = SongUploadSerializer(upload).data
+        if upload.status == SongUpload.PENDING:
+            data['uploaded_parts'] = [
+                {"number": part['PartNumber'], "size": part['Size']} for part in upload.get_uploaded_parts()
+            ]
+        return Response(data)
+
+    def delete(self, request, upload_id):
+        try:
+            self.get_pending_upload(upload_id).abort()
+        except SongUpload.NotPending as e:
+            raise ValidationError({"error": str(e)})
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class SongUploadPartsAPIView(SongUploadMixin, views.APIView):
+    """presigned PUT urls of parts of the upload
+       body: {"part_numbers": [1, 2, ...]}
+    """
+
+    def post(self, request, upload_id):
+        upload = self.get_pending_upload(upload_id)
+        serializer = SongUploadPartsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        part_numbers = serializer.validated_data['part_numbers']
+        if max(part_numbers) > upload.part_count:
+            raise ValidationError({"part_numbers": f"The upload has {upload.part_count} parts."})
+        urls = upload.get_part_urls(part_numbers)
+        return Response({"parts": [{"number": number, "url": url} for number, url in urls.items()]})
+
+class SongUploadCompleteAPIView(SongUploadMixin, views.APIView):
+    """assembles the uploaded parts and creates the song
+       calling it again after it succeeded returns the same song
+    """
+
+    def post(self, request, upload_id):
+        upload = self.get_upload(upload_id)
+        if upload.status == SongUpload.COMPLETED and upload.song is not None:
+            return Response(SongSerializer(upload.song, context={'request': request}).data)
+        upload = self.get_pending_upload(upload_id)
+        try:
+            song = upload.complete()
+        except SongUpload.IncompleteUpload as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except SongUpload.NotPending as e:
+            # a concurrent call completed (or aborted) it first
+            if upload.status == SongUpload.COMPLETED and upload.song is not None:
+                return Response(SongSerializer(upload.song, context={'request': request}).data)
+            raise ValidationError({"error": str(e)})
+        return Response(SongSerializer(song, context={'request': request}).data, status=status.HTTP_201_CREATED)
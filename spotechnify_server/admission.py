@@ -0,0 +1,233 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.exceptions import Throttled
+from rest_framework.request import Request
+from rest_framework.throttling import BaseThrottle
+from .async_api import request_data
+
+
+class ServerBusy(Throttled):
+    default_detail = "Too many requests are being handled right now, try again later."
+
+
+class ConcurrencyLimiter:
+    """runs at most `limit` blocks at the same time in this process (across threads and event loops),
+       up to `queue_size` more wait at most `timeout` seconds for a slot, the rest are rejected at once
+       with ServerBusy (429 with Retry-After), so a burst can not take every thread of the worker
+    """
+
+    def __init__(self, limit: int, queue_size: int, timeout: float, retry_after: int):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.condition = threading.Condition()
+        self.running = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.wait_time = 0.0
+
+    def enter_queue(self) -> bool:
+        """takes a slot if one is free (True), otherwise queues the caller (False)
+           must be called with the condition held
+        """
+        if self.running < self.limit:
+            self.running += 1
+            self.admitted += 1
+            return True
+        if self.waiting >= self.queue_size:
+            self.rejected_full += 1
+            raise ServerBusy(wait=self.retry_after)
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        return False
+
+    def leave_queue(self, admitted: bool, waited: float) -> None:
+        """must be called with the condition held
+        """
+        self.waiting -= 1
+        self.wait_time += waited
+        if not admitted:
+            self.rejected_timeout += 1
+            raise ServerBusy(wait=self.retry_after)
+        self.running += 1
+        self.admitted += 1
+
+    def release(self) -> None:
+        with self.condition:
+            self.running -= 1
+            self.condition.notify()
+
+    @contextmanager
+    def slot(self):
+        with self.condition:
+            if not self.enter_queue():
+                started = time.perf_counter()
+                admitted = self.condition.wait_for(lambda: self.running < self.limit, self.timeout)
+                self.leave_queue(admitted, time.perf_counter() - started)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        """same as slot, for async views: waiting polls instead of blocking the event loop
+        """
+        with self.condition:
+            queued = not self.enter_queue()
+        if queued:
+            started = time.perf_counter()
+            try:
+                while True:
+                    with self.condition:
+                        waited = time.perf_counter() - started
+                        if self.running < self.limit or waited >= self.timeout:
+                            queued = False
+                            self.leave_queue(self.running < self.limit, waited)
+                            break
+                    await asyncio.sleep(0.01)
+            finally:
+                if queued:
+                    # cancelled while waiting
+                    with self.condition:
+                        self.waiting -= 1
+        try:
+            yield
+        finally:
+            self.release()
+
+    def snapshot(self) -> dict:
+        with self.condition:
+            return {
+                "limit": self.limit,
+                "running": self.running,
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+                "admitted": self.admitted,
+                "rejected_full": self.rejected_full,
+                "rejected_timeout": self.rejected_timeout,
+                "wait_time": round(self.wait_time, 3),
+            }
+
+
+limiters = {}
+limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str) -> ConcurrencyLimiter:
+    """the limiter called name, configured by ADMISSION_LIMITS[name] and created on first use
+    """
+    with limiters_lock:
+        if name not in limiters:
+            limiters[name] = ConcurrencyLimiter(**settings.ADMISSION_LIMITS[name])
+        return limiters[name]
+
+
+def password_hashing():
+    """slot of the password_hashing limiter, taken around authenticate/check_password/set_password
+    """
+    return get_limiter('password_hashing').slot()
+
+
+def apassword_hashing():
+    return get_limiter('password_hashing').aslot()
+
+
+class ThrottleStats:
+    """rejections of each throttle scope in this process, listed at /metrics/
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rejected = {}
+
+    def reject(self, scope: str) -> None:
+        with self.lock:
+            self.rejected[scope] = self.rejected.get(scope, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.rejected)
+
+
+throttle_stats = ThrottleStats()
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """token bucket shared by the workers through the cache: THROTTLE_BUCKETS[scope] = (burst, seconds)
+       allows bursts of `burst` requests per key, refilled at `burst` tokens per `seconds`
+       it is kept as the time the bucket is full again (GCRA), a single cache value per key,
+       concurrent requests of the same key may both pass the last token, which only lets a burst slightly overshoot
+    """
+    scope = None
+    cache_key = "throttle:{scope}:{ident}"
+
+    def get_ident_for(self, request) -> str:
+        """the key the bucket is kept for, None to not throttle the request
+        """
+        raise NotImplementedError
+
+    def allow_request(self, request, view) -> bool:
+        ident = self.get_ident_for(request)
+        if ident is None:
+            return True
+        burst, seconds = settings.THROTTLE_BUCKETS[self.scope]
+        interval = seconds / burst
+        key = self.cache_key.format(scope=self.scope, ident=ident)
+        now = time.time()
+        full_at = max(cache.get(key) or now, now)
+        # the request takes one token, which is refilled after interval
+        if full_at + interval - now > seconds:
+            self.retry_after = full_at + interval - now - seconds
+            throttle_stats.reject(self.scope)
+            return False
+        cache.set(key, full_at + interval, seconds)
+        return True
+
+    def wait(self) -> float:
+        return self.retry_after
+
+
+class IPThrottle(TokenBucketThrottle):
+    """per client address: REMOTE_ADDR, or the X-Forwarded-For address added by the last of the
+       REST_FRAMEWORK['NUM_PROXIES'] proxies in front of the server, an address the client sends is never trusted
+    """
+    scope = 'ip'
+
+    def get_ident_for(self, request) -> str:
+        return self.get_ident(request)
+
+
+class CredentialThrottle(TokenBucketThrottle):
+    """per account: the username (login), the email (forgot password) or the authenticated user,
+       so guessing the password of one account is slow even from many addresses
+    """
+    scope = 'credential'
+
+    def get_ident_for(self, request) -> str:
+        if not isinstance(request, Request):
+            # throttled async views are not authenticated (see async_api_view)
+            data = request_data(request)
+        elif request.user.is_authenticated:
+            return f"user:{request.user.pk}"
+        else:
+            data = request.data
+        if not isinstance(data, dict):
+            # a json list or scalar, the serializer of the view rejects it
+            return None
+        for field in ('username', 'email'):
+            value = data.get(field)
+            if isinstance(value, str) and value:
+                return f"{field}:{value.strip().lower()[:150]}"
+        return None
+
+
+AUTH_THROTTLES = [IPThrottle, CredentialThrottle]
@@ -0,0 +1,71 @@
+import json
+import math
+from functools import wraps
+from django.http import Http404, HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated, Throttled
+from rest_framework.renderers import JSONRenderer
+from authentication.authentication import ClaimsUserAuthentication
+
+
+def api_response(data, status_code: int = status.HTTP_200_OK, headers: dict = None,
+                 renderer_class=JSONRenderer) -> HttpResponse:
+    """renders data to json the same way DRF's JSONRenderer does for the sync views
+    """
+    content = renderer_class().render(data) if data is not None else b""
+    return HttpResponse(content, status=status_code, content_type="application/json", headers=headers)
+
+
+def request_data(request) -> dict:
+    """the parsed body of a json or form request
+    """
+    if request.content_type == "application/json":
+        try:
+            return json.loads(request.body or b"{}")
+        except ValueError:
+            raise APIException(detail="JSON parse error", code="parse_error")
+    return request.POST
+
+
+def async_api_view(methods: list, authenticated: bool = True, throttles: list = ()):
+    """turns an async function into an API endpoint that behaves like the DRF views:
+       checks the method, authenticates the JWT (see ClaimsUserAuthentication) into request.user,
+       applies the throttles and turns DRF exceptions and Http404 into the same json errors DRF returns
+
+    Args:
+        methods (list): allowed http methods
+        authenticated (bool): if True, requests without a valid access token get 401
+        throttles (list): DRF throttle classes, a request refused by one gets 429 with Retry-After
+    """
+    def decorator(view):
+        @csrf_exempt
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return api_response({"detail": f'Method "{request.method}" not allowed.'},
+                                    status.HTTP_405_METHOD_NOT_ALLOWED)
+            try:
+                if authenticated:
+                    authentication = ClaimsUserAuthentication()
+                    result = await authentication.aauthenticate(request)
+                    if result is None:
+                        raise NotAuthenticated()
+                    request.user = result[0]
+                for throttle_class in throttles:
+                    throttle = throttle_class()
+                    if not throttle.allow_request(request, None):
+                        raise Throttled(wait=throttle.wait())
+                return await view(request, *args, **kwargs)
+            except APIException as e:
+                data = e.detail if isinstance(e.detail, (list, dict)) else {"detail": e.detail}
+                headers = None
+                if e.status_code == status.HTTP_401_UNAUTHORIZED:
+                    headers = {"WWW-Authenticate": 'Bearer realm="api"'}
+                elif getattr(e, 'wait', None):
+                    headers = {"Retry-After": str(math.ceil(e.wait))}
+                return api_response(data, e.status_code, headers)
+            except Http404 as e:
+                return api_response({"detail": str(e) or "Not found."}, status.HTTP_404_NOT_FOUND)
+        return wrapper
+    return decorator
@@ -0,0 +1,66 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+
+PIN_CACHE_KEY = "db_pin:user:{user_id}"
+
+reading_from_replica = ContextVar('reading_from_replica', default=False)
+
+
+def replica_aliases() -> list:
+    return [alias for alias in settings.DATABASES if alias != 'default']
+
+
+class ReplicaRouter:
+    """sends reads to a random replica while inside read_from_replica(), everything else to the primary (default)
+       read_from_replica() is only used by read-only views, so reads that are followed by a write
+       (e.g. in Like.apply_changes) always see the primary
+    """
+
+    def db_for_read(self, model, **hints):
+        if reading_from_replica.get():
+            replicas = replica_aliases()
+            if replicas:
+                return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+def pin_to_primary(user_id: int) -> None:
+    """makes the reads of the user go to the primary for REPLICA_PIN_SECONDS,
+       so the user sees their own writes even if the replicas lag behind
+    """
+    if replica_aliases():
+        cache.set(PIN_CACHE_KEY.format(user_id=user_id), True, settings.REPLICA_PIN_SECONDS)
+
+
+def should_read_from_replica(user_id: int) -> bool:
+    """True if replicas are configured and the user is not pinned to the primary
+    """
+    return bool(replica_aliases()) and not cache.get(PIN_CACHE_KEY.format(user_id=user_id))
+
+
+async def ashould_read_from_replica(user_id: int) -> bool:
+    return bool(replica_aliases()) and not await cache.aget(PIN_CACHE_KEY.format(user_id=user_id))
+
+
+@contextmanager
+def read_from_replica(enabled: bool = True):
+    """routes the reads of the block to the replicas (if enabled and any are configured)
+    """
+    token = reading_from_replica.set(enabled)
+    try:
+        yield
+    finally:
+        reading_from_replica.reset(token)
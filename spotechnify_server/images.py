@@ -0,0 +1,118 @@
+import os
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+from rest_framework import serializers
+
+# format name -> (Pillow format, file extension)
+VARIANT_FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+
+
+def current_variants(image, variants):
+    """the variants if they were built from the current file of image, None if they have to be (re)built
+
+    Args:
+        image (FieldFile): the original image
+        variants (dict): the stored variants, {"source": name of the original, "sizes": {size: {image_format: name}}}
+    """
+    if not image or not image._committed or variants is None or variants.get('source') != image.name:
+        return None
+    return variants
+
+
+def variant_name(name: str, size: int, image_format: str) -> str:
+    """song_images/cover.png -> song_images/cover_64.webp, next to the original
+    """
+    base, _ = os.path.splitext(name)
+    return f"{base}_{size}.{VARIANT_FORMATS[image_format][1]}"
+
+
+def encode(image: Image.Image, image_format: str) -> bytes:
+    pillow_format, _ = VARIANT_FORMATS[image_format]
+    if image_format == 'jpeg':
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    output = BytesIO()
+    image.save(output, format=pillow_format, quality=settings.IMAGE_VARIANT_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+def build_variants(name: str) -> dict:
+    """resizes the image stored as name to every IMAGE_VARIANT_SIZES (fitting in a size x size box,
+       never enlarged) in every IMAGE_VARIANT_FORMATS, and saves them next to it in the default storage
+
+    Returns:
+        dict: {"source": name, "sizes": {size: {image_format: name of the variant}}}
+    """
+    with default_storage.open(name, 'rb') as file:
+        original = Image.open(file)
+        original.load()
+    original = ImageOps.exif_transpose(original)
+
+    sizes = {}
+    for size in settings.IMAGE_VARIANT_SIZES:
+        resized = original.copy()
+        resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+        sizes[str(size)] = {}
+        for image_format in settings.IMAGE_VARIANT_FORMATS:
+            target = variant_name(name, size, image_format)
+            if default_storage.exists(target):
+                default_storage.delete(target)
+            content = ContentFile(encode(resized, image_format))
+            sizes[str(size)][image_format] = default_storage.save(target, content)
+    return {"source": name, "sizes": sizes}
+
+
+def build_variants_safe(name: str) -> tuple:
+    """build_variants for a worker process, which returns the error instead of raising it
+
+    Returns:
+        tuple: (variants, None) or (variants without sizes, error message)
+    """
+    try:
+        return build_variants(name), None
+    except Exception as e:
+        return {"source": name, "sizes": {}}, f"{type(e).__name__}: {e}"
+
+
+def variant_urls(variants: dict, request=None) -> dict:
+    """{size: {image_format: url}} of the variants, absolute urls if request is given
+    """
+    urls = {}
+    for size, formats in variants['sizes'].items():
+        urls[size] = {}
+        for image_format, name in formats.items():
+            url = default_storage.url(name)
+            urls[size][image_format] = request.build_absolute_uri(url) if request is not None else url
+    return urls
+
+
+class ImageVariantsField(serializers.Field):
+    """urls of the resized variants of an image field, {size: {image_format: url}},
+       empty until the variants of the current image are built (see the build_image_variants command)
+    """
+
+    def __init__(self, image_field: str, variants_field: str, **kwargs):
+        kwargs['read_only'] = True
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+        self.image_field = image_field
+        self.variants_field = variants_field
+
+    def to_representation(self, instance):
+        variants = current_variants(getattr(instance, self.image_field), getattr(instance, self.variants_field))
+        if variants is None:
+            return {}
+        return variant_urls(variants, self.context.get('request'))
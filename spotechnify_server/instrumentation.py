@@ -0,0 +1,313 @@
+import bisect
+import heapq
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (ms) of the histogram buckets, the last bucket has no upper bound
+HISTOGRAM_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+current_timings = ContextVar('current_timings', default=None)
+
+
+class RequestTimings:
+    """what one request spent its time on
+       sql, storage and serialize are exclusive, e.g. queries run while serializing count as sql only
+    """
+    def __init__(self, slow_statements: int):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql = 0.0
+        self.storage = 0.0
+        self.serialize = 0.0
+        self.slow_statements = slow_statements
+        self.statements = []  # min-heap of the slowest (duration, sql)
+
+    def add_query(self, sql: str, duration: float) -> None:
+        self.queries += 1
+        self.sql += duration
+        if len(self.statements) < self.slow_statements:
+            heapq.heappush(self.statements, (duration, sql))
+        elif self.statements and duration > self.statements[0][0]:
+            heapq.heapreplace(self.statements, (duration, sql))
+
+    def server_timing(self, total: float) -> str:
+        """value of the Server-Timing header, durations in milliseconds
+        """
+        app = max(total - self.sql - self.storage - self.serialize, 0.0)
+        return ", ".join((
+            f'sql;dur={self.sql * 1000:.1f};desc="{self.queries} queries"',
+            f"serialize;dur={self.serialize * 1000:.1f}",
+            f"storage;dur={self.storage * 1000:.1f}",
+            f"app;dur={app * 1000:.1f}",
+            f"total;dur={total * 1000:.1f}",
+        ))
+
+
+def sql_timer(execute, sql, params, many, context):
+    """database execute wrapper that adds the query to the timings of the current request, if any
+    """
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add_query(sql, time.perf_counter() - started)
+
+
+def install_sql_timer(connection, **kwargs) -> None:
+    if sql_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_timer)
+
+
+connection_created.connect(install_sql_timer)
+
+
+@contextmanager
+def timed(metric: str):
+    """adds the time spent in the block to metric ('storage' or 'serialize') of the current request,
+       without the sql and storage time already counted inside the block
+    """
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    nested = timings.sql + timings.storage + timings.serialize
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        nested = timings.sql + timings.storage + timings.serialize - nested
+        setattr(timings, metric, getattr(timings, metric) + max(elapsed - nested, 0.0))
+
+
+class TimedListSerializer(serializers.ListSerializer):
+    @property
+    def data(self):
+        with timed('serialize'):
+            return super().data
+
+
+class TimedSerializerMixin:
+    """counts the time spent in .data as serialize time,
+       for many=True set Meta.list_serializer_class = TimedListSerializer
+    """
+    @property
+    def data(self):
+        with timed('serialize'):
+            return super().data
+
+
+class TimedStorageMixin:
+    """counts the time spent in the calls to the storage backend (url signing, metadata, reads and writes)
+       as storage time
+    """
+    def url(self, *args, **kwargs):
+        with timed('storage'):
+            return super().url(*args, **kwargs)
+
+    def exists(self, name):
+        with timed('storage'):
+            return super().exists(name)
+
+    def size(self, name):
+        with timed('storage'):
+            return super().size(name)
+
+    def get_modified_time(self, name):
+        with timed('storage'):
+            return super().get_modified_time(name)
+
+    def _open(self, name, mode='rb'):
+        with timed('storage'):
+            return super()._open(name, mode)
+
+    def _save(self, name, content):
+        with timed('storage'):
+            return super()._save(name, content)
+
+    def delete(self, name):
+        with timed('storage'):
+            return super().delete(name)
+
+
+class RouteHistograms:
+    """per-route latency histograms of this process
+       every worker process keeps its own, they are cheap enough to update on every request
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def add(self, route: str, timings: RequestTimings, total: float, status_code: int) -> None:
+        bucket = bisect.bisect_left(HISTOGRAM_BOUNDS, total * 1000)
+        sql_bucket = bisect.bisect_left(HISTOGRAM_BOUNDS, timings.sql * 1000)
+        with self.lock:
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = {
+                    "count": 0,
+                    "errors": 0,
+                    "total_ms": 0.0,
+                    "sql_ms": 0.0,
+                    "serialize_ms": 0.0,
+                    "storage_ms": 0.0,
+                    "queries": 0,
+                    "max_queries": 0,
+                    "latency_buckets": [0] * (len(HISTOGRAM_BOUNDS) + 1),
+                    "sql_buckets": [0] * (len(HISTOGRAM_BOUNDS) + 1),
+                }
+            stats["count"] += 1
+            stats["errors"] += status_code >= 500
+            stats["total_ms"] += total * 1000
+            stats["sql_ms"] += timings.sql * 1000
+            stats["serialize_ms"] += timings.serialize * 1000
+            stats["storage_ms"] += timings.storage * 1000
+            stats["queries"] += timings.queries
+            stats["max_queries"] = max(stats["max_queries"], timings.queries)
+            stats["latency_buckets"][bucket] += 1
+            stats["sql_buckets"][sql_bucket] += 1
+
+    def snapshot(self) -> dict:
+        """copy of the histograms with the approximate p50/p95/p99 of every route
+
+        Returns:
+            dict: route -> stats, plus the bucket bounds
+        """
+        with self.lock:
+            routes = {route: {**stats,
+                              "latency_buckets": list(stats["latency_buckets"]),
+                              "sql_buckets": list(stats["sql_buckets"])}
+                      for route, stats in self.routes.items()}
+        for stats in routes.values():
+            for percent in (50, 95, 99):
+                stats[f"p{percent}_ms"] = self.percentile(stats["latency_buckets"], stats["count"], percent)
+        return {"bucket_bounds_ms": list(HISTOGRAM_BOUNDS), "routes": routes}
+
+    @staticmethod
+    def percentile(buckets: list, count: int, percent: float):
+        """upper bound of the bucket the percentile falls in (None for the unbounded last bucket)
+        """
+        rank = percent / 100 * count
+        seen = 0
+        for bound, bucket_count in zip(HISTOGRAM_BOUNDS + (None,), buckets):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return None
+
+    def reset(self) -> None:
+        with self.lock:
+            self.routes.clear()
+
+
+histograms = RouteHistograms()
+
+
+class CacheStats:
+    """hit/miss counters of an application cache in this process, listed at /metrics/
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def hit(self) -> None:
+        with self.lock:
+            self.hits += 1
+
+    def miss(self, stale: bool = False) -> None:
+        """stale: the entry was there but out of date
+        """
+        with self.lock:
+            self.misses += 1
+            self.stale += stale
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_rate": self.hits / lookups if lookups else None,
+            }
+
+
+cache_stats = {}
+
+
+def get_cache_stats(name: str) -> CacheStats:
+    """the counters of the cache called name, created on first use
+    """
+    return cache_stats.setdefault(name, CacheStats())
+
+
+class RequestTimingMiddleware:
+    """measures query count, sql, serializer and storage time of every request,
+       returns them in a Server-Timing header, logs requests slower than REQUEST_TIMING_SLOW_MS
+       with their slowest statements, and adds them to the per-route histograms
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_ms = getattr(settings, 'REQUEST_TIMING_SLOW_MS', 500)
+        self.slow_statements = getattr(settings, 'REQUEST_TIMING_SLOW_STATEMENTS', 3)
+        # connections opened before this module was imported
+        for connection in connections.all(initialized_only=True):
+            install_sql_timer(connection)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings(self.slow_statements)
+        token = current_timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings(self.slow_statements)
+        token = current_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings: RequestTimings):
+        total = time.perf_counter() - timings.started
+        response['Server-Timing'] = timings.server_timing(total)
+
+        match = request.resolver_match
+        route = f"{request.method} /{match.route}" if match is not None else f"{request.method} <unresolved>"
+        histograms.add(route, timings, total, response.status_code)
+
+        if total * 1000 >= self.slow_ms:
+            statements = "".join(
+                f"\n  {duration * 1000:.1f}ms {sql}"
+                for duration, sql in sorted(timings.statements, reverse=True)
+            )
+            logger.warning("Slow request %s %s: %.1fms, %s%s",
+                           request.method, request.get_full_path(), total * 1000,
+                           response['Server-Timing'], statements)
+        return response
@@ -0,0 +1,24 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer encoding with orjson, the output is the same byte for byte (compact, non-ASCII characters kept,
+       U+2028/U+2029 escaped, datetimes and other types encoded by DRF's JSONEncoder)
+       falls back to JSONRenderer for indented output and for data orjson can not encode (e.g. non-str keys),
+       NaN and infinity are encoded as null instead of NaN, so it is only used for data without floats (song lists)
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
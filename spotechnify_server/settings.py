@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 import os
 from pathlib import Path
 from datetime import timedelta
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv()  # take environment variables
@@ -44,7 +45,8 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    
+    'django.contrib.postgres',
+
     'rest_framework_simplejwt',
     'rest_framework',
     'storages',
@@ -57,8 +59,17 @@ INSTALLED_APPS = [
 # Add REST framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+        # builds request.user from the token claims (authentication.authentication.ClaimsUser),
+        # is_active is checked on the cached user, so there is no query while the user is cached
+        # use 'rest_framework_simplejwt.authentication.JWTAuthentication' to load the user on every request
+        'authentication.authentication.ClaimsUserAuthentication',
+    ),
+    # list endpoints are paginated only when the client sends "cursor" or "page_size"
+    'DEFAULT_PAGINATION_CLASS': 'music.pagination.SongKeysetPagination',
+    'PAGE_SIZE': 50,
+    # number of proxies in front of the server that append the client address to X-Forwarded-For,
+    # with 0 the throttles key on REMOTE_ADDR and ignore the header, which any client can set
+    'NUM_PROXIES': int(os.getenv("NUM_PROXIES", 0)),
 }
 
 # JWT Settings
@@ -89,7 +100,7 @@ SIMPLE_JWT = {
 
     "AUTH_TOKEN_CLASSES": ("rest_framework_simplejwt.tokens.AccessToken",),
     "TOKEN_TYPE_CLAIM": "token_type",
-    "TOKEN_USER_CLASS": "rest_framework_simplejwt.models.TokenUser",
+    "TOKEN_USER_CLASS": "authentication.authentication.ClaimsUser",
 
     "JTI_CLAIM": "jti",
 
@@ -108,6 +119,7 @@ SIMPLE_JWT = {
 }
 
 AUTH_USER_MODEL = 'authentication.CustomUser'
+USER_CACHE_TIMEOUT = 60  # seconds a user loaded for a token is cached (see CustomUser.get_cached)
 
 
 # email sending backend
@@ -120,6 +132,7 @@ EMAIL_USE_TLS = True  # config
 EMAIL_USE_SSL = False  # config
 
 MIDDLEWARE = [
+    'spotechnify_server.instrumentation.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -129,6 +142,10 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# requests slower than this many milliseconds are logged with their slowest statements
+REQUEST_TIMING_SLOW_MS = int(os.getenv('REQUEST_TIMING_SLOW_MS', 500))
+REQUEST_TIMING_SLOW_STATEMENTS = 3
+
 ROOT_URLCONF = 'spotechnify_server.urls'
 
 TEMPLATES = [
@@ -149,6 +166,29 @@ TEMPLATES = [
 WSGI_APPLICATION = 'spotechnify_server.wsgi.application'
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# with several worker processes a shared cache (redis) is needed, so invalidations reach every worker
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+if os.getenv("REDIS_URL"):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',  # needs the redis package
+        'LOCATION': os.getenv("REDIS_URL"),
+    }
+
+# how the "liked" flag of listed songs is computed:
+# "annotate": an Exists subquery evaluated for every song
+# "request": the liked song ids of the user are loaded once per request
+# "cache": like "request", but the ids are cached until the user likes/unlikes a song
+LIKED_SONGS_MODE = os.getenv("LIKED_SONGS_MODE", "annotate")
+LIKED_SONG_IDS_CACHE_TIMEOUT = 60 * 60
+
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
@@ -163,10 +203,36 @@ DATABASES = {
         'USER': os.getenv("DB_USER"),
         'PASSWORD': os.getenv("DB_PASSWORD"),
         'HOST': os.getenv("DB_HOST"),
-        'PORT': os.getenv("DB_PORT")  # Usually 5432
+        'PORT': os.getenv("DB_PORT"),  # Usually 5432
+        'OPTIONS': {
+            # psycopg 3 connection pool (per worker process), instead of a new connection per request
+            'pool': {
+                'min_size': int(os.getenv("DB_POOL_MIN_SIZE", 2)),
+                'max_size': int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+                'timeout': int(os.getenv("DB_POOL_TIMEOUT", 10)),
+            },
+        },
     }
 }
 
+# read replicas, comma separated hosts with the same credentials as the primary
+# the read-only music GET endpoints read from them (see spotechnify_server.db_router)
+for index, replica_host in enumerate(filter(None, os.getenv("DB_REPLICA_HOSTS", "").split(","))):
+    DATABASES[f'replica_{index}'] = {
+        **DATABASES['default'],
+        'HOST': replica_host.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['spotechnify_server.db_router.ReplicaRouter']
+
+# seconds after a like/unlike during which the user's reads go to the primary
+REPLICA_PIN_SECONDS = 10
+
+# the pins are kept in the cache, a per process cache would only pin the user on the worker that took the like
+if len(DATABASES) > 1 and CACHES['default']['BACKEND'] == 'django.core.cache.backends.locmem.LocMemCache':
+    raise ImproperlyConfigured("DB_REPLICA_HOSTS needs a cache shared by the workers, set REDIS_URL")
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -215,6 +281,64 @@ AWS_SECRET_ACCESS_KEY = os.getenv('LIARA_SECRET_KEY')
 AWS_STORAGE_BUCKET_NAME = os.getenv('BUCKET_NAME')
 AWS_S3_ENDPOINT_URL = os.getenv('LIARA_ENDPOINT_URL')
 AWS_S3_REGION_NAME = 'us-east-1'
+AWS_QUERYSTRING_EXPIRE = 60 * 60  # presigned urls are valid for an hour
+# presigned urls are cached and reused until this many seconds before they expire
+AWS_URL_CACHE_MARGIN = 5 * 60
+AWS_URL_CACHE_MAX_ENTRIES = 100_000
+
+# recommendations: the ranked song ids of each user are cached (see Song.get_recommended_ids_for_user)
+RECOMMENDATION_CACHE_SIZE = 500  # ids kept per user
+RECOMMENDATION_CACHE_TIMEOUT = 24 * 60 * 60
+# a genre fallback list is recomputed once the like count of one of its genres moved by this fraction
+RECOMMENDATION_GENRE_DRIFT = 0.1
+GENRE_COUNTS_CACHE_TIMEOUT = 60  # seconds the like counts of the genres are cached (see GenrePopularity.get_counts)
+
+# admission control of the password hashing endpoints (login, sign up, change/forgot password)
+# at most "limit" hashes run at once per worker process, so threads stay free for the other endpoints,
+# "queue_size" more requests wait up to "timeout" seconds, the rest get 429 with Retry-After: "retry_after"
+ADMISSION_LIMITS = {
+    'password_hashing': {
+        'limit': int(os.environ.get('PASSWORD_HASHING_CONCURRENCY', 2)),
+        'queue_size': int(os.environ.get('PASSWORD_HASHING_QUEUE_SIZE', 8)),
+        'timeout': 2.0,
+        'retry_after': 1,
+    },
+}
+# token buckets of the same endpoints, scope -> (burst, seconds to refill it)
+THROTTLE_BUCKETS = {
+    'ip': (30, 60),
+    'credential': (10, 300),
+}
+
+# song lists are serialized from values() rows and encoded with orjson (see music.views.FastSongListMixin)
+SONG_LIST_FAST_PATH = True
+
+# catalog delta sync (/music/sync/) and snapshots (build_catalog_snapshot command, /music/snapshot/)
+CATALOG_SYNC_MAX_CHANGES = 5000  # clients further behind than this are sent to the snapshot
+CATALOG_SNAPSHOT_DIR = "catalog"
+CATALOG_SNAPSHOT_KEEP = 3  # older snapshots are deleted
+# public url of the server, e.g. https://api.example.com, the urls in the snapshots and the sync are made
+# absolute on it (the snapshots are built without a request), without it the sync uses the host of the request
+CATALOG_BASE_URL = os.getenv("CATALOG_BASE_URL")
+
+# trending songs: likes are counted in hourly buckets, rolled into daily ones by the compact_like_buckets command
+TRENDING_WINDOW_HOURS = 7 * 24  # likes older than this do not count
+TRENDING_HOURLY_HOURS = 48  # hourly buckets older than this are rolled into daily ones
+TRENDING_HALF_LIFE_HOURS = 24  # a like counts half as much after this many hours
+TRENDING_SIZE = 500  # ids kept in the cached ranking
+TRENDING_CACHE_TIMEOUT = 60
+
+# resized copies of song and profile images, built by the build_image_variants command
+IMAGE_VARIANT_SIZES = (64, 256, 640)  # pixels, images are fitted in a size x size box
+IMAGE_VARIANT_FORMATS = ("webp", "jpeg")
+IMAGE_VARIANT_QUALITY = 80
+
+# audio files are uploaded by the clients straight to the bucket in parts (see music.models.SongUpload)
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
+UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024
+
+# audio streamed from non-S3 storages is read and sent in chunks of this many bytes
+STREAM_CHUNK_SIZE = 64 * 1024
 
 print(AWS_ACCESS_KEY_ID)
 print(AWS_SECRET_ACCESS_KEY)
@@ -225,7 +349,7 @@ print(AWS_S3_ENDPOINT_URL)
 # Django-storages configuration
 STORAGES = {
   "default": {
-      "BACKEND": "storages.backends.s3.S3Storage",
+      "BACKEND": "spotechnify_server.storage.CachedUrlS3Storage",
   },
   "staticfiles": {
       "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from storages.backends.s3 import S3Storage
+from storages.utils import clean_name
+from .instrumentation import TimedStorageMixin
+
+
+class CachedUrlS3Storage(TimedStorageMixin, S3Storage):
+    """S3Storage that reuses presigned urls instead of signing a new one on every url() call
+       a url is cached by (name, parameters, expire, http_method) and is reused until
+       AWS_URL_CACHE_MARGIN seconds before it expires, so clients never get a url that is about to expire
+       and not past the end of the signing period it was signed in (see url_period), so a list whose ETag
+       includes the period holds no url older than a period while the ETag still matches
+       entries are kept in signing order, which is also expiry order for a fixed expire,
+       so expired and excess entries are always evicted from the front
+       only the actual signing (a cache miss) is counted as storage time of the request
+    """
+
+    def __init__(self, **settings_overrides):
+        super().__init__(**settings_overrides)
+        self.url_cache_margin = getattr(settings, 'AWS_URL_CACHE_MARGIN', 300)
+        self.url_cache_max_entries = getattr(settings, 'AWS_URL_CACHE_MAX_ENTRIES', 100_000)
+        self._url_cache = OrderedDict()  # key -> (url, monotonic time after which it is not reused)
+        self._url_cache_lock = threading.Lock()
+        self.url_cache_hits = 0
+        self.url_cache_misses = 0
+        self.url_cache_evictions = 0
+
+    def url(self, name, parameters=None, expire=None, http_method=None):
+        if expire is None:
+            expire = self.querystring_expire
+        if not self.querystring_auth or self.custom_domain or expire <= self.url_cache_margin:
+            return super().url(name, parameters, expire, http_method)
+
+        key = (name, tuple(sorted(parameters.items())) if parameters else None, expire, http_method)
+        now = time.monotonic()
+        with self._url_cache_lock:
+            cached = self._url_cache.get(key)
+            if cached is not None and cached[1] > now:
+                self.url_cache_hits += 1
+                return cached[0]
+            self.url_cache_misses += 1
+
+        url = super().url(name, parameters, expire, http_method)
+
+        period = self.querystring_expire - self.url_cache_margin
+        period_left = period - time.time() % period if period > 0 else expire
+        with self._url_cache_lock:
+            self._url_cache.pop(key, None)
+            self._url_cache[key] = (url, now + min(expire - self.url_cache_margin, period_left))
+            self._evict(now)
+        return url
+
+    def url_period(self):
+        """number of the current url signing period, periods last AWS_QUERYSTRING_EXPIRE - AWS_URL_CACHE_MARGIN
+           seconds of wall time (the same in every worker), every url handed out in a period is still valid
+           for AWS_URL_CACHE_MARGIN seconds at its end
+
+        Returns:
+            int: the period, or None if the urls are not signed
+        """
+        period = self.querystring_expire - self.url_cache_margin
+        if not self.querystring_auth or self.custom_domain or period <= 0:
+            return None
+        return int(time.time() // period)
+
+    def _evict(self, now: float) -> None:
+        """drops entries from the front while they are expired or the cache is over its size limit
+           must be called with the lock held
+        """
+        while self._url_cache:
+            _, valid_until = next(iter(self._url_cache.values()))
+            if valid_until > now and len(self._url_cache) <= self.url_cache_max_entries:
+                break
+            self._url_cache.popitem(last=False)
+            self.url_cache_evictions += 1
+
+    def url_cache_stats(self) -> dict:
+        """hit/miss counters of the presigned url cache
+
+        Returns:
+            dict: hits, misses, evictions, size and hit_rate
+        """
+        with self._url_cache_lock:
+            lookups = self.url_cache_hits + self.url_cache_misses
+            return {
+                "hits": self.url_cache_hits,
+                "misses": self.url_cache_misses,
+                "evictions": self.url_cache_evictions,
+                "size": len(self._url_cache),
+                "hit_rate": self.url_cache_hits / lookups if lookups else None,
+            }
+
+    # multipart uploads that clients send straight to the bucket (see music.models.SongUpload)
+
+    def _key(self, name: str) -> str:
+        return self._normalize_name(clean_name(name))
+
+    def create_multipart_upload(self, name: str, content_type: str) -> str:
+        """starts a multipart upload of the object name
+
+        Returns:
+            str: the upload id
+        """
+        params = self.get_object_parameters(name)
+        params['ContentType'] = content_type
+        response = self.connection.meta.client.create_multipart_upload(
+            Bucket=self.bucket_name, Key=self._key(name), **params
+        )
+        return response['UploadId']
+
+    def multipart_part_url(self, name: str, upload_id: str, part_number: int, expire: int = None) -> str:
+        """presigned url the client PUTs one part of the upload to
+        """
+        return self.connection.meta.client.generate_presigned_url(
+            'upload_part',
+            Params={'Bucket': self.bucket_name, 'Key': self._key(name),
+                    'UploadId': upload_id, 'PartNumber': part_number},
+            ExpiresIn=expire or self.querystring_expire,
+            HttpMethod='PUT',
+        )
+
+    def list_multipart_parts(self, name: str, upload_id: str) -> list:
+        """the parts the bucket has received so far
+
+        Returns:
+            list: dicts with PartNumber, ETag and Size, ordered by part number
+        """
+        paginator = self.connection.meta.client.get_paginator('list_parts')
+        parts = []
+        for page in paginator.paginate(Bucket=self.bucket_name, Key=self._key(name), UploadId=upload_id):
+            parts.extend(
+                {'PartNumber': part['PartNumber'], 'ETag': part['ETag'], 'Size': part['Size']}
+                for part in page.get('Parts', [])
+            )
+        return parts
+
+    def complete_multipart_upload(self, name: str, upload_id: str, parts: list) -> None:
+        self.connection.meta.client.complete_multipart_upload(
+            Bucket=self.bucket_name, Key=self._key(name), UploadId=upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': part['PartNumber'], 'ETag': part['ETag']} for part in parts]},
+        )
+
+    def abort_multipart_upload(self, name: str, upload_id: str) -> None:
+        self.connection.meta.client.abort_multipart_upload(
+            Bucket=self.bucket_name, Key=self._key(name), UploadId=upload_id
+        )
@@ -0,0 +1,210 @@
+import re
+from unittest import mock
+import boto3
+import requests
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from moto import mock_aws
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from authentication.models import CustomUser
+from spotechnify_server.instrumentation import RequestTimings, current_timings, histograms, timed
+from spotechnify_server.storage import CachedUrlS3Storage
+
+BUCKET = "songs-bucket"
+
+
+@mock_aws
+@override_settings(AWS_QUERYSTRING_EXPIRE=3600, AWS_URL_CACHE_MARGIN=300, AWS_URL_CACHE_MAX_ENTRIES=100)
+class CachedUrlS3StorageTest(SimpleTestCase):
+    """presigned url cache of the default storage, against a moto bucket
+    """
+
+    def setUp(self):
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=BUCKET)
+        self.storage = self.create_storage()
+        self.now = 1000.0
+        # the wall clock is at the start of a signing period (3600 - 300 seconds) when the test starts
+        clock = mock.patch("spotechnify_server.storage.time")
+        clock.start().configure_mock(**{"monotonic.side_effect": lambda: self.now,
+                                        "time.side_effect": lambda: self.now + 3300 * 500 - 1000})
+        self.addCleanup(clock.stop)
+
+    @staticmethod
+    def create_storage() -> CachedUrlS3Storage:
+        return CachedUrlS3Storage(access_key="testing", secret_key="testing", bucket_name=BUCKET,
+                                  region_name="us-east-1", endpoint_url=None)
+
+    def test_hit(self):
+        url = self.storage.url("songs/1.mp3")
+        self.assertEqual(self.storage.url("songs/1.mp3"), url)
+        self.assertEqual(self.storage.url_cache_stats(),
+                         {"hits": 1, "misses": 1, "evictions": 0, "size": 1, "hit_rate": 0.5})
+
+    def test_cached_url_serves_the_object(self):
+        name = self.storage.save("songs/1.mp3", ContentFile(b"audio bytes"))
+        self.storage.url(name)
+        response = requests.get(self.storage.url(name))
+        self.assertEqual(self.storage.url_cache_stats()["hits"], 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"audio bytes")
+
+    def test_miss(self):
+        # every name, parameters, expire and method is signed on its own
+        self.storage.url("songs/1.mp3")
+        self.storage.url("songs/2.mp3")
+        self.storage.url("songs/1.mp3", parameters={"ResponseContentType": "audio/mpeg"})
+        self.storage.url("songs/1.mp3", expire=1800)
+        self.storage.url("songs/1.mp3", http_method="HEAD")
+        stats = self.storage.url_cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (0, 5, 5))
+
+    def test_expiry(self):
+        self.storage.url("songs/1.mp3")
+        # reused until AWS_URL_CACHE_MARGIN seconds before the url expires
+        self.now += 3600 - 300 - 1
+        self.storage.url("songs/1.mp3")
+        self.now += 1
+        self.storage.url("songs/1.mp3")
+        stats = self.storage.url_cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 2, 1))
+
+    def test_not_reused_past_the_signing_period(self):
+        self.now += 3000
+        self.storage.url("songs/1.mp3")
+        self.assertEqual(self.storage.url_period(), 500)
+        self.now += 299
+        self.storage.url("songs/1.mp3")
+        self.now += 1
+        self.assertEqual(self.storage.url_period(), 501)
+        self.storage.url("songs/1.mp3")
+        stats = self.storage.url_cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+
+    @override_settings(AWS_QUERYSTRING_AUTH=False)
+    def test_unsigned_urls_have_no_period(self):
+        self.assertIsNone(self.create_storage().url_period())
+
+    def test_expired_entries_are_evicted(self):
+        self.storage.url("songs/1.mp3")
+        self.storage.url("songs/2.mp3")
+        self.now += 3600 - 300
+        self.storage.url("songs/3.mp3")
+        stats = self.storage.url_cache_stats()
+        self.assertEqual((stats["evictions"], stats["size"]), (2, 1))
+
+    @override_settings(AWS_URL_CACHE_MAX_ENTRIES=2)
+    def test_oldest_entries_are_evicted_over_the_size_limit(self):
+        storage = self.create_storage()
+        for n in range(1, 4):
+            storage.url(f"songs/{n}.mp3")
+        self.assertEqual(storage.url_cache_stats()["evictions"], 1)
+        storage.url("songs/3.mp3")
+        storage.url("songs/1.mp3")
+        stats = storage.url_cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 4, 2))
+
+    def test_short_expire_is_not_cached(self):
+        # a url valid for less than the margin would never be reused
+        self.storage.url("songs/1.mp3", expire=300)
+        self.storage.url("songs/1.mp3", expire=300)
+        self.assertEqual(self.storage.url_cache_stats()["size"], 0)
+
+
+class RequestTimingsTest(SimpleTestCase):
+
+    def test_slowest_statements_are_kept(self):
+        timings = RequestTimings(slow_statements=2)
+        for n, duration in enumerate((0.3, 0.1, 0.5, 0.2)):
+            timings.add_query(f"SELECT {n}", duration)
+        self.assertEqual(timings.queries, 4)
+        self.assertAlmostEqual(timings.sql, 1.1)
+        self.assertEqual(sorted(timings.statements, reverse=True), [(0.5, "SELECT 2"), (0.3, "SELECT 0")])
+
+    def test_nested_time_is_counted_once(self):
+        timings = RequestTimings(slow_statements=0)
+        token = current_timings.set(timings)
+        self.addCleanup(current_timings.reset, token)
+        clock = mock.patch("spotechnify_server.instrumentation.time")
+        now = clock.start().perf_counter
+        self.addCleanup(clock.stop)
+        # 10s serializing, 3s of which reading the storage and 2s running a query
+        now.return_value = 0
+        with timed('serialize'):
+            now.return_value = 1
+            with timed('storage'):
+                now.return_value = 4
+            timings.add_query("SELECT 1", 2)
+            now.return_value = 10
+        self.assertEqual((timings.serialize, timings.storage, timings.sql), (5, 3, 2))
+        self.assertEqual(timings.server_timing(12), 'sql;dur=2000.0;desc="1 queries", serialize;dur=5000.0, '
+                                                    'storage;dur=3000.0, app;dur=2000.0, total;dur=12000.0')
+
+
+class RequestTimingMiddlewareTest(TestCase):
+    """Server-Timing header, slow request log and per-route histograms of RequestTimingMiddleware
+    """
+
+    def setUp(self):
+        cache.clear()
+        histograms.reset()
+        self.addCleanup(histograms.reset)
+        self.user = CustomUser.objects.create_user(username="listener", email="listener@example.com",
+                                                   password="a-long-password")
+        self.admin = CustomUser.objects.create_user(username="admin", email="admin@example.com",
+                                                    password="a-long-password", is_staff=True)
+
+    def client_of(self, user: CustomUser) -> APIClient:
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(user).access_token}")
+        return client
+
+    def test_server_timing(self):
+        client = self.client_of(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/music/list/')
+        self.assertEqual(response.status_code, 200)
+        metrics = dict(re.findall(r"(\w+);dur=([\d.]+)", response['Server-Timing']))
+        self.assertEqual(list(metrics), ["sql", "serialize", "storage", "app", "total"])
+        self.assertIn(f'desc="{len(queries)} queries"', response['Server-Timing'])
+        self.assertGreater(float(metrics["total"]), 0)
+
+    @override_settings(REQUEST_TIMING_SLOW_MS=0)
+    def test_slow_request_is_logged_with_its_statements(self):
+        client = self.client_of(self.user)
+        with self.assertLogs('spotechnify_server.instrumentation', 'WARNING') as logs:
+            client.get('/music/list/?page_size=5')
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("Slow request GET /music/list/?page_size=5", logs.output[0])
+        self.assertIn("ms SELECT", logs.output[0])
+
+    @override_settings(REQUEST_TIMING_SLOW_MS=60_000)
+    def test_fast_request_is_not_logged(self):
+        client = self.client_of(self.user)
+        with self.assertNoLogs('spotechnify_server.instrumentation', 'WARNING'):
+            client.get('/music/list/')
+
+    def test_histograms(self):
+        client = self.client_of(self.user)
+        client.get('/music/list/')
+        client.get('/music/list/')
+        client.get('/not-a-route/')
+        routes = histograms.snapshot()["routes"]
+        self.assertEqual(routes["GET /music/list/"]["count"], 2)
+        self.assertEqual(sum(routes["GET /music/list/"]["latency_buckets"]), 2)
+        self.assertEqual(routes["GET <unresolved>"]["count"], 1)
+
+    def test_metrics_are_for_admins_only(self):
+        self.assertEqual(APIClient().get('/metrics/').status_code, 401)
+        self.assertEqual(self.client_of(self.user).get('/metrics/').status_code, 403)
+        self.assertEqual(self.client_of(self.user).delete('/metrics/').status_code, 403)
+        admin = self.client_of(self.admin)
+        self.client_of(self.user).get('/music/list/')
+        response = admin.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["routes"]["GET /music/list/"]["count"], 1)
+        self.assertEqual(admin.delete('/metrics/').status_code, 204)
+        self.assertNotIn("GET /music/list/", admin.get('/metrics/').json()["routes"])
@@ -17,10 +17,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.conf.urls.static import static
-from . import settings
+from . import settings, views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("auth/", include("authentication.urls")),
-    path("music/", include("music.urls"))
+    path("music/", include("music.urls")),
+    path("metrics/", views.MetricsAPIView.as_view())
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
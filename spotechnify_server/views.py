@@ -0,0 +1,27 @@
+from django.core.files.storage import default_storage
+from rest_framework import permissions, status, views
+from rest_framework.request import Request
+from rest_framework.response import Response
+from .admission import limiters, throttle_stats
+from .instrumentation import cache_stats, histograms
+
+
+class MetricsAPIView(views.APIView):
+    """per-route request timings and cache hit rates of this worker process (see RequestTimingMiddleware),
+       admins only, DELETE resets the timings
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request: Request) -> Response:
+        data = histograms.snapshot()
+        data["caches"] = {name: stats.snapshot() for name, stats in cache_stats.items()}
+        data["admission"] = {name: limiter.snapshot() for name, limiter in list(limiters.items())}
+        data["throttled"] = throttle_stats.snapshot()
+        url_cache_stats = getattr(default_storage, 'url_cache_stats', None)
+        if url_cache_stats is not None:
+            data["storage_url_cache"] = url_cache_stats()
+        return Response(data)
+
+    def delete(self, request: Request) -> Response:
+        histograms.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)